@@ -7,6 +7,8 @@ import celery
 from celery.result import TaskSetResult
 from django_extensions.db.fields import UUIDField
 
+from file_store.models import get_import_progress
+
 logger = logging.getLogger(__name__)
 
 
@@ -115,6 +117,18 @@ def get_task_group_state(task_group_id):
         return task_group_state
 
     for task in taskset.results:
+        # file import tasks publish their progress to a cheaper store
+        progress = get_import_progress(task.id)
+        if progress is not None:
+            if progress['state'] == celery.states.SUCCESS:
+                percent_done = 100
+            else:
+                percent_done = progress.get('percent_done') or 0
+            task_group_state.append({
+                'state': progress['state'],
+                'percent_done': percent_done,
+            })
+            continue
         # AsyncResult.info does not contain task state after task has finished
         if task.state == celery.states.SUCCESS:
             percent_done = 100
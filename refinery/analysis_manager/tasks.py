@@ -3,8 +3,13 @@ Created on Apr 5, 2012
 
 @author: nils
 '''
+from collections import defaultdict
 import logging
+import time
 import urlparse
+import uuid
+
+from django.core.cache import cache
 
 from bioblend import galaxy
 import celery
@@ -24,6 +29,44 @@ logger = logging.getLogger(__name__)
 
 RETRY_INTERVAL = 5  # seconds
 
+# the analysis monitor ticks every MONITOR_MIN_INTERVAL seconds while analyses
+# advance and backs off up to MONITOR_MAX_INTERVAL seconds while nothing
+# changes; every active analysis is checked at least that often
+MONITOR_MIN_INTERVAL = RETRY_INTERVAL
+MONITOR_MAX_INTERVAL = 60  # seconds
+MONITOR_LOCK_TIMEOUT = 10 * 60  # seconds
+MONITOR_ACTIVE_STATUSES = (Analysis.RUNNING_STATUS, Analysis.UNKNOWN_STATUS)
+
+_MONITOR_SCHEDULE_KEY = "analysis-monitor-schedule"
+_MONITOR_LOCK_KEY = "analysis-monitor-lock"
+_MONITOR_STATE_KEY = "analysis-monitor-state"
+_MONITOR_TICKS_KEY = "analysis-monitor-ticks"
+_MONITOR_COMPLETED_KEY = "analysis-monitor-completed"
+
+
+class AnalysisPending(Exception):
+    """Raised by a stage of an analysis run that has to wait for its tasks
+    or for the workflow to progress in Galaxy
+    """
+
+
+def _fail_analysis(analysis_uuid, error_msg):
+    """Set analysis status to failure in case of errors not handled in the
+    stages of the analysis run
+    """
+    logger.error(error_msg)
+    try:
+        analysis = Analysis.objects.get(uuid=analysis_uuid)
+    except (Analysis.DoesNotExist, Analysis.MultipleObjectsReturned) as e:
+        logger.error("Can not retrieve analysis with UUID '%s': '%s'",
+                     analysis_uuid, e)
+        return
+    else:
+        analysis.terminate_file_import_tasks()
+
+    logger.error("Setting status of analysis '%s' to failure", analysis)
+    analysis.set_status(Analysis.FAILURE_STATUS, error_msg)
+
 
 class AnalysisHandlerTask(Task):
     abstract = True
@@ -35,33 +78,23 @@ class AnalysisHandlerTask(Task):
         error_msg = "Monitoring task for analysis with UUID '{}' failed due " \
                     "to unexpected error: '{}: {}'".format(
                          args[0], einfo.type, einfo.exception)
-
-        logger.error(error_msg)
-        try:
-            analysis = Analysis.objects.get(uuid=args[0])
-        except (Analysis.DoesNotExist, Analysis.MultipleObjectsReturned) as e:
-            logger.error("Can not retrieve analysis with UUID '%s': '%s'",
-                         args[0], e)
-            return
-        else:
-            analysis.terminate_file_import_tasks()
-
-        logger.error("Setting status of analysis '%s' to failure", analysis)
-        analysis.set_status(Analysis.FAILURE_STATUS, error_msg)
+        _fail_analysis(args[0], error_msg)
 
 
-def _check_galaxy_history_state(analysis_uuid):
+def _check_galaxy_history_state(analysis_uuid, history=None):
     """
     Monitor the state of our Galaxy history from analysis.galaxy_progress().
     Fail the `run_analysis` task appropriately if we run into trouble.
     Update analysis_status.galaxy_history_progress &
     analysis_status.galaxy_history_state along the way
+    :param history: state of the Galaxy history if already fetched by the
+    analysis monitor
     """
     analysis = _get_analysis(analysis_uuid)
     analysis_status = _get_analysis_status(analysis_uuid)
 
     try:
-        percent_complete = analysis.galaxy_progress()
+        percent_complete = analysis.galaxy_progress(history)
     except RuntimeError:
         analysis_status.set_galaxy_history_state(AnalysisStatus.ERROR)
         error_msg = (
@@ -82,7 +115,7 @@ def _check_galaxy_history_state(analysis_uuid):
         analysis_status.set_galaxy_history_state(
             AnalysisStatus.UNKNOWN
         )
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
     else:
         # workaround to avoid moving the progress bar backward
         if analysis_status.galaxy_history_progress < percent_complete:
@@ -90,7 +123,7 @@ def _check_galaxy_history_state(analysis_uuid):
             analysis_status.save()
         if percent_complete < 100:
             analysis_status.set_galaxy_history_state(AnalysisStatus.PROGRESS)
-            run_analysis.retry(countdown=RETRY_INTERVAL)
+            raise AnalysisPending()
         else:
             analysis_status.set_galaxy_history_state(AnalysisStatus.OK)
 
@@ -184,14 +217,14 @@ def _galaxy_file_export(analysis_uuid):
             "Starting downloading of results from Galaxy for analysis "
             "'%s'", analysis)
         galaxy_export_taskset = TaskSet(
-            tasks=galaxy_export_tasks
+            tasks=_link_to_analysis_monitor(galaxy_export_tasks, analysis_uuid)
         ).apply_async()
         galaxy_export_taskset.save()
         analysis_status.galaxy_export_task_group_id = (
             galaxy_export_taskset.taskset_id
         )
         analysis_status.save()
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     # check if analysis results have finished downloading from Galaxy
     galaxy_export_taskset = get_taskset_result(
@@ -199,7 +232,7 @@ def _galaxy_file_export(analysis_uuid):
     )
     if not galaxy_export_taskset.ready():
         logger.debug("Results download pending for analysis '%s'", analysis)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
     # all tasks must have succeeded or failed
     elif not galaxy_export_taskset.successful():
         error_msg = ("Analysis '{}' failed while downloading results "
@@ -258,12 +291,14 @@ def _refinery_file_import(analysis_uuid):
             refinery_import_task = import_file.subtask((input_file_uuid,))
             refinery_import_tasks.append(refinery_import_task)
         refinery_import_taskset = TaskSet(
-            tasks=refinery_import_tasks).apply_async()
+            tasks=_link_to_analysis_monitor(refinery_import_tasks,
+                                            analysis_uuid)
+        ).apply_async()
         refinery_import_taskset.save()
         analysis_status.refinery_import_task_group_id = \
             refinery_import_taskset.taskset_id
         analysis_status.save()
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     # check if all files were successfully imported into Refinery
     refinery_import_taskset = get_taskset_result(
@@ -272,7 +307,7 @@ def _refinery_file_import(analysis_uuid):
     if not refinery_import_taskset.ready():
         logger.debug("Input file import pending for analysis '%s'",
                      analysis)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     elif not refinery_import_taskset.successful():
         error_msg = "Analysis '{}' failed during file import".format(
@@ -287,7 +322,8 @@ def _refinery_file_import(analysis_uuid):
 def run_analysis(analysis_uuid):
     """
     Manage file importing/exporting, execution, and Galaxy operations for
-    an Analysis
+    an Analysis: run the stages that can be run right away and hand the
+    analysis over to the analysis monitor, which advances it from then on
     """
     logger.info("Executing Analysis with UUID: ""%s", analysis_uuid)
 
@@ -298,15 +334,293 @@ def run_analysis(analysis_uuid):
         analysis.terminate_file_import_tasks()
         return
 
+    # stages must not run concurrently with a monitor tick
+    lock = _acquire_monitor_lock()
+    if lock is None:
+        run_analysis.retry(countdown=RETRY_INTERVAL)
+    try:
+        _run_analysis_stages(analysis_uuid)
+    except AnalysisPending:
+        pass
+    finally:
+        _release_monitor_lock(lock)
+    wake_analysis_monitor()
+
+
+def _acquire_monitor_lock():
+    """Returns the token of the monitor lock or None if it is held"""
+    lock = uuid.uuid4().hex
+    if cache.add(_MONITOR_LOCK_KEY, lock, MONITOR_LOCK_TIMEOUT):
+        return lock
+    return None
+
+
+def _release_monitor_lock(lock):
+    """Releases the monitor lock unless it expired and was taken by another
+    holder in the meantime
+    """
+    if cache.get(_MONITOR_LOCK_KEY) == lock:
+        cache.delete(_MONITOR_LOCK_KEY)
+    else:
+        logger.warning("Analysis monitor lock expired after %s seconds while "
+                       "held", MONITOR_LOCK_TIMEOUT)
+
+
+def _run_analysis_stages(analysis_uuid, galaxy_history=None):
+    """Advance an analysis as far as possible
+    :raises: AnalysisPending if a stage has to wait
+    """
     _get_analysis_status(analysis_uuid)
     _refinery_file_import(analysis_uuid)
     _run_galaxy_file_import(analysis_uuid)
     _run_galaxy_workflow(analysis_uuid)
-    _check_galaxy_history_state(analysis_uuid)
+    _check_galaxy_history_state(analysis_uuid, galaxy_history)
     _galaxy_file_export(analysis_uuid)
     _attach_workflow_outputs(analysis_uuid)
 
 
+def _get_monitor_event_key(analysis_uuid):
+    return "analysis-monitor-event-{}".format(analysis_uuid)
+
+
+def _link_to_analysis_monitor(tasks, analysis_uuid):
+    """Notify the analysis monitor when any of the tasks finishes"""
+    callback = notify_analysis_monitor.si(analysis_uuid)
+    for task_signature in tasks:
+        task_signature.link(callback)
+        task_signature.link_error(callback)
+    return tasks
+
+
+@task(ignore_result=True)
+def notify_analysis_monitor(analysis_uuid):
+    """Completion callback of the tasks started by the stages of an analysis:
+    the analysis gets advanced on the next tick of the monitor
+    """
+    cache.set(_get_monitor_event_key(analysis_uuid), True, None)
+    wake_analysis_monitor()
+
+
+def _schedule_analysis_monitor(countdown):
+    # ticks that were scheduled before are superseded
+    token = uuid.uuid4().hex
+    cache.set(_MONITOR_SCHEDULE_KEY,
+              {"token": token, "eta": time.time() + countdown}, None)
+    monitor_analyses.apply_async((token,), countdown=countdown)
+
+
+def wake_analysis_monitor():
+    """Make the analysis monitor tick within MONITOR_MIN_INTERVAL seconds
+    (events within that interval are handled by the same tick), unless a
+    tick is due sooner
+    """
+    schedule = cache.get(_MONITOR_SCHEDULE_KEY)
+    now = time.time()
+    if (schedule is None or
+            not now <= schedule["eta"] <= now + MONITOR_MIN_INTERVAL):
+        _schedule_analysis_monitor(MONITOR_MIN_INTERVAL)
+
+
+@task(ignore_result=True)
+def ensure_analysis_monitor():
+    """Periodic task that restarts the analysis monitor if its next tick got
+    lost, e.g. because a worker was shut down
+    """
+    schedule = cache.get(_MONITOR_SCHEDULE_KEY)
+    if (schedule is None or
+            schedule["eta"] < time.time() - MONITOR_MAX_INTERVAL):
+        if Analysis.objects.filter(
+                status__in=MONITOR_ACTIVE_STATUSES
+        ).exists():
+            _schedule_analysis_monitor(MONITOR_MIN_INTERVAL)
+
+
+@task(ignore_result=True)
+def monitor_analyses(token):
+    """
+    Advance all active analyses in a single loop. Analyses are advanced when
+    one of their tasks finished, when their Galaxy history changed, or at
+    least every MONITOR_MAX_INTERVAL seconds.
+    """
+    schedule = cache.get(_MONITOR_SCHEDULE_KEY)
+    if schedule is None or schedule["token"] != token:
+        return  # superseded by a more recent tick
+
+    lock = _acquire_monitor_lock()
+    if lock is None:
+        # the holder of the lock schedules the next tick when it is done
+        logger.debug("Analysis monitor is busy, skipping tick")
+        return
+    try:
+        interval = _monitor_tick()
+    finally:
+        _release_monitor_lock(lock)
+
+    if interval is None:
+        cache.delete(_MONITOR_SCHEDULE_KEY)
+    else:
+        _schedule_analysis_monitor(interval)
+
+
+def get_analysis_monitor_metrics():
+    ticks = cache.get(_MONITOR_TICKS_KEY) or 0
+    completed = cache.get(_MONITOR_COMPLETED_KEY) or 0
+    return {
+        "ticks": ticks,
+        "completed_analyses": completed,
+        "ticks_per_completed_analysis":
+            float(ticks) / completed if completed else None
+    }
+
+
+def _get_galaxy_history_states(analyses):
+    """Fetch the states of the Galaxy histories of the analyses with one
+    request per Galaxy instance
+    :returns: dict of history ID to a dict shaped like the return value of
+    HistoryClient.get_status()
+    """
+    analyses_by_instance = defaultdict(list)
+    for analysis in analyses:
+        analyses_by_instance[analysis.galaxy_instance().id].append(analysis)
+
+    history_states = {}
+    for instance_analyses in analyses_by_instance.values():
+        connection = instance_analyses[0].galaxy_connection()
+        try:
+            response = connection.make_get_request(
+                connection.histories.url,
+                params={"keys": "id,state,state_details"}
+            )
+            response.raise_for_status()
+            histories = response.json()
+        except Exception as exc:
+            # analyses query Galaxy individually
+            logger.warning("Could not fetch Galaxy histories from '%s': %s",
+                           instance_analyses[0].galaxy_instance(), exc)
+            continue
+        history_ids = set(analysis.history_id
+                          for analysis in instance_analyses)
+        for history in histories:
+            if history["id"] not in history_ids:
+                continue
+            state_details = history.get("state_details") or {}
+            total = sum(state_details.values())
+            history_states[history["id"]] = {
+                "state": history["state"],
+                "state_details": state_details,
+                "percent_complete":
+                    100 * state_details.get("ok", 0) // total if total else 0
+            }
+    return history_states
+
+
+def _galaxy_history_changed(history, analysis_status):
+    return (analysis_status is None or
+            history["state"] in ("ok", "error") or
+            history["state_details"].get("error", 0) > 0 or
+            history["percent_complete"] !=
+            analysis_status.galaxy_history_progress)
+
+
+def _monitor_tick():
+    """Advance the analyses that need it
+    :returns: seconds until the next tick or None if no analysis is active
+    """
+    analyses = list(
+        Analysis.objects.filter(
+            status__in=MONITOR_ACTIVE_STATUSES
+        ).select_related("workflow__workflow_engine__instance")
+    )
+    if not analyses:
+        return None
+
+    tick = core.utils.incr_cache_counter(_MONITOR_TICKS_KEY)
+    state = cache.get(_MONITOR_STATE_KEY) or {
+        "interval": MONITOR_MIN_INTERVAL, "last_steps": {}
+    }
+    analysis_statuses = {
+        analysis_status.analysis_id: analysis_status
+        for analysis_status in AnalysisStatus.objects.filter(
+            analysis__in=analyses
+        )
+    }
+    event_keys = dict((_get_monitor_event_key(analysis.uuid), analysis.uuid)
+                      for analysis in analyses)
+    events = cache.get_many(event_keys.keys())
+    cache.delete_many(events.keys())
+    notified = set(event_keys[key] for key in events)
+    history_states = _get_galaxy_history_states([
+        analysis for analysis in analyses if analysis.history_id and
+        getattr(analysis_statuses.get(analysis.id),
+                "galaxy_history_state", None) != AnalysisStatus.OK
+    ])
+
+    now = time.time()
+    advanced = 0
+    stepped = []
+    for analysis in analyses:
+        history = history_states.get(analysis.history_id)
+        last_step = state["last_steps"].get(analysis.uuid)
+        if last_step is None or analysis.uuid in notified or (
+                history is not None and _galaxy_history_changed(
+                    history, analysis_statuses.get(analysis.id))):
+            advanced += 1
+        elif now - last_step < MONITOR_MAX_INTERVAL:
+            continue
+        state["last_steps"][analysis.uuid] = now
+        stepped.append(analysis.uuid)
+        try:
+            _run_analysis_stages(analysis.uuid, history)
+        except AnalysisPending:
+            pass
+        except Exception as exc:
+            _fail_analysis(
+                analysis.uuid,
+                "Monitoring of analysis with UUID '{}' failed due to "
+                "unexpected error: '{}: {}'".format(
+                    analysis.uuid, type(exc).__name__, exc
+                )
+            )
+
+    still_active = set(Analysis.objects.filter(
+        uuid__in=stepped, status__in=MONITOR_ACTIVE_STATUSES
+    ).values_list("uuid", flat=True))
+    completed = [analysis for analysis in analyses
+                 if analysis.uuid in stepped and
+                 analysis.uuid not in still_active]
+    if completed:
+        core.utils.incr_cache_counter(_MONITOR_COMPLETED_KEY, len(completed))
+        for analysis in Analysis.objects.filter(
+                uuid__in=[analysis.uuid for analysis in completed],
+                status=Analysis.FAILURE_STATUS
+        ):
+            analysis.terminate_file_import_tasks()
+
+    active_uuids = set(analysis.uuid for analysis in analyses) - \
+        set(analysis.uuid for analysis in completed)
+    state["last_steps"] = dict(
+        (analysis_uuid, last_step)
+        for analysis_uuid, last_step in state["last_steps"].iteritems()
+        if analysis_uuid in active_uuids
+    )
+    if advanced:
+        state["interval"] = MONITOR_MIN_INTERVAL
+    else:
+        state["interval"] = min(state["interval"] * 2, MONITOR_MAX_INTERVAL)
+    cache.set(_MONITOR_STATE_KEY, state, None)
+
+    logger.info(
+        "Analysis monitor tick %s: %s active, %s advanced, %s checked, %s "
+        "completed analyses; %s ticks per completed analysis; next tick in "
+        "%s sec", tick, len(analyses), advanced, len(stepped), len(completed),
+        get_analysis_monitor_metrics()["ticks_per_completed_analysis"],
+        state["interval"]
+    )
+    if not active_uuids:
+        return None
+    return state["interval"]
+
+
 def _run_galaxy_file_import(analysis_uuid):
     analysis = _get_analysis(analysis_uuid)
     analysis_status = _get_analysis_status(analysis_uuid)
@@ -325,7 +639,7 @@ def _run_galaxy_file_import(analysis_uuid):
         galaxy_import_tasks = tool.get_galaxy_import_tasks()
 
         galaxy_file_import_taskset = TaskSet(
-            tasks=galaxy_import_tasks
+            tasks=_link_to_analysis_monitor(galaxy_import_tasks, analysis_uuid)
         ).apply_async()
 
         galaxy_file_import_taskset.save()
@@ -334,7 +648,7 @@ def _run_galaxy_file_import(analysis_uuid):
             galaxy_file_import_taskset.taskset_id
         )
         analysis_status.set_galaxy_import_state(AnalysisStatus.PROGRESS)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     # Check if data files were successfully imported into Galaxy
     galaxy_file_import_taskset = get_taskset_result(
@@ -342,7 +656,7 @@ def _run_galaxy_file_import(analysis_uuid):
     )
     if not galaxy_file_import_taskset.ready():
         logger.debug("Analysis '%s' pending in Galaxy", analysis)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
     elif not galaxy_file_import_taskset.successful():
         error_msg = "Analysis '{}' failed in Galaxy".format(analysis)
         logger.error(error_msg)
@@ -377,7 +691,8 @@ def _run_galaxy_workflow(analysis_uuid):
         ]
 
         galaxy_workflow_taskset = TaskSet(
-            tasks=galaxy_workflow_tasks
+            tasks=_link_to_analysis_monitor(galaxy_workflow_tasks,
+                                            analysis_uuid)
         ).apply_async()
 
         galaxy_workflow_taskset.save()
@@ -386,7 +701,7 @@ def _run_galaxy_workflow(analysis_uuid):
             galaxy_workflow_taskset.taskset_id
         )
         analysis_status.set_galaxy_history_state(AnalysisStatus.PROGRESS)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     # Check on the status of the running galaxy workflow
     galaxy_workflow_taskset = get_taskset_result(
@@ -394,7 +709,7 @@ def _run_galaxy_workflow(analysis_uuid):
     )
     if not galaxy_workflow_taskset.ready():
         logger.debug("Analysis '%s' pending in Galaxy", analysis)
-        run_analysis.retry(countdown=RETRY_INTERVAL)
+        raise AnalysisPending()
 
     elif not galaxy_workflow_taskset.successful():
         error_msg = "Analysis '{}' failed in Galaxy".format(analysis)
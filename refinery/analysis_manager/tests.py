@@ -1,8 +1,10 @@
 import json
+import time
 import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import RequestFactory, TestCase
 
 from bioblend.galaxy.client import ConnectionError
@@ -13,8 +15,10 @@ import mock
 
 from analysis_manager.models import AnalysisStatus
 from analysis_manager.tasks import (
+    MONITOR_MAX_INTERVAL, MONITOR_MIN_INTERVAL, AnalysisPending,
     _check_galaxy_history_state, _get_analysis, _get_analysis_status,
-    run_analysis
+    _monitor_tick, get_analysis_monitor_metrics, monitor_analyses,
+    notify_analysis_monitor, run_analysis
 )
 from analysis_manager.utils import (
     fetch_objects_required_for_analysis, validate_analysis_config
@@ -357,13 +361,12 @@ class AnalysisRunTests(AnalysisManagerTestBase):
     @mock.patch.object(Analysis, "galaxy_progress",
                        side_effect=ConnectionError("Couldn't establish "
                                                    "Galaxy connection"))
-    @mock.patch.object(run_analysis, "retry", side_effect=None)
     def test__check_galaxy_history_state_with_connection_error(
             self,
-            retry_mock,
             galaxy_progress_mock
     ):
-        _check_galaxy_history_state(self.analysis.uuid)
+        with self.assertRaises(AnalysisPending):
+            _check_galaxy_history_state(self.analysis.uuid)
 
         # Fetch analysis status since it has changed during
         # the course of this test and the old `self` reference is stale
@@ -373,17 +376,15 @@ class AnalysisRunTests(AnalysisManagerTestBase):
                          AnalysisStatus.UNKNOWN)
 
         self.assertTrue(galaxy_progress_mock.called)
-        self.assertTrue(retry_mock.called)
 
     @mock.patch.object(Analysis, "galaxy_progress", return_value=50)
-    @mock.patch.object(run_analysis, "retry", side_effect=None)
     def test__check_galaxy_history_state_progress_less_than_percent_complete(
             self,
-            retry_mock,
             galaxy_progress_mock
     ):
         self.analysis_status.galaxy_history_progress = 25
-        _check_galaxy_history_state(self.analysis.uuid)
+        with self.assertRaises(AnalysisPending):
+            _check_galaxy_history_state(self.analysis.uuid)
 
         analysis_status = AnalysisStatus.objects.get(analysis=self.analysis)
 
@@ -392,7 +393,6 @@ class AnalysisRunTests(AnalysisManagerTestBase):
                          AnalysisStatus.PROGRESS)
 
         self.assertTrue(galaxy_progress_mock.called)
-        self.assertTrue(retry_mock.called)
 
     @mock.patch.object(Analysis, "galaxy_progress", return_value=100)
     def test__check_galaxy_history_state_percent_complete_is_100(
@@ -421,6 +421,106 @@ class AnalysisRunTests(AnalysisManagerTestBase):
         self.assertTrue(update_state_mock.called)
 
 
+class AnalysisMonitorTests(AnalysisManagerTestBase):
+    def setUp(self):
+        super(AnalysisMonitorTests, self).setUp()
+        self.analysis.set_status(Analysis.RUNNING_STATUS)
+        self.cache = LocMemCache("analysis-monitor-test", {})
+        mock.patch("analysis_manager.tasks.cache", self.cache).start()
+        mock.patch("core.utils.cache", self.cache).start()
+        self.apply_async_mock = mock.patch.object(
+            monitor_analyses, "apply_async"
+        ).start()
+        self.run_stages_mock = mock.patch(
+            "analysis_manager.tasks._run_analysis_stages",
+            side_effect=AnalysisPending
+        ).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def set_monitor_state(self, interval, last_step=None):
+        self.cache.set("analysis-monitor-state", {
+            "interval": interval,
+            "last_steps": {self.analysis.uuid: last_step or time.time()}
+        })
+
+    def test_new_analysis_is_advanced(self):
+        self.assertEqual(_monitor_tick(), MONITOR_MIN_INTERVAL)
+        self.run_stages_mock.assert_called_once_with(self.analysis.uuid, None)
+
+    def test_unchanged_analysis_is_not_advanced_and_monitor_backs_off(self):
+        self.set_monitor_state(20)
+        self.assertEqual(_monitor_tick(), 40)
+        self.assertEqual(_monitor_tick(), MONITOR_MAX_INTERVAL)
+        self.assertFalse(self.run_stages_mock.called)
+
+    def test_unchanged_analysis_is_checked_after_max_interval(self):
+        self.set_monitor_state(MONITOR_MAX_INTERVAL,
+                               time.time() - MONITOR_MAX_INTERVAL)
+        self.assertEqual(_monitor_tick(), MONITOR_MAX_INTERVAL)
+        self.assertTrue(self.run_stages_mock.called)
+
+    def test_notified_analysis_is_advanced(self):
+        self.set_monitor_state(MONITOR_MAX_INTERVAL)
+        notify_analysis_monitor(self.analysis.uuid)
+        self.assertTrue(self.apply_async_mock.called)
+        self.assertEqual(_monitor_tick(), MONITOR_MIN_INTERVAL)
+        self.run_stages_mock.assert_called_once_with(self.analysis.uuid, None)
+
+    def test_analysis_is_advanced_on_galaxy_history_change(self):
+        self.analysis.history_id = "6fc9fbb81c497f69"
+        self.analysis.save()
+        self.analysis_status.galaxy_history_progress = 25
+        self.analysis_status.save()
+        self.set_monitor_state(MONITOR_MAX_INTERVAL)
+        history = {"state": "running",
+                   "state_details": {"ok": 1, "running": 1},
+                   "percent_complete": 50}
+        with mock.patch(
+            "analysis_manager.tasks._get_galaxy_history_states",
+            return_value={self.analysis.history_id: history}
+        ):
+            _monitor_tick()
+        self.run_stages_mock.assert_called_once_with(self.analysis.uuid,
+                                                     history)
+
+    def test_superseded_tick_is_skipped(self):
+        self.cache.set("analysis-monitor-schedule",
+                       {"token": "current", "eta": time.time()})
+        monitor_analyses("previous")
+        self.assertFalse(self.run_stages_mock.called)
+
+    def test_monitor_lock_is_released(self):
+        self.cache.set("analysis-monitor-schedule",
+                       {"token": "current", "eta": time.time()})
+        monitor_analyses("current")
+        self.assertIsNone(self.cache.get("analysis-monitor-lock"))
+
+    def test_expired_monitor_lock_of_other_holder_is_kept(self):
+        def take_over_expired_lock(*args):
+            self.cache.set("analysis-monitor-lock", "other holder")
+            raise AnalysisPending
+        self.run_stages_mock.side_effect = take_over_expired_lock
+        self.cache.set("analysis-monitor-schedule",
+                       {"token": "current", "eta": time.time()})
+        monitor_analyses("current")
+        self.assertEqual(self.cache.get("analysis-monitor-lock"),
+                         "other holder")
+
+    def test_ticks_per_completed_analysis(self):
+        self.run_stages_mock.side_effect = \
+            lambda analysis_uuid, history: self.analysis.set_status(
+                Analysis.SUCCESS_STATUS
+            )
+        self.assertIsNone(_monitor_tick())
+        self.assertEqual(get_analysis_monitor_metrics(), {
+            "ticks": 1,
+            "completed_analyses": 1,
+            "ticks_per_completed_analysis": 1.0
+        })
+
+
 class AnalysisStatusTests(AnalysisManagerTestBase):
     def test_set_galaxy_history_state_with_valid_state(self):
         self.analysis_status.set_galaxy_history_state(AnalysisStatus.PROGRESS)
@@ -0,0 +1,107 @@
+from __future__ import absolute_import
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from ...models import GenomeBuild, Gene, Taxon, bin_from_range
+from ...views import _filter_overlapping
+
+HG19_CHR1_SIZE = 249250621
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = """Time hg19 gene window queries with the previous chromosome range
+    conditions and with the UCSC bin index on a synthetic gene track in the
+    database; all changes are rolled back
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--genes',
+            type=int,
+            default=50000,
+            help="Number of genes on chr1"
+        )
+        parser.add_argument(
+            '--windows',
+            type=int,
+            default=500,
+            help="Number of random windows to query"
+        )
+        parser.add_argument(
+            '--window-size',
+            type=int,
+            default=1000000,
+            help="Size of the windows in bases"
+        )
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        try:
+            with transaction.atomic():
+                self._create_genes(options['genes'])
+                windows = []
+                for _ in range(options['windows']):
+                    start = random.randint(
+                        0, HG19_CHR1_SIZE - options['window_size']
+                    )
+                    windows.append((start, start + options['window_size']))
+
+                for name, query in (("range", self._range_query),
+                                    ("binned", self._binned_query)):
+                    start_time = time.time()
+                    count = sum(len(query(start, end))
+                                for start, end in windows)
+                    self.stdout.write(
+                        "{} query: {} windows, {} genes in {:.2f} sec".format(
+                            name, len(windows), count,
+                            time.time() - start_time
+                        )
+                    )
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def _create_genes(self, gene_count):
+        taxon, _ = Taxon.objects.get_or_create(
+            taxon_id=9606, name="Homo sapiens", type="scientific name"
+        )
+        genome_build, _ = GenomeBuild.objects.get_or_create(
+            name="hg19", defaults={"description": "hg19", "species": taxon}
+        )
+        genes = []
+        for index in range(gene_count):
+            # mostly short genes and a few very long ones
+            length = int(random.lognormvariate(9.5, 1.2))
+            start = random.randint(0, HG19_CHR1_SIZE - length)
+            end = start + length
+            genes.append(Gene(
+                genomebuild=genome_build, bin=bin_from_range(start, end),
+                name="gene {}".format(index), chrom="chr1", strand="+",
+                txStart=start, txEnd=end, cdsStart=start, cdsEnd=end,
+                exonCount=1, exonStarts=str(start), exonEnds=str(end),
+                score=0, name2="gene {}".format(index), cdsStartStat="cmpl",
+                cdsEndStat="cmpl", exonFrames="0"
+            ))
+        Gene.objects.bulk_create(genes, batch_size=1000)
+
+    def _range_query(self, start, end):
+        # conditions of the gene view before the bin index was added
+        return list(Gene.objects.filter(
+            Q(genomebuild__name="hg19"),
+            Q(chrom__iexact="chr1"),
+            Q(cdsStart__range=(start, end)) | Q(cdsEnd__range=(start, end))
+        ).values_list('id', flat=True))
+
+    def _binned_query(self, start, end):
+        return list(_filter_overlapping(
+            Gene, "hg19", "chr1", start, end, 'txStart', 'txEnd'
+        ).values_list('id', flat=True))
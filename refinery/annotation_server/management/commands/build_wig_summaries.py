@@ -0,0 +1,39 @@
+from __future__ import absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...models import ConservationTrackSummary, GCContentSummary
+
+SUMMARY_MODELS = {
+    'gc': GCContentSummary,
+    'conservation': ConservationTrackSummary,
+}
+
+
+class Command(BaseCommand):
+    help = """(Re)builds the zoom levels of the GC content and conservation
+    tracks used to answer requests for large windows
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--track',
+            choices=sorted(SUMMARY_MODELS),
+            action='append',
+            help="Track to summarize (default: all tracks)"
+        )
+        parser.add_argument(
+            '--genome',
+            default=None,
+            help="Only summarize this genome build, e.g. hg19"
+        )
+
+    def handle(self, *args, **options):
+        for track in options['track'] or sorted(SUMMARY_MODELS):
+            start = time.time()
+            count = SUMMARY_MODELS[track].rebuild(genome=options['genome'])
+            self.stdout.write("Created {} {} summaries in {:.1f} sec".format(
+                count, track, time.time() - start
+            ))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_server', '0002_annotation_server_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empiricalmappability',
+            name='bin',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='theoreticalmappability',
+            name='bin',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='conservationtrack',
+            index_together=set([('genomebuild', 'chrom', 'position')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='empiricalmappability',
+            index_together=set([('genomebuild', 'chrom', 'bin')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gapregionfile',
+            index_together=set([('genomebuild', 'chrom', 'bin')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gccontent',
+            index_together=set([('genomebuild', 'chrom', 'position')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gene',
+            index_together=set([('genomebuild', 'chrom', 'bin')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='theoreticalmappability',
+            index_together=set([('genomebuild', 'chrom', 'bin')]),
+        ),
+    ]
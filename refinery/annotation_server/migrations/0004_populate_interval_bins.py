@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations
+
+from annotation_server.models import bin_from_range
+
+UPDATE_BATCH_SIZE = 1000
+
+
+def populate_bins(apps, schema_editor):
+    """Assign the UCSC bin to existing mappability track features"""
+    for model_name in ['EmpiricalMappability', 'TheoreticalMappability']:
+        model = apps.get_model('annotation_server', model_name)
+        ids_by_bin = defaultdict(list)
+        for feature_id, start, end in model.objects.filter(
+                bin__isnull=True
+        ).values_list('id', 'chromStart', 'chromEnd').iterator():
+            ids_by_bin[bin_from_range(start, end)].append(feature_id)
+        for bin, feature_ids in ids_by_bin.iteritems():
+            for index in range(0, len(feature_ids), UPDATE_BATCH_SIZE):
+                model.objects.filter(
+                    id__in=feature_ids[index:index + UPDATE_BATCH_SIZE]
+                ).update(bin=bin)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_server', '0003_interval_bin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_bins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_server', '0004_populate_interval_bins'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConservationTrackSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('chrom', models.CharField(max_length=255)),
+                ('resolution', models.IntegerField()),
+                ('position', models.IntegerField()),
+                ('value', models.FloatField()),
+                ('minimum', models.FloatField()),
+                ('maximum', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('annot', models.ForeignKey(
+                    to='annotation_server.WigDescription')),
+                ('genomebuild', models.ForeignKey(
+                    default=None, to='annotation_server.GenomeBuild',
+                    null=True)),
+            ],
+            options={
+                'ordering': ['chrom', 'position'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='GCContentSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('chrom', models.CharField(max_length=255)),
+                ('resolution', models.IntegerField()),
+                ('position', models.IntegerField()),
+                ('value', models.FloatField()),
+                ('minimum', models.FloatField()),
+                ('maximum', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('annot', models.ForeignKey(
+                    to='annotation_server.WigDescription')),
+                ('genomebuild', models.ForeignKey(
+                    default=None, to='annotation_server.GenomeBuild',
+                    null=True)),
+            ],
+            options={
+                'ordering': ['chrom', 'position'],
+                'abstract': False,
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='conservationtracksummary',
+            index_together=set([
+                ('genomebuild', 'chrom', 'resolution', 'position')
+            ]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gccontentsummary',
+            index_together=set([
+                ('genomebuild', 'chrom', 'resolution', 'position')
+            ]),
+        ),
+    ]
@@ -1,9 +1,64 @@
 import logging
 
-from django.db import models
+from django.db import models, transaction
+
+import core
 
 logger = logging.getLogger(__name__)
 
+# UCSC standard binning scheme (Kent et al. 2002, "The Human Genome Browser
+# at UCSC"): bins of 128 kb, 1 Mb, 8 Mb, 64 Mb and 512 Mb covering
+# chromosomes up to 512 Mb, every feature is stored in the smallest bin that
+# contains it so overlap queries only need to look at a few dozen bins
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_MAX_END = 2 ** 29
+
+# bases summarized by each zoom level of the wiggle track summaries
+WIG_SUMMARY_RESOLUTIONS = [10, 100, 1000, 10000, 100000, 1000000]
+WIG_SUMMARY_BATCH_SIZE = 1000
+
+
+def bin_from_range(start, end):
+    """Returns the UCSC bin of a feature
+    :param start: zero-based start of the feature
+    :type start: int
+    :param end: end of the feature (exclusive)
+    :type end: int
+    :returns: int -- smallest bin that contains the feature
+    :raises: ValueError -- if the feature is outside of the binned range
+    """
+    if start < 0 or end > BIN_MAX_END or start > end:
+        raise ValueError("Range {}-{} can not be binned".format(start, end))
+    start_bin = start >> BIN_FIRST_SHIFT
+    end_bin = max(start, end - 1) >> BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start_bin == end_bin:
+            return offset + start_bin
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+
+
+def bins_overlapping_range(start, end):
+    """Returns the UCSC bins that can hold features overlapping a range
+    :param start: zero-based start of the range
+    :type start: int
+    :param end: end of the range (exclusive)
+    :type end: int
+    :returns: list -- bin numbers
+    """
+    start = max(0, start)
+    end = min(BIN_MAX_END, max(start + 1, end))
+    start_bin = start >> BIN_FIRST_SHIFT
+    end_bin = (end - 1) >> BIN_FIRST_SHIFT
+    bins = []
+    for offset in BIN_OFFSETS:
+        bins.extend(range(offset + start_bin, offset + end_bin + 1))
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+    return bins
+
 
 # CLASSES FOR Taxonomy Names
 class Taxon(models.Model):
@@ -173,6 +228,7 @@ class Gene (models.Model):
 
     class Meta:
         ordering = ['chrom', 'txStart']
+        index_together = [('genomebuild', 'chrom', 'bin')]
 
 
 class GapRegionFile(models.Model):
@@ -195,6 +251,7 @@ class GapRegionFile(models.Model):
 
     class Meta:
         ordering = ['chrom', 'chromStart']
+        index_together = [('genomebuild', 'chrom', 'bin')]
 
 
 class WigDescription(models.Model):
@@ -230,14 +287,21 @@ class BedFile (models.Model):
     blockCount = models.IntegerField(null=True)
     blockSizes = models.CommaSeparatedIntegerField(max_length=3700)
     blockStarts = models.CommaSeparatedIntegerField(max_length=3700)
+    bin = models.IntegerField(null=True)
 
     def __unicode__(self):
         return self.name + " - " + self.chrom + ":" \
                + self.chromStart + "-" + self.chromEnd
 
+    def save(self, *args, **kwargs):
+        if self.bin is None:
+            self.bin = bin_from_range(self.chromStart, self.chromEnd)
+        super(BedFile, self).save(*args, **kwargs)
+
     class Meta:
         abstract = True
         ordering = ['chrom', 'chromStart']
+        index_together = [('genomebuild', 'chrom', 'bin')]
 
 
 class GffFile (models.Model):
@@ -297,6 +361,128 @@ class WigFile(models.Model):
     class Meta:
         abstract = True
         ordering = ['chrom', 'position']
+        index_together = [('genomebuild', 'chrom', 'position')]
+
+
+class WigSummary(models.Model):
+    """Abstract Base class for the zoom levels of a wiggle track: min, max
+    and mean of the values in consecutive windows of `resolution` bases,
+    similar to the zoom levels of bigWig files
+    """
+    genomebuild = models.ForeignKey('GenomeBuild', null=True, default=None)
+    annot = models.ForeignKey(WigDescription)
+    chrom = models.CharField(max_length=255)
+    resolution = models.IntegerField()
+    position = models.IntegerField()
+    value = models.FloatField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+    count = models.IntegerField()
+
+    # WigFile model whose values are summarized
+    track_model = None
+
+    def __unicode__(self):
+        return "{}:{} ({} bp) = {}".format(self.chrom, self.position,
+                                           self.resolution, self.value)
+
+    class Meta:
+        abstract = True
+        ordering = ['chrom', 'position']
+        index_together = [
+            ('genomebuild', 'chrom', 'resolution', 'position')
+        ]
+
+    @classmethod
+    def _get_generation_key(cls):
+        return '{}-generation'.format(cls.__name__)
+
+    @classmethod
+    def get_generation(cls):
+        """Returns the generation of the summaries, which namespaces cached
+        responses so that they are dropped when the summaries are rebuilt
+        """
+        return core.utils.get_cache_generation(cls._get_generation_key())
+
+    @classmethod
+    def rebuild(cls, genome=None):
+        """Replaces the summaries with ones computed in a single pass over
+        the values of the track
+        :param genome: only rebuild the summaries of this genome build
+        :type genome: string
+        :returns: int -- number of summaries created
+        """
+        values = cls.track_model.objects.all()
+        summaries = cls.objects.all()
+        if genome is not None:
+            values = values.filter(genomebuild__name=genome)
+            summaries = summaries.filter(genomebuild__name=genome)
+
+        created = [0]
+        batch = []
+
+        def add(summary):
+            summary.value = summary.total / summary.count
+            batch.append(summary)
+            if len(batch) == WIG_SUMMARY_BATCH_SIZE:
+                flush()
+
+        def flush():
+            cls.objects.bulk_create(batch)
+            created[0] += len(batch)
+            del batch[:]
+
+        with transaction.atomic():
+            summaries.delete()
+            current = {}  # resolution -> summary being accumulated
+            for genomebuild_id, annot_id, chrom, position, value in \
+                    values.order_by(
+                        'genomebuild', 'annot', 'chrom', 'position'
+                    ).values_list('genomebuild_id', 'annot_id', 'chrom',
+                                  'position', 'value').iterator():
+                for resolution in WIG_SUMMARY_RESOLUTIONS:
+                    start = position // resolution * resolution
+                    summary = current.get(resolution)
+                    if summary is None or (
+                        summary.genomebuild_id, summary.annot_id,
+                        summary.chrom, summary.position
+                    ) != (genomebuild_id, annot_id, chrom, start):
+                        if summary is not None:
+                            add(summary)
+                        summary = cls(
+                            genomebuild_id=genomebuild_id, annot_id=annot_id,
+                            chrom=chrom, resolution=resolution,
+                            position=start, minimum=value, maximum=value,
+                            count=0
+                        )
+                        summary.total = 0.0
+                        current[resolution] = summary
+                    summary.minimum = min(summary.minimum, value)
+                    summary.maximum = max(summary.maximum, value)
+                    summary.total += value
+                    summary.count += 1
+            for resolution in WIG_SUMMARY_RESOLUTIONS:
+                if resolution in current:
+                    add(current[resolution])
+            flush()
+        core.utils.bump_cache_generation(cls._get_generation_key())
+        return created[0]
+
+
+def get_wig_summary_resolution(start, end, width):
+    """Returns the zoom level to draw a window of a wiggle track with
+    :param width: number of values the client can display (pixels)
+    :type width: int
+    :returns: int -- finest resolution that gives at most one value per
+    pixel, or None if the values themselves should be returned
+    """
+    bases_per_value = float(end - start) / max(1, width)
+    if bases_per_value <= 1:
+        return None
+    for resolution in WIG_SUMMARY_RESOLUTIONS:
+        if resolution >= bases_per_value:
+            return resolution
+    return WIG_SUMMARY_RESOLUTIONS[-1]
 
 
 # Models derived from other models
@@ -321,6 +507,16 @@ class ConservationTrack(WigFile):
     annot = models.ForeignKey(WigDescription)
 
 
+class GCContentSummary(WigSummary):
+    """Zoom levels of the GC Content annotation track"""
+    track_model = GCContent
+
+
+class ConservationTrackSummary(WigSummary):
+    """Zoom levels of the Conserved region annotation track"""
+    track_model = ConservationTrack
+
+
 # CLASSES FOR extra tables
 
 class hg19_GenCode(GtfFile):
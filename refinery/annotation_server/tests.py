@@ -0,0 +1,207 @@
+import json
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+import mock
+
+from .models import (BIN_MAX_END, GCContent, GCContentSummary, GenomeBuild,
+                     Taxon, TheoreticalMappability, WigDescription,
+                     bin_from_range, bins_overlapping_range,
+                     get_wig_summary_resolution)
+from .views import _filter_overlapping, _get_wig_track_response
+
+
+def create_genome_build():
+    taxon = Taxon.objects.create(taxon_id=1, name='Test species',
+                                 type='scientific name')
+    return GenomeBuild.objects.create(name='testgenome',
+                                      description='Test genome', species=taxon)
+
+
+def create_wig_description(genome_build, name='GC'):
+    return WigDescription.objects.create(
+        genomebuild=genome_build, annotation_type='gc', name=name,
+        altColor='', color='', visibility='', priority=0, type='wig',
+        description=''
+    )
+
+
+class BinningTests(SimpleTestCase):
+    def test_bin_of_feature_in_first_128kb(self):
+        self.assertEqual(bin_from_range(0, 2 ** 17), 585)
+
+    def test_bin_of_feature_in_second_128kb(self):
+        self.assertEqual(bin_from_range(2 ** 17, 2 ** 18), 586)
+
+    def test_bin_of_feature_across_128kb_boundary(self):
+        self.assertEqual(bin_from_range(2 ** 17 - 1, 2 ** 17 + 1), 73)
+
+    def test_bin_of_empty_feature(self):
+        self.assertEqual(bin_from_range(2 ** 17, 2 ** 17), 586)
+
+    def test_bin_of_whole_binned_range(self):
+        self.assertEqual(bin_from_range(0, BIN_MAX_END), 0)
+
+    def test_bin_of_range_that_can_not_be_binned(self):
+        for start, end in [(-1, 10), (0, BIN_MAX_END + 1), (10, 9)]:
+            self.assertRaises(ValueError, bin_from_range, start, end)
+
+    def test_bins_overlapping_first_128kb(self):
+        self.assertEqual(bins_overlapping_range(0, 2 ** 17),
+                         [585, 73, 9, 1, 0])
+
+    def test_bins_overlapping_range_across_128kb_boundary(self):
+        self.assertEqual(bins_overlapping_range(2 ** 17 - 1, 2 ** 17 + 1),
+                         [585, 586, 73, 9, 1, 0])
+
+    def test_bins_overlapping_range_include_bin_of_spanning_feature(self):
+        spanning_bin = bin_from_range(100000, 300000)
+        self.assertIn(spanning_bin, bins_overlapping_range(140000, 150000))
+
+    def test_bins_overlapping_range_are_clipped(self):
+        self.assertEqual(bins_overlapping_range(-10, 0), [585, 73, 9, 1, 0])
+        self.assertEqual(bins_overlapping_range(0, BIN_MAX_END + 1)[-1], 0)
+
+
+class FilterOverlappingTests(TestCase):
+    def setUp(self):
+        self.genome_build = create_genome_build()
+        for name, chrom, start, end in [
+            ('spanning', 'chr1', 0, 1000000),
+            ('inside', 'chr1', 145000, 146000),
+            ('at end', 'chr1', 150000, 150100),
+            ('before', 'chr1', 100, 200),
+            ('after', 'chr1', 200000, 200100),
+            ('other chromosome', 'chr2', 145000, 146000)
+        ]:
+            TheoreticalMappability.objects.create(
+                genomebuild=self.genome_build, chrom=chrom, chromStart=start,
+                chromEnd=end, name=name
+            )
+
+    def test_filter_overlapping(self):
+        features = _filter_overlapping(TheoreticalMappability, 'testgenome',
+                                       'chr1', '140000', '150000')
+        self.assertEqual(
+            sorted(features.values_list('name', flat=True)),
+            ['at end', 'inside', 'spanning']
+        )
+
+
+class WigSummaryResolutionTests(SimpleTestCase):
+    def test_values_if_there_is_a_pixel_per_base(self):
+        self.assertIsNone(get_wig_summary_resolution(0, 100, 100))
+        self.assertIsNone(get_wig_summary_resolution(0, 100, 200))
+
+    def test_finest_resolution_with_a_value_per_pixel(self):
+        self.assertEqual(get_wig_summary_resolution(0, 1000, 100), 10)
+        self.assertEqual(get_wig_summary_resolution(0, 1000, 99), 100)
+
+    def test_coarsest_resolution_for_large_windows(self):
+        self.assertEqual(get_wig_summary_resolution(0, 10 ** 9, 10), 10 ** 6)
+
+    def test_zero_width(self):
+        self.assertEqual(get_wig_summary_resolution(0, 50, 0), 100)
+
+
+class WigSummaryRebuildTests(TestCase):
+    def setUp(self):
+        genome_build = create_genome_build()
+        self.annot = create_wig_description(genome_build)
+        self.other_annot = create_wig_description(genome_build, 'Other GC')
+        values = (
+            [(self.annot, 'chr1', position, position)
+             for position in range(15)] +
+            [(self.annot, 'chr2', position, -position)
+             for position in range(5, 15)] +
+            [(self.other_annot, 'chr1', position, 1)
+             for position in range(10)]
+        )
+        GCContent.objects.bulk_create(
+            GCContent(genomebuild=genome_build, annot=annot, chrom=chrom,
+                      position=position, value=value)
+            for annot, chrom, position, value in values
+        )
+
+    def get_summaries(self, resolution):
+        return [
+            (summary.annot, summary.chrom, summary.position,
+             summary.minimum, summary.maximum, summary.value, summary.count)
+            for summary in GCContentSummary.objects.filter(
+                resolution=resolution
+            ).order_by('annot', 'chrom', 'position')
+        ]
+
+    @mock.patch('annotation_server.models.WIG_SUMMARY_BATCH_SIZE', 3)
+    def test_rebuild(self):
+        # five summaries at 10 bp and three at each of the other resolutions
+        self.assertEqual(GCContentSummary.rebuild(), 20)
+        self.assertEqual(self.get_summaries(10), [
+            (self.annot, 'chr1', 0, 0, 9, 4.5, 10),
+            (self.annot, 'chr1', 10, 10, 14, 12, 5),
+            (self.annot, 'chr2', 0, -9, -5, -7, 5),
+            (self.annot, 'chr2', 10, -14, -10, -12, 5),
+            (self.other_annot, 'chr1', 0, 1, 1, 1, 10)
+        ])
+        self.assertEqual(self.get_summaries(100), [
+            (self.annot, 'chr1', 0, 0, 14, 7, 15),
+            (self.annot, 'chr2', 0, -14, -5, -9.5, 10),
+            (self.other_annot, 'chr1', 0, 1, 1, 1, 10)
+        ])
+
+    def test_rebuild_replaces_summaries(self):
+        GCContentSummary.rebuild()
+        self.assertEqual(GCContentSummary.rebuild(), 20)
+        self.assertEqual(GCContentSummary.objects.count(), 20)
+
+
+class WigTrackResponseTests(TestCase):
+    def setUp(self):
+        self.cache = LocMemCache('annotation-server', {})
+        for module in ('core.utils', 'annotation_server.views'):
+            cache_patcher = mock.patch(module + '.cache', self.cache)
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
+        self.genome_build = create_genome_build()
+        annot = create_wig_description(self.genome_build)
+        GCContent.objects.bulk_create(
+            GCContent(genomebuild=self.genome_build, annot=annot,
+                      chrom='chr1', position=position, value=position)
+            for position in range(100)
+        )
+
+    def get_track(self, width):
+        request = RequestFactory().get('/', {'width': width})
+        response = _get_wig_track_response(
+            request, 'gc', GCContent, GCContentSummary, 'testgenome', 'chr1',
+            '0', '99'
+        )
+        return json.loads(response.content)
+
+    def test_summaries_are_returned(self):
+        GCContentSummary.rebuild()
+        summaries = self.get_track(5)
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0]['position'], 0)
+        self.assertEqual(summaries[0]['minimum'], 0)
+        self.assertEqual(summaries[0]['maximum'], 99)
+        self.assertEqual(summaries[0]['value'], 49.5)
+
+    def test_values_are_returned_if_summaries_were_not_built(self):
+        self.assertEqual(len(self.get_track(5)), 100)
+
+    def test_rebuild_drops_cached_summaries(self):
+        GCContentSummary.rebuild()
+        self.get_track(5)
+        GCContent.objects.update(value=0)
+        GCContentSummary.rebuild()
+        self.assertEqual(self.get_track(5)[0]['maximum'], 0)
+
+    def test_invalid_width(self):
+        request = RequestFactory().get('/', {'width': 'wide'})
+        response = _get_wig_track_response(
+            request, 'gc', GCContent, GCContentSummary, 'testgenome', 'chr1',
+            '0', '99'
+        )
+        self.assertEqual(response.status_code, 400)
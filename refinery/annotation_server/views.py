@@ -2,14 +2,98 @@ from decimal import Decimal
 import json
 import logging
 
+from django.core.cache import cache
 from django.db import connection
 from django.db.models import Q
 from django.http import HttpResponse, JsonResponse
 
+from .models import (ConservationTrack, ConservationTrackSummary,
+                     EmpiricalMappability, GapRegionFile, GCContent,
+                     GCContentSummary, Gene, TheoreticalMappability,
+                     bins_overlapping_range, get_wig_summary_resolution)
 from .utils import GAP_REGIONS, MAPPABILITY_THEORETICAL, SUPPORTED_GENOMES
 
 logger = logging.getLogger(__name__)
 
+# annotation tracks only change when they are re-imported
+ANNOTATION_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+
+def _get_track_response(track, genome, chrom, start, end, get_values,
+                        fallback=None):
+    """Returns the JSON of a track within a window of a chromosome, cached
+    by (track, genome, chrom, window)
+    :param get_values: callable returning the ValuesQuerySet of the window
+    :param fallback: optional callable returning the response if the window
+    has no values, which is not cached
+    """
+    cache_key = "annotation-{}-{}-{}-{}-{}".format(track, genome, chrom,
+                                                   start, end)
+    content = cache.get(cache_key)
+    if content is None:
+        values = list(get_values())
+        if not values and fallback is not None:
+            return fallback()
+        content = ValuesQuerySetToDict(values)
+        cache.set(cache_key, content, ANNOTATION_CACHE_TIMEOUT)
+    return HttpResponse(content, content_type="application/json")
+
+
+def _filter_overlapping(model, genome, chrom, start, end,
+                        start_field='chromStart', end_field='chromEnd'):
+    """Returns the features of a binned track overlapping a window
+    Only the UCSC bins that can hold overlapping features are searched, so
+    the lookup is an index range scan on (genomebuild, chrom, bin) and
+    features spanning the whole window are included
+    """
+    start = int(start)
+    end = int(end)
+    return model.objects.filter(
+        genomebuild__name=genome,
+        chrom=chrom,
+        bin__in=bins_overlapping_range(max(0, start - 1), end + 1),
+        **{start_field + '__lte': end, end_field + '__gte': start}
+    )
+
+
+def _get_wig_track_response(request, track, model, summary_model, genome,
+                            chrom, start, end):
+    """Returns the values of a wiggle track within a window, or the min, max
+    and mean of the zoom level matching the `width` query parameter (number
+    of pixels the window is drawn on) so that large windows give responses
+    of bounded size
+    """
+    try:
+        width = int(request.GET['width'])
+    except KeyError:
+        resolution = None
+    except ValueError:
+        return HttpResponse(status=400)
+    else:
+        resolution = get_wig_summary_resolution(int(start), int(end), width)
+
+    def get_track_response():
+        return _get_track_response(
+            track, genome, chrom, start, end,
+            lambda: model.objects.filter(
+                genomebuild__name=genome, chrom=chrom,
+                position__range=(start, end)
+            ).values('chrom', 'position', 'value')
+        )
+
+    if resolution is None:
+        return get_track_response()
+    # summaries that were not built yet fall back to the values of the track
+    return _get_track_response(
+        '{}-{}-{}'.format(track, resolution, summary_model.get_generation()),
+        genome, chrom, start, end,
+        lambda: summary_model.objects.filter(
+            genomebuild__name=genome, chrom=chrom, resolution=resolution,
+            position__range=(int(start) // resolution * resolution, end)
+        ).values('chrom', 'position', 'value', 'minimum', 'maximum'),
+        fallback=get_track_response
+    )
+
 
 def search_genes(request, genome, search_string):
     """Function for searching basic gene table currently:
@@ -104,30 +188,29 @@ def get_genes(request, genome, chrom, start, end):
                  "%s chromosome: %s", genome, chrom)
 
     if genome in SUPPORTED_GENOMES:
-        current_table = globals()[genome + "_EnsGene"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(cdsStart__range=(start, end)) | Q(cdsEnd__range=(start, end))
-        ).values('name', 'chrom', 'strand', 'txStart', 'txEnd', 'cdsStart',
-                 'cdsEnd', 'exonCount', 'exonStarts', 'exonEnds')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_track_response(
+            'genes', genome, chrom, start, end,
+            lambda: _filter_overlapping(
+                Gene, genome, chrom, start, end, 'txStart', 'txEnd'
+            ).values('name', 'chrom', 'strand', 'txStart', 'txEnd',
+                     'cdsStart', 'cdsEnd', 'exonCount', 'exonStarts',
+                     'exonEnds')
+        )
     return HttpResponse(status=400)
 
 
 def get_gc(request, genome, chrom, start, end):
-    """gets GC content within a range i.e. gene start, cds, gene symbol"""
+    """gets GC content within a range i.e. gene start, cds, gene symbol
+    summarized to at most `width` values if the query parameter is given
+    """
     logger.debug("annotation_server.get_gc called for genome: "
                  "%s chromosome: %s:%s-%s", genome, chrom, start, end)
 
     if genome in SUPPORTED_GENOMES:
-        current_table = globals()[genome + "_GC"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(position__range=(start, end)),
-        ).values('chrom', 'position', 'value')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_wig_track_response(
+            request, 'gc', GCContent, GCContentSummary, genome, chrom, start,
+            end
+        )
     return HttpResponse(status=400)
 
 
@@ -139,13 +222,12 @@ def get_maptheo(request, genome, chrom, start, end):
                  "%s chromosome: %s:%s-%s", genome, chrom, start, end)
 
     if genome in MAPPABILITY_THEORETICAL:
-        current_table = globals()[genome + "_MappabilityTheoretical"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(chromStart__range=(start, end)) | Q(chromEnd__range=(start, end))
-        ).values('chrom', 'chromStart', 'chromEnd')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_track_response(
+            'maptheo', genome, chrom, start, end,
+            lambda: _filter_overlapping(
+                TheoreticalMappability, genome, chrom, start, end
+            ).values('chrom', 'chromStart', 'chromEnd')
+        )
     return HttpResponse(status=400)
 
 
@@ -156,29 +238,27 @@ def get_mapemp(request, genome, chrom, start, end):
                  "%s chromosome: %s:%s-%s", genome, chrom, start, end)
 
     if genome in SUPPORTED_GENOMES:
-        current_table = globals()[genome + "_MappabilityEmpirial"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(chromStart__range=(start, end)) | Q(chromEnd__range=(start, end))
-        ).values('chrom', 'chromStart', 'chromEnd')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_track_response(
+            'mapemp', genome, chrom, start, end,
+            lambda: _filter_overlapping(
+                EmpiricalMappability, genome, chrom, start, end
+            ).values('chrom', 'chromStart', 'chromEnd')
+        )
     return HttpResponse(status=400)
 
 
 def get_conservation(request, genome, chrom, start, end):
-    """gets Conservation annotation scores within a range"""
+    """gets Conservation annotation scores within a range
+    summarized to at most `width` values if the query parameter is given
+    """
     logger.debug("annotation_server.get_conservation called for genome: "
                  "%s chromosome: %s:%s-%s", genome, chrom, start, end)
 
     if genome in SUPPORTED_GENOMES:
-        current_table = globals()[genome + "_Conservation"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(position__range=(start, end)),
-        ).values('chrom', 'position', 'value')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_wig_track_response(
+            request, 'conservation', ConservationTrack,
+            ConservationTrackSummary, genome, chrom, start, end
+        )
     return HttpResponse(status=400)
 
 
@@ -189,15 +269,13 @@ def get_gapregion(request, genome, chrom, start, end):
                  "%s chromosome: %s:%s-%s", genome, chrom, start, end)
 
     if genome in GAP_REGIONS:
-        current_table = globals()[genome + "_GapRegions"]
-        curr_vals = current_table.objects.filter(
-            Q(chrom__iexact=chrom),
-            Q(chromStart__gte=start),
-            Q(chromStart__range=(start, end)) | Q(chromEnd__range=(start, end))
-        ).values('bin', 'chromStart', 'chromEnd', 'ix', 'n', 'size', 'type',
-                 'bridge')
-        data = ValuesQuerySetToDict(curr_vals)
-        return JsonResponse(data)
+        return _get_track_response(
+            'gapregion', genome, chrom, start, end,
+            lambda: _filter_overlapping(
+                GapRegionFile, genome, chrom, start, end
+            ).values('bin', 'chromStart', 'chromEnd', 'ix', 'n', 'size',
+                     'type', 'bridge')
+        )
     return HttpResponse(status=400)
 
 
@@ -220,4 +298,4 @@ def ValuesQuerySetToDict(vqs):
     Based on http://djangosnippets.org/snippets/2454/
     """
     ret = [item for item in vqs]
-    return json.dumps(ret, indent=4)
+    return json.dumps(ret, separators=(',', ':'))
@@ -341,6 +341,13 @@ CELERYBEAT_SCHEDULE = {
             'expires': 20,  # seconds
         }
     },
+    'ensure_analysis_monitor': {
+        'task': 'analysis_manager.tasks.ensure_analysis_monitor',
+        'schedule': timedelta(seconds=60),
+        'options': {
+            'expires': 30,  # seconds
+        }
+    },
 }
 
 CHUNKED_UPLOAD_ABSTRACT_MODEL = False
@@ -392,6 +399,19 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = get_setting('FILE_UPLOAD_MAX_MEMORY_SIZE',
 # format: {'pattern': 'replacement'} - may contain more than one key-value pair
 REFINERY_FILE_SOURCE_MAP = get_setting("REFINERY_FILE_SOURCE_MAP")
 
+# number of concurrent ranged requests used to download a file from a URL or
+# S3 during import (1 disables parallel downloads)
+REFINERY_FILE_IMPORT_PARALLEL_RANGES = get_setting(
+    "REFINERY_FILE_IMPORT_PARALLEL_RANGES", local_settings, 1)
+
+# progress of file transfers is published to the shared progress store at most
+# every REFINERY_FILE_IMPORT_PROGRESS_INTERVAL seconds and to the Celery result
+# backend when it has advanced by REFINERY_FILE_IMPORT_PROGRESS_STEP percent
+REFINERY_FILE_IMPORT_PROGRESS_INTERVAL = get_setting(
+    "REFINERY_FILE_IMPORT_PROGRESS_INTERVAL", local_settings, 5)
+REFINERY_FILE_IMPORT_PROGRESS_STEP = get_setting(
+    "REFINERY_FILE_IMPORT_PROGRESS_STEP", local_settings, 5)
+
 # data file import directory; it should be located on the same partition as
 # FILE_STORE_DIR and MEDIA_ROOT to make import operations fast
 REFINERY_DATA_IMPORT_DIR = get_setting("REFINERY_DATA_IMPORT_DIR")
@@ -403,6 +423,11 @@ REFINERY_SOLR_BASE_URL = get_setting("REFINERY_SOLR_BASE_URL")
 REFINERY_SOLR_SPACE_DYNAMIC_FIELDS = get_setting(
     "REFINERY_SOLR_SPACE_DYNAMIC_FIELDS")
 
+# number of Node or DataSet documents posted to Solr per request when indexing
+# in bulk
+REFINERY_SOLR_INDEX_BATCH_SIZE = get_setting(
+    "REFINERY_SOLR_INDEX_BATCH_SIZE", local_settings, 500)
+
 HAYSTACK_CONNECTIONS = {
     'default': {
         # Haystack requires a default, but there's less risk of confusion
@@ -467,6 +492,10 @@ REFINERY_BANNER_ANONYMOUS_ONLY = get_setting("REFINERY_BANNER_ANONYMOUS_ONLY")
 # Deletion options are ALWAYS, ON_SUCCESS, and NEVER
 REFINERY_GALAXY_ANALYSIS_CLEANUP = get_setting(
     "REFINERY_GALAXY_ANALYSIS_CLEANUP")
+# maximum number of API requests sent to a Galaxy instance at the same time
+# when fetching dataset and job metadata for an analysis
+REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS = get_setting(
+    "REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS", local_settings, 8)
 # Subject and message body of the welcome email sent to new users
 REFINERY_WELCOME_EMAIL_SUBJECT = get_setting("REFINERY_WELCOME_EMAIL_SUBJECT")
 REFINERY_WELCOME_EMAIL_MESSAGE = get_setting("REFINERY_WELCOME_EMAIL_MESSAGE")
@@ -596,6 +625,11 @@ REFINERY_URL_SCHEME = get_setting("REFINERY_URL_SCHEME")
 REFINERY_AUXILIARY_FILE_GENERATION = get_setting(
     "REFINERY_AUXILIARY_FILE_GENERATION")
 
+# Build the node graph of ISA-Tab files in memory and insert it with bulk
+# queries instead of saving nodes and attributes one at a time
+REFINERY_ISA_TAB_BULK_IMPORT = get_setting(
+    "REFINERY_ISA_TAB_BULK_IMPORT", local_settings, False)
+
 REFINERY_TUTORIAL_STEPS = refinery_tutorial_settings
 
 ANONYMOUS_USER_ID = -1
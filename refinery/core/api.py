@@ -9,6 +9,7 @@ from datetime import timedelta
 import json
 import logging
 from sets import Set
+import urllib
 import uuid
 
 from django.conf import settings
@@ -19,12 +20,13 @@ from django.contrib.sites.models import get_current_site
 from django.core.cache import cache
 from django.core.mail import EmailMessage
 from django.core.signing import Signer
+from django.db.models import Count
 from django.forms import ValidationError
 from django.template import loader
 from django.utils import timezone
 
-from constants import UUID_RE
-from guardian.models import GroupObjectPermission
+from constants import NOT_AVAILABLE, UUID_RE
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from guardian.shortcuts import get_objects_for_group, get_objects_for_user
 from guardian.utils import get_anonymous_user
 from tastypie import fields
@@ -32,22 +34,25 @@ from tastypie.authentication import Authentication, SessionAuthentication
 from tastypie.authorization import Authorization
 from tastypie.bundle import Bundle
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
-from tastypie.exceptions import ImmediateHttpResponse, NotFound
+from tastypie.exceptions import BadRequest, ImmediateHttpResponse, NotFound
 from tastypie.http import (HttpAccepted, HttpBadRequest, HttpCreated,
                            HttpForbidden, HttpGone, HttpMethodNotAllowed,
                            HttpNoContent, HttpNotFound, HttpUnauthorized)
+from tastypie.paginator import Paginator
 from tastypie.resources import ModelResource, Resource
 from tastypie.utils import trailing_slash
 
 from core.models import (Analysis, DataSet, ExtendedGroup, GroupManagement,
                          Invitation, Project, ResourceStatistics, Tutorials,
                          UserAuthentication, UserProfile, Workflow)
-from core.utils import (get_data_sets_annotations, get_resources_for_user,
+from core.utils import (get_data_sets_annotations, get_resource_list_cache_key,
+                        get_resources_for_user, get_sharing_statistics,
                         which_default_read_perm)
 from data_set_manager.api import (AssayResource, InvestigationResource,
-                                  StudyResource)
-from data_set_manager.models import Attribute, Node, Study
-from file_store.models import FileStoreItem
+                                  StudyResource,
+                                  get_organism_attributes_prefetch)
+from data_set_manager.models import Node, Study
+from file_store.models import FileStoreItem, get_import_statuses
 
 logger = logging.getLogger(__name__)
 signer = Signer()
@@ -127,6 +132,19 @@ class SharableResourceAPIInterface(object):
 
         return res_list
 
+    def _get_owner_uuids(self, res_ids):
+        """Maps the IDs of resources to the profile UUIDs of their owners
+        with a single query (ownership is determined by "add" permission,
+        see SharableResource.get_owner())
+        """
+        owner_perms = UserObjectPermission.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.res_type),
+            permission__codename='add_%s' % self.res_type._meta.verbose_name,
+            object_pk__in=res_ids
+        ).order_by('-id').values_list('object_pk', 'user__profile__uuid')
+        # the permission with the lowest ID wins if there are several owners
+        return dict(owner_perms)
+
     def _build_res_list(self, user):
         return get_resources_for_user(user, self.res_type._meta.verbose_name)
 
@@ -152,10 +170,12 @@ class SharableResourceAPIInterface(object):
             res_list_unique = None
 
         cache_check = None
+        cache_key = None
         if res_list_unique is not None:
             try:
-                cache_check = cache.get('{}-{}'.format(
-                    user.id, res_list_unique))
+                cache_key = get_resource_list_cache_key(user.id,
+                                                        res_list_unique)
+                cache_check = cache.get(cache_key)
             except Exception as e:
                 logger.error(
                     'Something went wrong with retrieving the cached res_list.'
@@ -176,24 +196,25 @@ class SharableResourceAPIInterface(object):
                     which_default_read_perm(self.res_type._meta.verbose_name)
                 ).values_list("id", flat=True))
 
+            res_ids = [str(res.id) for res in res_list]
+
             # Get content type, needed to map Guardian group permission.
             content_type = ContentType.objects.get(model='dataset')
 
-            shared_res_dict = {res.id: GroupObjectPermission.objects.filter(
-                content_type_id=content_type.id,
-                object_pk=res.id
-            ).count() for res in res_list}
+            shared_res_dict = dict(
+                GroupObjectPermission.objects.filter(
+                    content_type_id=content_type.id,
+                    object_pk__in=res_ids
+                ).values_list('object_pk').annotate(count=Count('id'))
+            )
+
+            owner_dict = self._get_owner_uuids(res_ids)
 
             # instantiate owner and public fields
             for res in res_list:
                 is_owner = res.id in owned_res_set
                 setattr(res, 'is_owner', is_owner)
-                owner = res.get_owner()
-                setattr(
-                    res,
-                    'owner',
-                    owner.profile.uuid if owner is not None else owner
-                )
+                setattr(res, 'owner', owner_dict.get(str(res.id)))
                 setattr(
                     res,
                     'public',
@@ -202,14 +223,14 @@ class SharableResourceAPIInterface(object):
                 setattr(
                     res,
                     'is_shared',
-                    shared_res_dict[res.id] > 0
+                    shared_res_dict.get(str(res.id), 0) > 0
                 )
 
                 if 'sharing' in kwargs and kwargs['sharing']:
                     setattr(res, 'share_list', self.get_share_list(user, res))
 
-            if user_uuid and res_list_unique:
-                cache.add('{}-{}'.format(user.id, res_list_unique), res_list)
+            if user_uuid and cache_key:
+                cache.add(cache_key, res_list)
         else:
             res_list = cache_check
 
@@ -1056,30 +1077,81 @@ class AnalysisResource(ModelResource):
         return data
 
 
+class KeysetPaginator(Paginator):
+    """Paginate by primary key instead of by offset
+    Each page is selected with pk > <last pk of the previous page>, so its
+    cost does not depend on its position in the list. The key is passed in
+    the 'after' parameter of the next page URI
+    """
+    def get_after(self):
+        after = self.request_data.get('after')
+        if after is None:
+            return None
+        try:
+            return int(after)
+        except (TypeError, ValueError):
+            raise BadRequest(
+                "Invalid after '{}' provided. Please provide an "
+                "integer.".format(after)
+            )
+
+    def page(self):
+        limit = self.get_limit()
+        after = self.get_after()
+        objects = self.objects.order_by('pk')
+        if after is not None:
+            objects = objects.filter(pk__gt=after)
+        # fetch one extra object to find out if there is a next page
+        page = list(objects[:limit + 1]) if limit else list(objects)
+        next_uri = None
+        if limit and len(page) > limit:
+            page = page[:limit]
+            next_uri = self._generate_keyset_uri(limit, page[-1].pk)
+        return {
+            self.collection_name: page,
+            'meta': {
+                'limit': limit,
+                'after': after,
+                'next': next_uri,
+                'previous': None
+            }
+        }
+
+    def _generate_keyset_uri(self, limit, after):
+        if self.resource_uri is None:
+            return None
+        request_params = self.request_data.copy()
+        request_params.pop('offset', None)
+        request_params['limit'] = limit
+        request_params['after'] = after
+        try:
+            encoded_params = request_params.urlencode()
+        except AttributeError:  # plain dict
+            encoded_params = urllib.urlencode(request_params)
+        return '{}?{}'.format(self.resource_uri, encoded_params)
+
+
 class NodeResource(ModelResource):
     parents = fields.ToManyField('core.api.NodeResource', 'parents')
     study = fields.ToOneField('data_set_manager.api.StudyResource', 'study')
     assay = fields.ToOneField(
         'data_set_manager.api.AssayResource', 'assay', null=True
     )
+    # organism attributes only (see Meta.queryset)
     attributes = fields.ToManyField(
         'data_set_manager.api.AttributeResource',
-        attribute=lambda bundle: (
-            Attribute.objects
-            .exclude(value__isnull=True)
-            .exclude(value__exact='')
-            .filter(
-                node=bundle.obj,
-                subtype='organism'
-            )
-        ),
+        attribute='attribute_set',
         use_in='all',
         full=True,
         null=True
     )
 
     class Meta:
-        queryset = Node.objects.all()
+        queryset = Node.objects.select_related(
+            'study', 'assay'
+        ).prefetch_related(
+            'parents', get_organism_attributes_prefetch()
+        )
         resource_name = 'node'
         detail_uri_name = 'uuid'  # for using UUIDs instead of pk in URIs
         # required for public data set access by anonymous users
@@ -1097,8 +1169,9 @@ class NodeResource(ModelResource):
             'file_uuid': ALL,
             'type': ALL
         }
-        limit = 0
-        max_limit = 0
+        paginator_class = KeysetPaginator
+        limit = 1000
+        max_limit = 1000
 
     def prepend_urls(self):
         return [
@@ -1108,23 +1181,75 @@ class NodeResource(ModelResource):
                 name="api_dispatch_detail"),
         ]
 
-    def dehydrate(self, bundle):
-        # return download URL of file if a file is associated with the node
+    def get_list(self, request, **kwargs):
+        """Same as ModelResource.get_list() but loads FileStoreItems and their
+        import states for the whole page of Nodes before dehydration
+        """
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(
+            bundle=base_bundle, **self.remove_api_resource_names(kwargs)
+        )
+        sorted_objects = self.apply_sorting(objects, options=request.GET)
+        paginator = self._meta.paginator_class(
+            request.GET, sorted_objects,
+            resource_uri=self.get_resource_uri(), limit=self._meta.limit,
+            max_limit=self._meta.max_limit,
+            collection_name=self._meta.collection_name
+        )
+        to_be_serialized = paginator.page()
+        nodes = to_be_serialized[self._meta.collection_name]
+        self._prefetch_file_store_items(nodes)
+        to_be_serialized[self._meta.collection_name] = [
+            self.full_dehydrate(self.build_bundle(obj=node, request=request),
+                                for_list=True)
+            for node in nodes
+        ]
+        to_be_serialized = self.alter_list_data_to_serialize(
+            request, to_be_serialized
+        )
+        return self.create_response(request, to_be_serialized)
+
+    @staticmethod
+    def _prefetch_file_store_items(nodes):
+        file_store_items = dict(
+            (item.uuid, item) for item in FileStoreItem.objects.filter(
+                uuid__in=set(node.file_uuid for node in nodes
+                             if node.file_uuid)
+            )
+        )
+        import_statuses = get_import_statuses(
+            item.import_task_id for item in file_store_items.itervalues()
+            if item.import_task_id
+        )
+        for item in file_store_items.itervalues():
+            item.import_status = import_statuses.get(item.import_task_id,
+                                                     NOT_AVAILABLE)
+        for node in nodes:
+            node.file_store_item = file_store_items.get(node.file_uuid)
+
+    def _get_file_store_item(self, node):
+        if hasattr(node, 'file_store_item'):  # loaded by get_list()
+            return node.file_store_item
         try:
-            file_item = FileStoreItem.objects.get(uuid=bundle.obj.file_uuid)
-        except AttributeError:
-            logger.warning("No UUID provided")
-            bundle.data['file_url'] = None
-            bundle.data['file_import_status'] = None
+            file_store_item = FileStoreItem.objects.get(uuid=node.file_uuid)
         except FileStoreItem.DoesNotExist:
-            logger.warning(
-                "Unable to find file store item with UUID '%s'",
-                bundle.obj.file_uuid)
+            return None
+        file_store_item.import_status = file_store_item.get_import_status()
+        return file_store_item
+
+    def dehydrate(self, bundle):
+        # return download URL of file if a file is associated with the node
+        file_item = self._get_file_store_item(bundle.obj)
+        if file_item is None:
+            if bundle.obj.file_uuid:
+                logger.warning(
+                    "Unable to find file store item with UUID '%s'",
+                    bundle.obj.file_uuid)
             bundle.data['file_url'] = None
             bundle.data['file_import_status'] = None
         else:
             bundle.data['file_url'] = file_item.get_datafile_url()
-            bundle.data['file_import_status'] = file_item.get_import_status()
+            bundle.data['file_import_status'] = file_item.import_status
         return bundle
 
 
@@ -1141,26 +1266,7 @@ class StatisticsResource(Resource):
         object_class = ResourceStatistics
 
     def stat_summary(self, model, unique_workflows=False):
-
-        if not unique_workflows:
-            model_list = model.objects.all()
-        else:
-            # Filter out inactive workflows
-            model_list = model.objects.filter(is_active=True)
-
-        total = len(model_list)
-
-        public = len(filter(lambda x: x.is_public(), model_list))
-
-        private_shared = len(filter(
-            lambda x: not x.is_public() and len(x.get_groups()) > 1,
-            model_list))
-
-        private = total - public - private_shared
-        return {
-            'total': total, 'public': public,
-            'private': private, 'private_shared': private_shared
-        }
+        return get_sharing_statistics(model, active_only=unique_workflows)
 
     def detail_uri_kwargs(self, bundle_or_obj):
         kwargs = {}
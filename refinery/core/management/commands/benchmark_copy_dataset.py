@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from data_set_manager.models import (Assay, Attribute, Investigation, Node,
+                                     Protocol, ProtocolReference, Study)
+
+from ...tasks import COPY_BATCH_SIZE, copy_investigation
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = """Time copying a synthetic investigation with the given number of
+    nodes (source -> sample -> raw data file chains) in the database; all
+    changes are rolled back
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nodes',
+            type=int,
+            default=100000,
+            help="Number of nodes in the investigation"
+        )
+        parser.add_argument(
+            '--attributes',
+            type=int,
+            default=5,
+            help="Number of attributes per node"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                start = time.time()
+                investigation = self._create_investigation(
+                    options['nodes'], options['attributes']
+                )
+                self.stdout.write("Created investigation in {:.1f} sec".format(
+                    time.time() - start
+                ))
+                start = time.time()
+                copy_investigation(investigation)
+                self.stdout.write(
+                    "Copied {} nodes with {} attributes each in {:.1f} "
+                    "sec".format(options['nodes'], options['attributes'],
+                                 time.time() - start)
+                )
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def _create_investigation(self, node_count, attribute_count):
+        investigation = Investigation.objects.create()
+        study = Study.objects.create(investigation=investigation)
+        assay = Assay.objects.create(study=study)
+        protocol = Protocol.objects.create(study=study)
+
+        node_types = [Node.SOURCE, Node.SAMPLE, Node.RAW_DATA_FILE]
+        nodes = []
+        for index in range(node_count):
+            node_type = node_types[index % len(node_types)]
+            nodes.append(Node(
+                uuid=str(uuid.uuid4()), study=study, type=node_type,
+                name="{} {}".format(node_type, index),
+                assay=assay if node_type == Node.RAW_DATA_FILE else None,
+                file_uuid=(str(uuid.uuid4())
+                           if node_type == Node.RAW_DATA_FILE else None)
+            ))
+        Node.objects.bulk_create(nodes, batch_size=COPY_BATCH_SIZE)
+        node_ids = dict(
+            Node.objects.filter(study=study).values_list("uuid", "id")
+        )
+
+        links = [(node_ids[nodes[index - 1].uuid], node_ids[node.uuid])
+                 for index, node in enumerate(nodes)
+                 if index % len(node_types)]
+        Node.children.through.objects.bulk_create(
+            [Node.children.through(from_node_id=parent_id,
+                                   to_node_id=child_id)
+             for parent_id, child_id in links],
+            batch_size=COPY_BATCH_SIZE
+        )
+        Node.parents.through.objects.bulk_create(
+            [Node.parents.through(from_node_id=child_id,
+                                  to_node_id=parent_id)
+             for parent_id, child_id in links],
+            batch_size=COPY_BATCH_SIZE
+        )
+        Attribute.objects.bulk_create(
+            [Attribute(node_id=node_id, type=Attribute.CHARACTERISTICS,
+                       subtype="attribute {}".format(index),
+                       value="value {}".format(index))
+             for node_id in node_ids.itervalues()
+             for index in range(attribute_count)],
+            batch_size=COPY_BATCH_SIZE
+        )
+        ProtocolReference.objects.bulk_create(
+            [ProtocolReference(node_id=node_ids[node.uuid],
+                               protocol=protocol)
+             for node in nodes if node.type == Node.RAW_DATA_FILE],
+            batch_size=COPY_BATCH_SIZE
+        )
+        return investigation
@@ -0,0 +1,34 @@
+from __future__ import absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...models import DataSet
+from ...search_indexes import DataSetIndex
+
+
+class Command(BaseCommand):
+    help = """Re-index all data sets in the core Solr index, loading the
+    investigations, studies, assays, contacts, owners and groups of a batch
+    of data sets at a time and posting each batch to Solr in one request
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help="Number of data sets per batch (default: "
+                 "REFINERY_SOLR_INDEX_BATCH_SIZE)"
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = DataSetIndex().update_objects(
+            DataSet.objects.order_by('id'), using='core',
+            batch_size=options['batch_size']
+        )
+        self.stdout.write("Indexed {} data sets in {:.1f} sec".format(
+            count, time.time() - start
+        ))
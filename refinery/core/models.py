@@ -26,7 +26,7 @@ from django.contrib.sites.models import Site
 from django.core.mail import send_mail
 from django.db import models, transaction
 from django.db.models.fields import IntegerField
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import m2m_changed, post_save, pre_delete
 from django.dispatch import receiver
 from django.forms import ValidationError
 from django.template import loader
@@ -51,7 +51,8 @@ from data_set_manager.models import (
 )
 from data_set_manager.search_indexes import NodeIndex
 from data_set_manager.utils import (
-    add_annotated_nodes_selection, index_annotated_nodes_selection
+    add_annotated_nodes_selection, delete_nodes, get_solr_terms_query,
+    index_annotated_nodes_selection
 )
 from file_store.models import FileStoreItem, FileType
 from galaxy_connector.models import Instance
@@ -315,6 +316,7 @@ class OwnableResource(BaseResource):
         assign_perm("change_%s" % self._meta.verbose_name, user, self)
         if self._meta.verbose_name == 'dataset':
             assign_perm("read_meta_%s" % self._meta.verbose_name, user, self)
+        invalidate_cached_object(self)
 
     def get_owner(self):
         # ownership is determined by "add" permission
@@ -711,6 +713,7 @@ class DataSet(SharableResource):
         remove_perm('read_meta_%s' % self._meta.verbose_name, group, self)
 
         update_data_set_index(self)
+        invalidate_cached_object(self)
         # Need to check if the users of the group that is unshared still have
         # access via other groups or by ownership
         users = group.user_set.all()
@@ -805,6 +808,16 @@ def _dataset_delete(sender, instance, *args, **kwargs):
     """
     with transaction.atomic():
         for investigation_link in instance.get_investigation_links():
+            # remove Nodes in bulk, deleting the node collection would send
+            # pre_delete for every Node
+            investigation = investigation_link.investigation
+            study_uuids = Study.objects.filter(
+                investigation=investigation
+            ).values_list('uuid', flat=True)
+            delete_nodes(
+                Node.objects.filter(study__investigation=investigation),
+                solr_query=get_solr_terms_query('study_uuid', study_uuids)
+            )
             investigation_link.get_node_collection().delete()
 
     delete_data_set_index(instance)
@@ -825,6 +838,13 @@ def _dataset_saved(sender, instance, *args, **kwargs):
     instance._invalidate_cached_properties()
 
 
+@receiver(m2m_changed, sender=User.groups.through)
+def _group_membership_changed(sender, action, **kwargs):
+    # the DataSets users can read depend on the groups they are members of
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_cached_object(DataSet())
+
+
 class InvestigationLink(models.Model):
     data_set = models.ForeignKey(DataSet)
     investigation = models.ForeignKey(Investigation)
@@ -1146,23 +1166,28 @@ class Analysis(OwnableResource):
     def galaxy_connection(self):
         return self.galaxy_instance().galaxy_connection()
 
-    def galaxy_progress(self):
-        """Return analysis progress in Galaxy"""
-        connection = self.galaxy_connection()
-        try:
-            history = connection.histories.get_status(self.history_id)
-        except galaxy.client.ConnectionError as exc:
-            error_msg = "Unable to get progress for history {} of analysis " \
-                        "{}: {}".format(self.history_id, self.name, exc)
-            # if history with provided ID doesn't exist (HTTP 400)
-            if '400' in str(exc):
-                logger.error(error_msg)
-                self.set_status(Analysis.FAILURE_STATUS, error_msg)
-                raise RuntimeError()
-            else:
-                logger.warning(error_msg)
-                self.set_status(Analysis.UNKNOWN_STATUS, error_msg)
-                raise
+    def galaxy_progress(self, history=None):
+        """Return analysis progress in Galaxy
+        :param history: state of the history as returned by
+        HistoryClient.get_status(), fetched from Galaxy if not provided
+        """
+        if history is None:
+            connection = self.galaxy_connection()
+            try:
+                history = connection.histories.get_status(self.history_id)
+            except galaxy.client.ConnectionError as exc:
+                error_msg = "Unable to get progress for history {} of " \
+                            "analysis {}: {}".format(self.history_id,
+                                                     self.name, exc)
+                # if history with provided ID doesn't exist (HTTP 400)
+                if '400' in str(exc):
+                    logger.error(error_msg)
+                    self.set_status(Analysis.FAILURE_STATUS, error_msg)
+                    raise RuntimeError()
+                else:
+                    logger.warning(error_msg)
+                    self.set_status(Analysis.UNKNOWN_STATUS, error_msg)
+                    raise
 
         if (history['state'] == 'error' or
                 history['state_details']['error'] > 0):
@@ -1216,6 +1241,7 @@ class Analysis(OwnableResource):
         """Mark analysis as cancelled"""
         self.canceled = True
         self.set_status(Analysis.FAILURE_STATUS, "Cancelled at user's request")
+        self.terminate_file_import_tasks()
         # jobs in a running workflow are stopped by deleting its history
         self.galaxy_cleanup()
 
@@ -1644,7 +1670,10 @@ def _analysis_delete(sender, instance, *args, **kwargs):
         # Delete associated AnalysisResults
         instance.get_analysis_results().delete()
         # Delete Nodes Associated w/ the Analysis
-        instance.get_nodes().delete()
+        delete_nodes(
+            instance.get_nodes(),
+            solr_query=get_solr_terms_query('analysis_uuid', [instance.uuid])
+        )
 
     # Optimize Solr's index to get rid of any traces of the Analysis
     instance.optimize_solr_index()
@@ -4,19 +4,130 @@ Created on Jul 2, 2012
 @author: nils
 '''
 
+from collections import defaultdict
 import logging
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.template import loader
 from django.template.context import Context
 
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from haystack import indexes
+from pysolr import SolrError
 
 import data_set_manager
 
 logger = logging.getLogger(__name__)
 
 
+class DataSetIndexContext(object):
+    """Investigation, studies, assays, contacts, owner, groups and annotated
+    nodes of a data set, loaded once to prepare its document
+    """
+    def __init__(self, investigation=None, studies=(), assays=(),
+                 contacts=(), owner=None, group_ids=(), nodes=()):
+        self.investigation = investigation
+        self.studies = list(studies)
+        self.assays = list(assays)
+        self.contacts = list(contacts)
+        self.owner = owner
+        self.group_ids = list(group_ids)
+        self.nodes = list(nodes)
+
+    @classmethod
+    def for_data_sets(cls, data_sets):
+        """Load the contexts of many data sets with a fixed number of queries
+        :returns: dict of contexts keyed by data set ID
+        """
+        data_set_model = models.get_model('core', 'DataSet')
+        investigation_link_model = models.get_model('core',
+                                                    'InvestigationLink')
+        dsm_models = data_set_manager.models
+        data_set_ids = [data_set.id for data_set in data_sets]
+
+        # same as DataSet.get_investigation(): the most recent link
+        investigations = {}
+        for link in investigation_link_model.objects.filter(
+            data_set_id__in=data_set_ids
+        ).select_related('investigation').order_by('date'):
+            investigations[link.data_set_id] = link.investigation
+        investigation_ids = [investigation.id
+                             for investigation in investigations.values()]
+
+        studies = defaultdict(list)
+        for study in dsm_models.Study.objects.filter(
+            investigation_id__in=investigation_ids
+        ).order_by('id'):
+            studies[study.investigation_id].append(study)
+        study_ids = [study.id for study_list in studies.values()
+                     for study in study_list]
+
+        assays = defaultdict(list)
+        for assay in dsm_models.Assay.objects.filter(
+            study_id__in=study_ids
+        ).order_by('id'):
+            assays[assay.study_id].append(assay)
+
+        contacts = defaultdict(list)
+        for contact in dsm_models.Contact.objects.filter(
+            collection_id__in=investigation_ids + study_ids
+        ).order_by('id'):
+            contacts[contact.collection_id].append(contact)
+
+        nodes = defaultdict(list)
+        distinct_fields = ('assay', 'node_name', 'attribute_type',
+                           'attribute_subtype', 'attribute_value',
+                           'attribute_value_unit')
+        for node in dsm_models.AnnotatedNode.objects.filter(
+            study_id__in=study_ids,
+            node_type__in=dsm_models.Node.FILES
+        ).order_by(*distinct_fields).distinct(*distinct_fields):
+            nodes[node.assay_id].append(node)
+
+        # same as DataSet.get_owner() and get_group_ids()
+        content_type = ContentType.objects.get_for_model(data_set_model)
+        object_pks = [str(data_set_id) for data_set_id in data_set_ids]
+        owner_ids = {}
+        for object_pk, user_id in UserObjectPermission.objects.filter(
+            content_type=content_type,
+            permission__codename='add_dataset',
+            object_pk__in=object_pks
+        ).order_by('-id').values_list('object_pk', 'user_id'):
+            owner_ids[int(object_pk)] = user_id
+        owners = User.objects.in_bulk(set(owner_ids.values()))
+        group_ids = defaultdict(set)
+        for object_pk, group_id in GroupObjectPermission.objects.filter(
+            content_type=content_type, object_pk__in=object_pks
+        ).values_list('object_pk', 'group_id'):
+            group_ids[int(object_pk)].add(group_id)
+
+        contexts = {}
+        for data_set in data_sets:
+            investigation = investigations.get(data_set.id)
+            context = cls(owner=owners.get(owner_ids.get(data_set.id)),
+                          group_ids=sorted(group_ids[data_set.id]))
+            if investigation is not None:
+                context.investigation = investigation
+                context.studies = studies[investigation.id]
+                context.contacts = list(contacts[investigation.id])
+                for study in context.studies:
+                    context.assays.extend(assays[study.id])
+                    context.contacts.extend(contacts[study.id])
+                for assay in context.assays:
+                    context.nodes.extend(nodes[assay.id])
+            contexts[data_set.id] = context
+        return contexts
+
+    def get_description(self):
+        # same as Investigation.get_description()
+        if not self.investigation.description:
+            return self.studies[0].description
+        return self.investigation.description
+
+
 class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
     name = indexes.CharField(model_attr='name', null=True)
@@ -37,6 +148,9 @@ class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
     # We add this for autocomplete
     # content_auto = indexes.EdgeNgramField(null=True)
 
+    # DataSetIndexContexts of the data sets being prepared, keyed by ID
+    _contexts = None
+
     def get_model(self):
         return models.get_model('core', 'DataSet')
 
@@ -44,91 +158,96 @@ class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
         """Used when the entire index for model is updated"""
         return self.get_model().objects.all()
 
-    def prepare_description(self, object):
+    def _get_context(self, data_set):
+        if self._contexts is not None and data_set.id in self._contexts:
+            return self._contexts[data_set.id]
+        return DataSetIndexContext.for_data_sets([data_set])[data_set.id]
+
+    def update_objects(self, data_sets, using=None, batch_size=None):
+        """Index many DataSets at once
+        Contexts are loaded with a few queries per batch, documents are
+        posted to Solr batch_size at a time and committed once at the end
+        :param data_sets: DataSet queryset (or list of DataSets)
+        :returns: number of DataSets sent for indexing
+        """
+        if batch_size is None:
+            batch_size = settings.REFINERY_SOLR_INDEX_BATCH_SIZE
+        if hasattr(data_sets, "iterator"):
+            data_sets = data_sets.iterator()
+
+        backend = self._get_backend(using)
+        if backend is None:
+            return 0
+
+        counter = 0
+        batch = []
+        for data_set in data_sets:
+            batch.append(data_set)
+            if len(batch) == batch_size:
+                counter += self._update_batch(backend, batch)
+                batch = []
+        if batch:
+            counter += self._update_batch(backend, batch)
+
+        if counter:
+            try:
+                backend.conn.commit()
+            except (IOError, SolrError) as e:
+                logger.error("Failed to commit %s indexed DataSets: %s",
+                             counter, e)
+        return counter
+
+    def _update_batch(self, backend, data_sets):
+        self._contexts = DataSetIndexContext.for_data_sets(data_sets)
         try:
-            return object.get_investigation().get_description()
-        except AttributeError as e:
+            backend.update(self, data_sets, commit=False)
+        finally:
+            self._contexts = None
+        return len(data_sets)
+
+    def prepare_description(self, object):
+        context = self._get_context(object)
+        if context.investigation is None:
             logger.error(
-                "Could not fetch Investigation for DataSet with UUID: %s %s",
-                object.uuid,
-                e
+                "Could not fetch Investigation for DataSet with UUID: %s",
+                object.uuid
             )
-        return ""
+            return ""
+        return context.get_description()
 
     def prepare_access(self, object):
+        context = self._get_context(object)
         access_list = []
-        if object.get_owner() is not None:
-            access_list.append('u_{}'.format(object.get_owner().id))
-        for group_id in object.get_group_ids():
+        if context.owner is not None:
+            access_list.append('u_{}'.format(context.owner.id))
+        for group_id in context.group_ids:
             access_list.append('g_{}'.format(group_id))
         return access_list
 
     def prepare_submitter(self, object):
-        investigation = object.get_investigation()
-
-        if investigation is None:
-            return []
-
-        submitters = []
-
-        for contact in investigation.contact_set.all():
-            submitters.append(
-                u"{}, {}".format(
-                    contact.last_name,
-                    contact.first_name
-                )
-            )
-
-        studies = investigation.study_set.all()
-        for study in studies:
-            for contact in study.contact_set.all():
-                submitters.append(
-                    u"{}, {}".format(
-                        contact.last_name,
-                        contact.first_name
-                    )
-                )
-
+        context = self._get_context(object)
+        submitters = [
+            u"{}, {}".format(contact.last_name, contact.first_name)
+            for contact in context.contacts
+        ]
         # Cast to `list` looks redundant, but MultiValueField stores sets
         # improperly, introducing a search bug.
         # https://github.com/refinery-platform/refinery-platform/pull/1716#discussion_r115339987
         return list(set(submitters))
 
     def prepare_measurement(self, object):
-        investigation = object.get_investigation()
-
-        if investigation is None:
-            return []
-
-        measurements = []
-
-        studies = investigation.study_set.all()
-        for study in studies:
-            for assay in study.assay_set.all():
-                measurements.append(assay.measurement)
-
+        context = self._get_context(object)
         # Cast to `list` looks redundant, but MultiValueField stores sets
         # improperly, introducing a search bug.
         # https://github.com/refinery-platform/refinery-platform/pull/1716#discussion_r115339987
-        return list(set(measurements))
+        return list(set(assay.measurement for assay in context.assays))
 
     def prepare_technology(self, object):
-        investigation = object.get_investigation()
-
-        if investigation is None:
-            return []
-
-        technologies = []
-
-        studies = investigation.study_set.all()
-        for study in studies:
-            for assay in study.assay_set.all():
-                technologies.append(assay.technology)
-
+        context = self._get_context(object)
         # Cast to `list` looks redundant, but MultiValueField stores sets
         # improperly, introducing a search bug.
         # https://github.com/refinery-platform/refinery-platform/pull/1716#discussion_r115339987
-        return list(set(technologies))
+        return list(set(assay.technology for assay in context.assays))
 
     # from:
     # http://django-haystack.readthedocs.org/en/latest/rich_content_extraction.html
@@ -136,28 +255,17 @@ class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
     # http://django-haystack.readthedocs.org/en/latest/searchindex_api.html
     def prepare(self, data_set):
         logger.info("Start preparing '%s' for indexing", data_set.name)
-        data = super(DataSetIndex, self).prepare(data_set)
-        investigation = data_set.get_investigation()
-        nodes = []
-        if investigation is not None:
-            studies = investigation.study_set.all()
-            for study in studies:
-                assays = study.assay_set.all()
-                for assay in assays:
-                    nodes += list(
-                        data_set_manager.models.AnnotatedNode.objects.filter(
-                            study__uuid=study.uuid,
-                            assay__uuid=assay.uuid,
-                            node_type__in=data_set_manager.models.Node.FILES
-                        ).distinct(
-                            'node_name',
-                            'attribute_type',
-                            'attribute_subtype',
-                            'attribute_value',
-                            'attribute_value_unit'
-                        )
-                    )
-
+        # load the context once for all prepare_<field>() methods
+        loaded_here = self._contexts is None
+        if loaded_here:
+            self._contexts = DataSetIndexContext.for_data_sets([data_set])
+        try:
+            data = super(DataSetIndex, self).prepare(data_set)
+            context = self._get_context(data_set)
+        finally:
+            if loaded_here:
+                self._contexts = None
+        if context.investigation is not None:
             # perform the template processing to render the
             # text field with *all* of our node data visible for indexing
             template = loader.select_template(
@@ -166,7 +274,7 @@ class DataSetIndex(indexes.SearchIndex, indexes.Indexable):
             data['text'] = template.render(
                 Context({
                     'object': data_set,
-                    'nodes': nodes
+                    'nodes': context.nodes
                 })
             )
         logger.info("Successfully prepared '%s' for indexing", data_set.name)
@@ -1,19 +1,31 @@
 import logging
+import time
 
-from django.db.models.deletion import Collector
+from django.db import connection, transaction
 from django.db.models.fields.related import ForeignKey
 
 from celery.task import task
-
-from data_set_manager.models import Investigation, Study
+from django_extensions.db.fields import UUIDField
+
+from data_set_manager.models import (Assay, Attribute, AttributeDefinition,
+                                     Contact, Design, Factor, Investigation,
+                                     Node, NodeCollection, Ontology, Protocol,
+                                     ProtocolComponent, ProtocolParameter,
+                                     ProtocolReference,
+                                     ProtocolReferenceParameter, Publication,
+                                     Study)
 from data_set_manager.tasks import annotate_nodes
+from data_set_manager.utils import _iterate_with_server_side_cursor
 from file_store.models import FileStoreItem
 from file_store.tasks import import_file
 
 from .models import DataSet, InvestigationLink, SiteStatistics
+from .utils import update_sharing_statistics
 
 logger = logging.getLogger(__name__)
 
+COPY_BATCH_SIZE = 1000
+
 
 def copy_file(original_item_uuid):
     """Creates a copy of a FileStoreItem with the given UUID"""
@@ -35,131 +47,215 @@ def copy_file(original_item_uuid):
         return new_item.uuid
 
 
-def copy_object(obj, value=None, field=None, duplicate_order=None,
-                copy_files=False):
-    """Duplicate all related objects of obj setting field to value
-    If one of the duplicate objects has an FK to another duplicate object
-    update that as well. Return the duplicate copy of obj.
-    This code was adapted from http://djangosnippets.org/snippets/1282/
-    :param obj: Object to copy.
-    :type obj: Model instance of something.
-    :param value: value to set.
-    :type value: str.
-    :param field: field to update.
-    :type field: str.
-    :param duplicate_order: list of models which specify how the duplicate
-    objects are saved. For complex objects this can matter. Check to save if
-    objects are being saved correctly and if not just pass in related objects
-    in the order that they should be saved.
-    :type duplicate_order: list.
-    :param copy_files: Flag indicating whether to create a copy of the
-    FileStoreItem or simply copy the original FileStoreItem's UUID.
-    :type copy_files: bool.
-    :returns: copy of Model instance if successful.
+def _reserve_ids(model, count):
+    """Allocate primary keys for count new rows of model from its sequence
+    so that rows inserted with bulk_create() can be referenced right away
+    :returns: list of IDs or None if not supported by the database
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+            "FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_rows(queryset, id_maps, map_ids=False, prepare=None,
+               batch_size=COPY_BATCH_SIZE):
+    """Insert copies of all rows selected by queryset
+    Rows are streamed from the database and inserted batch_size at a time.
+    Foreign keys to rows that have already been copied are remapped using
+    id_maps and auto-generated UUIDs are regenerated.
+    :param id_maps: dict of model -> {original ID: copy ID}
+    :param map_ids: add the IDs of the copies to id_maps (required if rows
+    that are copied later refer to this model)
+    :param prepare: optional callable to modify each copy before insert
+    :returns: number of rows copied
+    """
+    model = queryset.model
+    fields = model._meta.concrete_fields
+    fk_maps = [(field.attname, id_maps[field.rel.to]) for field in fields
+               if isinstance(field, ForeignKey) and field.rel.to in id_maps]
+    uuid_fields = [field.attname for field in fields
+                   if isinstance(field, UUIDField) and field.auto]
+    id_map = id_maps.setdefault(model, {})
+    rows = _iterate_with_server_side_cursor(
+        queryset.order_by('pk').values_list(*[field.name for field in fields]),
+        chunk_size=batch_size
+    )
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(model(*row))
+        if len(batch) == batch_size:
+            count += _insert_copies(model, batch, fk_maps, uuid_fields, id_map,
+                                    map_ids, prepare)
+            batch = []
+    if batch:
+        count += _insert_copies(model, batch, fk_maps, uuid_fields, id_map,
+                                map_ids, prepare)
+    return count
+
+
+def _insert_copies(model, objects, fk_maps, uuid_fields, id_map, map_ids,
+                   prepare):
+    original_ids = [obj.pk for obj in objects]
+    for obj in objects:
+        for attname, fk_map in fk_maps:
+            value = getattr(obj, attname)
+            if value in fk_map:
+                setattr(obj, attname, fk_map[value])
+        for attname in uuid_fields:
+            setattr(obj, attname, None)  # generated on insert
+        if prepare is not None:
+            prepare(obj)
+        obj.pk = None
+
+    if map_ids:
+        new_ids = _reserve_ids(model, len(objects))
+        if new_ids is None:
+            for obj in objects:
+                obj.save(force_insert=True)
+        else:
+            for obj, new_id in zip(objects, new_ids):
+                obj.pk = new_id
+            model.objects.bulk_create(objects)
+        id_map.update(zip(original_ids, [obj.pk for obj in objects]))
+    else:
+        model.objects.bulk_create(objects)
+    return len(objects)
+
+
+def _copy_node_collection(node_collection, id_maps, **fields):
+    """Copy an Investigation or a Study (multi-table inheritance models can
+    not be inserted with bulk_create())
     """
-    # key = original object, value = copy of original object
-    associated_copy = dict()
-    collector = Collector("default")
-    collector.collect([obj])
-    collector.sort()
-    related_models = collector.data.keys()
-    data_snapshot = {}
-    for key in collector.data.keys():
-        data_snapshot.update({
-            key: dict(zip(
-                [item.pk for item in collector.data[key]],
-                [item for item in collector.data[key]]
-            ))
-        })
-
-    root_obj = None
-
-    # Sometimes it's good enough just to save in reverse deletion order
-    if duplicate_order is None:
-        duplicate_order = reversed(related_models)
-
-    for model in duplicate_order:
-        # Find all FKs on model that point to a related_model
-        fks = []
-        for f in model._meta.fields:
-            if isinstance(f, ForeignKey) and f.rel.to in related_models:
-                fks.append(f)
-        # Replace each `sub_obj` with a duplicate.
-        if model not in collector.data:
-            continue
-        sub_objects = collector.data[model]
-        for obj in sub_objects:
-            orig_obj_id = obj.id
-
-            for fk in fks:
-                fk_value = getattr(obj, "%s_id" % fk.name)
-                # If this FK has been duplicated then point to the duplicate.
-                fk_rel_to = data_snapshot[fk.rel.to]
-                if fk_value in fk_rel_to:
-                    dupe_obj = fk_rel_to[fk_value]
-                    setattr(obj, fk.name, dupe_obj)
-
-            # Duplicate the object and save it.
-            obj.id = None
-
-            if copy_files:
-                # copy data files referenced in file_uuid field in a Node
-                try:
-                    if obj.file_uuid:
-                        obj.file_uuid = copy_file(obj.file_uuid)
-                except AttributeError:
-                    pass
-
-                # copy metadata files associated with an Investigation
-                try:
-                    if obj.isarchive_file or obj.pre_isarchive_file:
-                        try:
-                            obj.isarchive_file = copy_file(obj.isarchive_file)
-                        except:
-                            pass
-                        try:
-                            obj.pre_isarchive_file = copy_file(
-                                obj.pre_isarchive_file)
-                        except:
-                            pass
-                except AttributeError:
-                    pass
-
-            try:
-                if obj.uuid:
-                    obj.uuid = None
-            except AttributeError:
-                pass
-
-            if field is not None:
-                setattr(obj, field, value)
-
-            obj.save()
-
-            # plug the original object and its copy into the dictionary
-            associated_copy[model.objects.get(id=orig_obj_id)] = obj
-
-            if root_obj is None:
-                root_obj = obj
-
-    # work out Many-To-Manys
-    for model in duplicate_order:
-        sub_objects = collector.data[model]
-        for obj in sub_objects:
-            m2m_dict = dict()
-            for m2m in model._meta.many_to_many:
-                m2m_manager = getattr(obj, "%s_set" % m2m.name)
-                m2m_dict[m2m.name] = m2m_manager.all()
-            try:
-                copied_obj = associated_copy[obj]
-                for m2m in model._meta.many_to_many:
-                    m2m_field_manager = getattr(copied_obj, m2m.name)
-                    for item in m2m_dict[m2m.name]:
-                        m2m_field_manager.add(associated_copy[item])
-            except KeyError:
-                pass
-
-    return root_obj
+    original_id = node_collection.id
+    node_collection.pk = None
+    node_collection.id = None
+    node_collection.uuid = None
+    for name, value in fields.iteritems():
+        setattr(node_collection, name, value)
+    node_collection.save()
+    id_maps.setdefault(type(node_collection), {})[original_id] = \
+        node_collection.id
+    id_maps.setdefault(NodeCollection, {})[original_id] = node_collection.id
+    return node_collection
+
+
+def _copy_node_file(node):
+    if node.file_uuid:
+        node.file_uuid = copy_file(node.file_uuid)
+
+
+def copy_investigation(investigation, copy_files=False):
+    """Copy an Investigation with its Studies, Assays, Protocols and Nodes
+    Rows are copied model by model with bulk inserts. Derived rows
+    (AnnotatedNodes, AnnotatedNodeRegistries and AttributeOrders) are not
+    copied, annotate_nodes() rebuilds them for the copy.
+    :param copy_files: create copies of the FileStoreItems referenced by the
+    Investigation and its Nodes instead of copying their UUIDs
+    :returns: copy of the Investigation
+    """
+    timings = {}
+    id_maps = {}
+    # work on a separate instance to leave the original untouched
+    investigation_copy = Investigation.objects.get(pk=investigation.pk)
+    with transaction.atomic():
+        start = time.time()
+        fields = {}
+        if copy_files:
+            for name in ['isarchive_file', 'pre_isarchive_file']:
+                if getattr(investigation_copy, name):
+                    fields[name] = copy_file(
+                        getattr(investigation_copy, name)
+                    )
+        _copy_node_collection(investigation_copy, id_maps, **fields)
+        for study in Study.objects.filter(investigation=investigation):
+            _copy_node_collection(study, id_maps,
+                                  investigation=investigation_copy)
+        for queryset in [
+            Ontology.objects.filter(investigation=investigation),
+            Publication.objects.filter(
+                collection_id__in=list(id_maps[NodeCollection])
+            ),
+            Contact.objects.filter(
+                collection_id__in=list(id_maps[NodeCollection])
+            ),
+            Design.objects.filter(study__investigation=investigation),
+            Factor.objects.filter(study__investigation=investigation),
+        ]:
+            _copy_rows(queryset, id_maps)
+        _copy_rows(Assay.objects.filter(study__investigation=investigation),
+                   id_maps, map_ids=True)
+        _copy_rows(
+            Protocol.objects.filter(study__investigation=investigation),
+            id_maps, map_ids=True
+        )
+        for queryset in [
+            ProtocolParameter.objects.filter(
+                study__investigation=investigation
+            ),
+            ProtocolComponent.objects.filter(
+                study__investigation=investigation
+            ),
+            AttributeDefinition.objects.filter(
+                study__investigation=investigation
+            ),
+        ]:
+            _copy_rows(queryset, id_maps)
+        timings["investigation"] = time.time() - start
+
+        start = time.time()
+        node_count = _copy_rows(
+            Node.objects.filter(study__investigation=investigation),
+            id_maps, map_ids=True,
+            prepare=_copy_node_file if copy_files else None
+        )
+        timings["nodes"] = time.time() - start
+
+        start = time.time()
+        for through in [Node.children.through, Node.parents.through]:
+            _copy_rows(
+                through.objects.filter(
+                    from_node__study__investigation=investigation
+                ),
+                id_maps
+            )
+        timings["node links"] = time.time() - start
+
+        start = time.time()
+        attribute_count = _copy_rows(
+            Attribute.objects.filter(node__study__investigation=investigation),
+            id_maps
+        )
+        timings["attributes"] = time.time() - start
+
+        start = time.time()
+        _copy_rows(
+            ProtocolReference.objects.filter(
+                node__study__investigation=investigation
+            ),
+            id_maps, map_ids=True
+        )
+        _copy_rows(
+            ProtocolReferenceParameter.objects.filter(
+                protocol_reference__node__study__investigation=investigation
+            ),
+            id_maps
+        )
+        timings["protocol references"] = time.time() - start
+
+    logger.info(
+        "Copied Investigation '%s' with %s nodes and %s attributes in %s",
+        investigation.uuid, node_count, attribute_count,
+        ", ".join("{}: {:.3f} sec".format(phase, duration)
+                  for phase, duration in timings.iteritems())
+    )
+    return investigation_copy
 
 
 @task()
@@ -167,13 +263,6 @@ def copy_dataset(dataset, owner, versions=None, copy_files=False):
     logger.info("logging from copy_dataset")
     if versions is None:
         versions = [dataset.get_version()]
-    # count total number of objects to copy
-    items_to_copy = 1
-    collector = Collector("default")
-    for version in versions:
-        collector.collect([dataset.get_investigation(version)])
-        for key in collector.data.keys():
-            items_to_copy += len(collector.data[key])
     # check to see if dataset already exists for provided user
     dataset_copy = None
     data_sets = DataSet.objects.filter(name="%s (copy)" % dataset.name)
@@ -194,23 +283,16 @@ def copy_dataset(dataset, owner, versions=None, copy_files=False):
         dataset_copy.save()
         logger.info("copy_dataset: Created data set %s", dataset_copy.name)
 
-    # make copies of investigations and their links and assign to newly
-    # created dataset
+    # make copies of investigations and link them to the newly created dataset
     for version in versions:
-        inv = dataset.get_investigation(version)
-        node_collection = copy_object(inv, copy_files=copy_files)
-        node_collection.save()
-
-        # find the corresponding Investigation object
-        try:
-            inv = Investigation.objects.get(uuid=node_collection.uuid)
-        except Investigation.DoesNotExist:
-            inv = Study.objects.get(uuid=node_collection.uuid).investigation
-
-        # use the Investigation object to grab its InvestigationLink object
-        il = InvestigationLink.objects.get(investigation=inv)
-        il.data_set = dataset_copy
-        il.save()
+        investigation_link = dataset.get_latest_investigation_link(version)
+        inv = copy_investigation(investigation_link.investigation,
+                                 copy_files=copy_files)
+        InvestigationLink.objects.create(
+            data_set=dataset_copy, investigation=inv,
+            version=investigation_link.version,
+            message=investigation_link.message
+        )
         # annotate the investigation
         annotate_nodes(inv.uuid)
 
@@ -225,3 +307,4 @@ def copy_dataset(dataset, owner, versions=None, copy_files=False):
 @task()
 def collect_site_statistics():
     SiteStatistics.objects.create().collect()
+    update_sharing_statistics()
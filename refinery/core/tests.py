@@ -1,16 +1,19 @@
 from datetime import timedelta
 import json
 import re
+import uuid
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, Group, User
 from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import CommandError, call_command
 from django.db import connection
 from django.db.migrations.executor import MigrationExecutor
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from guardian.core import ObjectPermissionChecker
@@ -22,9 +25,11 @@ from tastypie.exceptions import NotFound
 from tastypie.test import ResourceTestCase
 
 from analysis_manager.models import AnalysisStatus
-from core.tasks import collect_site_statistics
+from core.tasks import collect_site_statistics, copy_dataset
 from data_set_manager.models import (
-    AnnotatedNode, Assay, Contact, Investigation, Node, NodeCollection, Study
+    AnnotatedNode, Assay, Attribute, Contact, Investigation, Node,
+    NodeCollection, Protocol, ProtocolReference, ProtocolReferenceParameter,
+    Study
 )
 from factory_boy.django_model_factories import (
     GalaxyInstanceFactory,
@@ -33,9 +38,9 @@ from factory_boy.utils import (
     create_dataset_with_necessary_models, create_tool_with_necessary_models,
     make_analyses_with_single_dataset
 )
-from file_store.models import FileStoreItem, FileType
+from file_store.models import FileStoreItem, FileType, set_import_progress
 
-from .api import AnalysisResource
+from .api import AnalysisResource, DataSetResource
 from .management.commands.create_user import init_user
 from .management.commands.import_annotations import \
     Command as ImportAnnotationsCommand
@@ -47,7 +52,9 @@ from .models import (
 )
 from .search_indexes import DataSetIndex
 from .utils import (
-    filter_nodes_uuids_in_solr, get_aware_local_time, get_resources_for_user,
+    bump_cache_generation, filter_nodes_uuids_in_solr, get_aware_local_time,
+    get_cache_generation, get_resource_list_cache_key,
+    get_resources_for_user, get_sharing_statistics, incr_cache_counter,
     move_obj_to_front, which_default_read_perm
 )
 
@@ -566,6 +573,68 @@ class CachingTest(TestCase):
         self.assertNotEqual(self.initial_cache, new_cache)
 
 
+class CacheGenerationTest(TestCase):
+    """Testing generation based invalidation of cached resource lists"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("cache-user", "", "password")
+        self.data_set = create_dataset_with_necessary_models()
+        self.cache = LocMemCache("cache-generation-test", {})
+        mock.patch("core.utils.cache", self.cache).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_resource_list_cache_key_is_stable(self):
+        self.assertEqual(
+            get_resource_list_cache_key(self.user.id, "DataSet"),
+            get_resource_list_cache_key(self.user.id, "DataSet")
+        )
+
+    def test_invalidation_changes_resource_list_cache_key(self):
+        key = get_resource_list_cache_key(self.user.id, "DataSet")
+        self.cache.add(key, [self.data_set])
+        invalidate_cached_object(self.data_set)
+        new_key = get_resource_list_cache_key(self.user.id, "DataSet")
+        self.assertNotEqual(key, new_key)
+        self.assertIsNone(self.cache.get(new_key))
+
+    def test_invalidation_only_affects_model_of_instance(self):
+        key = get_resource_list_cache_key(self.user.id, "Project")
+        invalidate_cached_object(self.data_set)
+        self.assertEqual(
+            key, get_resource_list_cache_key(self.user.id, "Project")
+        )
+
+    def test_invalidation_without_generation(self):
+        invalidate_cached_object(self.data_set)
+        self.assertIsNotNone(self.cache.get("DataSet-generation"))
+
+    def test_invalidation_cost_does_not_depend_on_user_count(self):
+        get_resource_list_cache_key(self.user.id, "DataSet")
+        for user_count in (10, 1000):
+            User.objects.bulk_create(
+                User(username="cache-user-{}-{}".format(user_count, i))
+                for i in range(user_count)
+            )
+            with mock.patch.object(self.cache, "incr",
+                                   wraps=self.cache.incr) as incr_mock:
+                with self.assertNumQueries(0):
+                    invalidate_cached_object(self.data_set)
+            self.assertEqual(incr_mock.call_count, 1)
+
+    def test_bump_evicted_generation(self):
+        generation = get_cache_generation("test-generation")
+        self.cache.delete("test-generation")
+        bump_cache_generation("test-generation")
+        self.assertGreaterEqual(get_cache_generation("test-generation"),
+                                generation)
+
+    def test_incr_cache_counter(self):
+        self.assertEqual(incr_cache_counter("test-counter"), 1)
+        self.assertEqual(incr_cache_counter("test-counter", 2), 3)
+
+
 class WorkflowDeletionTest(TestCase):
     """Testing for the deletion of Workflows"""
 
@@ -1446,6 +1515,144 @@ class DataSetResourceTest(LoginResourceTestCase):
                          pre_isa_archive_file_store_item.uuid)
 
 
+class NodeResourceTest(LoginResourceTestCase):
+    """Test Node V1 REST API operations"""
+
+    def setUp(self):
+        super(NodeResourceTest, self).setUp()
+        investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=investigation)
+        self.assay = Assay.objects.create(study=self.study)
+        self.list_uri = make_api_uri("node")
+        cache_patcher = mock.patch('file_store.models.cache',
+                                   LocMemCache('node-resource', {}))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    def _create_nodes(self, count):
+        nodes = []
+        for index in range(count):
+            file_store_item = FileStoreItem.objects.create(
+                source='http://example.org/file{}.txt'.format(index),
+                import_task_id=str(uuid.uuid4())
+            )
+            set_import_progress(file_store_item.import_task_id, 'SUCCESS')
+            node = Node.objects.create(
+                study=self.study, assay=self.assay, name='file',
+                type=Node.RAW_DATA_FILE, file_uuid=file_store_item.uuid
+            )
+            Attribute.objects.create(node=node, subtype='organism',
+                                     type=Attribute.CHARACTERISTICS,
+                                     value='Mus musculus')
+            Attribute.objects.create(node=node, subtype='cell type',
+                                     type=Attribute.CHARACTERISTICS,
+                                     value='HeLa')
+            nodes.append(node)
+        return nodes
+
+    def _get_list(self, uri, **params):
+        response = self.api_client.get(uri, format='json', data=params)
+        self.assertValidJSONResponse(response)
+        return self.deserialize(response)
+
+    def test_get_node_list(self):
+        node = self._create_nodes(1)[0]
+        data = self._get_list(self.list_uri, study__uuid=self.study.uuid)
+        self.assertEqual(len(data['objects']), 1)
+        node_data = data['objects'][0]
+        self.assertEqual(node_data['uuid'], node.uuid)
+        self.assertEqual(node_data['file_url'],
+                         'http://example.org/file0.txt')
+        self.assertEqual(node_data['file_import_status'], 'SUCCESS')
+        self.assertEqual([attribute['subtype']
+                          for attribute in node_data['attributes']],
+                         ['organism'])
+
+    def test_get_node_detail(self):
+        node = self._create_nodes(1)[0]
+        response = self.api_client.get(make_api_uri("node", node.uuid),
+                                       format='json')
+        self.assertValidJSONResponse(response)
+        data = self.deserialize(response)
+        self.assertEqual(data['file_import_status'], 'SUCCESS')
+        self.assertEqual(len(data['attributes']), 1)
+
+    def test_get_node_list_pages(self):
+        nodes = self._create_nodes(5)
+        data = self._get_list(self.list_uri, study__uuid=self.study.uuid,
+                              limit=2)
+        node_uuids = [node['uuid'] for node in data['objects']]
+        self.assertEqual(len(node_uuids), 2)
+        while data['meta']['next']:
+            data = self._get_list(data['meta']['next'])
+            node_uuids.extend(node['uuid'] for node in data['objects'])
+        self.assertEqual(node_uuids, [node.uuid for node in nodes])
+
+    def test_get_node_list_with_invalid_key(self):
+        response = self.api_client.get(self.list_uri, format='json',
+                                       data={'after': 'abc'})
+        self.assertHttpBadRequest(response)
+
+    def test_get_node_list_query_count_does_not_depend_on_page_size(self):
+        query_counts = []
+        for count in (2, 10):
+            self.study = Study.objects.create(
+                investigation=self.study.investigation
+            )
+            self._create_nodes(count)
+            with mock.patch('celery.result.AsyncResult') as mock_result:
+                with CaptureQueriesContext(connection) as queries:
+                    data = self._get_list(self.list_uri,
+                                          study__uuid=self.study.uuid)
+            mock_result.assert_not_called()
+            self.assertEqual(len(data['objects']), count)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class DataSetResourceTransformTest(TestCase):
+    """Test the flags set on DataSets listed by the V1 REST API"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "", "password")
+        self.data_set = create_dataset_with_necessary_models(user=self.user)
+        self.request = mock.Mock(GET={})
+        # no cached lists
+        mock.patch("core.api.cache").start().get.return_value = None
+        mock.patch("core.utils.cache").start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def transform_data_sets(self):
+        return DataSetResource().transform_res_list(
+            self.user, DataSet.objects.all(), self.request
+        )
+
+    def test_flags_of_owned_data_set(self):
+        data_set = self.transform_data_sets()[0]
+        self.assertTrue(data_set.is_owner)
+        self.assertEqual(data_set.owner, self.user.profile.uuid)
+        self.assertFalse(data_set.public)
+        self.assertFalse(data_set.is_shared)
+
+    def test_flags_of_public_data_set(self):
+        self.data_set.share(ExtendedGroup.objects.public_group())
+        data_set = self.transform_data_sets()[0]
+        self.assertTrue(data_set.public)
+        self.assertTrue(data_set.is_shared)
+
+    def test_query_count_does_not_depend_on_number_of_data_sets(self):
+        with CaptureQueriesContext(connection) as one_data_set:
+            self.transform_data_sets()
+        for i in range(5):
+            create_dataset_with_necessary_models(user=self.user)
+        with CaptureQueriesContext(connection) as six_data_sets:
+            self.assertEqual(len(self.transform_data_sets()), 6)
+        self.assertEqual(len(one_data_set.captured_queries),
+                         len(six_data_sets.captured_queries))
+
+
 class DataSetTests(TestCase):
     """ Testing of the DataSet model"""
 
@@ -1594,6 +1801,154 @@ class DataSetTests(TestCase):
         self.assertFalse(tool.dataset.is_clean())
 
 
+class CopyDataSetTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', '', 'user')
+        self.data_set = DataSet.objects.create(name='Test DataSet')
+        self.data_set.set_owner(self.user)
+        self.investigation = Investigation.objects.create(
+            isarchive_file=str(uuid.uuid4())
+        )
+        InvestigationLink.objects.create(
+            data_set=self.data_set, investigation=self.investigation,
+            version=2, message='test version'
+        )
+        self.study = Study.objects.create(investigation=self.investigation,
+                                          title='Test Study')
+        Contact.objects.create(collection=self.study, last_name='Doe')
+        self.assay = Assay.objects.create(study=self.study,
+                                          measurement='transcription')
+        self.protocol = Protocol.objects.create(study=self.study,
+                                                name='sequencing')
+        source = Node.objects.create(study=self.study, name='source',
+                                     type=Node.SOURCE)
+        sample = Node.objects.create(study=self.study, name='sample',
+                                     type=Node.SAMPLE)
+        data_file = Node.objects.create(study=self.study, assay=self.assay,
+                                        name='data file',
+                                        type=Node.RAW_DATA_FILE,
+                                        file_uuid=str(uuid.uuid4()))
+        source.add_child(sample)
+        sample.add_child(data_file)
+        for node in [source, sample, data_file]:
+            Attribute.objects.create(node=node, type='Characteristics',
+                                     subtype='organism', value=node.name)
+        protocol_reference = ProtocolReference.objects.create(
+            node=data_file, protocol=self.protocol, performer='lab'
+        )
+        ProtocolReferenceParameter.objects.create(
+            protocol_reference=protocol_reference, name='read length',
+            value='50'
+        )
+
+    def _copy_data_set(self):
+        with mock.patch('core.tasks.annotate_nodes'):
+            return copy_dataset(self.data_set, self.user)
+
+    def _get_copied_investigation(self, data_set_copy):
+        return InvestigationLink.objects.get(
+            data_set=data_set_copy
+        ).investigation
+
+    def test_copy_data_set(self):
+        data_set_copy = self._copy_data_set()
+        self.assertEqual(data_set_copy.name, 'Test DataSet (copy)')
+        self.assertEqual(data_set_copy.get_owner(), self.user)
+        link = InvestigationLink.objects.get(data_set=data_set_copy)
+        self.assertEqual((link.version, link.message), (2, 'test version'))
+        self.assertNotEqual(link.investigation, self.investigation)
+        self.assertEqual(link.investigation.isarchive_file,
+                         self.investigation.isarchive_file)
+
+    def test_copy_studies_and_assays(self):
+        investigation = self._get_copied_investigation(self._copy_data_set())
+        study = Study.objects.get(investigation=investigation)
+        self.assertNotEqual(study.uuid, self.study.uuid)
+        self.assertEqual(study.title, 'Test Study')
+        self.assertEqual(
+            list(Contact.objects.filter(
+                collection=study).values_list('last_name', flat=True)),
+            ['Doe']
+        )
+        assay = Assay.objects.get(study=study)
+        self.assertNotEqual(assay.uuid, self.assay.uuid)
+        self.assertEqual(assay.measurement, 'transcription')
+
+    def test_copy_node_graph(self):
+        investigation = self._get_copied_investigation(self._copy_data_set())
+        nodes = Node.objects.filter(study__investigation=investigation)
+        self.assertEqual(nodes.count(), 3)
+        original_uuids = Node.objects.filter(
+            study=self.study
+        ).values_list('uuid', flat=True)
+        self.assertFalse(nodes.filter(uuid__in=original_uuids).exists())
+        sample = nodes.get(name='sample')
+        self.assertEqual([node.name for node in sample.parents.all()],
+                         ['source'])
+        self.assertEqual([node.name for node in sample.children.all()],
+                         ['data file'])
+        data_file = nodes.get(name='data file')
+        self.assertEqual(data_file.assay.study.investigation, investigation)
+        self.assertEqual(
+            data_file.file_uuid,
+            Node.objects.get(study=self.study, name='data file').file_uuid
+        )
+
+    def test_copy_attributes_and_protocol_references(self):
+        investigation = self._get_copied_investigation(self._copy_data_set())
+        attributes = Attribute.objects.filter(
+            node__study__investigation=investigation
+        )
+        self.assertEqual(
+            sorted((attribute.node.name, attribute.value)
+                   for attribute in attributes),
+            [('data file', 'data file'), ('sample', 'sample'),
+             ('source', 'source')]
+        )
+        protocol_reference = ProtocolReference.objects.get(
+            node__study__investigation=investigation
+        )
+        self.assertEqual(protocol_reference.node.name, 'data file')
+        self.assertEqual(protocol_reference.protocol.study.investigation,
+                         investigation)
+        self.assertEqual(
+            protocol_reference.protocolreferenceparameter_set.get().value,
+            '50'
+        )
+
+    def test_original_is_unchanged(self):
+        self._copy_data_set()
+        self.assertEqual(
+            Node.objects.filter(study__investigation=self.investigation)
+            .count(), 3
+        )
+        self.assertEqual(Attribute.objects.filter(
+            node__study__investigation=self.investigation).count(), 3)
+        self.assertEqual(InvestigationLink.objects.get(
+            data_set=self.data_set).investigation, self.investigation)
+
+    def test_copy_files(self):
+        copies = {}
+        with mock.patch(
+                'core.tasks.copy_file',
+                side_effect=lambda file_uuid: copies.setdefault(
+                    file_uuid, str(uuid.uuid4())
+                )
+        ):
+            with mock.patch('core.tasks.annotate_nodes'):
+                data_set_copy = copy_dataset(self.data_set, self.user,
+                                             copy_files=True)
+        investigation = self._get_copied_investigation(data_set_copy)
+        self.assertEqual(investigation.isarchive_file,
+                         copies[self.investigation.isarchive_file])
+        data_file = Node.objects.get(study__investigation=investigation,
+                                     name='data file')
+        original_file_uuid = Node.objects.get(study=self.study,
+                                              name='data file').file_uuid
+        self.assertEqual(data_file.file_uuid, copies[original_file_uuid])
+
+
 class CoreIndexTests(TestCase):
     def setUp(self):
         self.dataset_index = DataSetIndex()
@@ -1665,6 +2020,54 @@ class CoreIndexTests(TestCase):
             self.good_dataset.get_investigation().get_description()
         )
 
+    def test_prepare_access(self):
+        user = User.objects.create_user("owner")
+        self.good_dataset.set_owner(user)
+        group = ExtendedGroup.objects.create(name="Test Group")
+        self.good_dataset.share(group)
+        access = self.dataset_index.prepare_access(self.good_dataset)
+        self.assertIn('g_{}'.format(group.id), access)
+        self.assertEqual(
+            sorted(access),
+            sorted(['u_{}'.format(user.id)] +
+                   ['g_{}'.format(group_id) for group_id
+                    in self.good_dataset.get_group_ids()])
+        )
+
+    def test_prepare_loads_context_once(self):
+        self.dataset_index.prepare(self.good_dataset)
+        with CaptureQueriesContext(connection) as single_queries:
+            self.dataset_index.prepare(self.good_dataset)
+        for _ in range(5):
+            create_dataset_with_necessary_models()
+        with mock.patch.object(DataSetIndex, '_get_backend') as backend:
+            backend.return_value.update.side_effect = \
+                lambda index, batch, commit: [index.prepare(data_set)
+                                              for data_set in batch]
+            with CaptureQueriesContext(connection) as bulk_queries:
+                count = self.dataset_index.update_objects(
+                    DataSet.objects.all()
+                )
+        self.assertEqual(count, DataSet.objects.count())
+        # one context load for all data sets
+        self.assertLessEqual(len(bulk_queries), len(single_queries) + 1)
+
+    def test_update_objects_prepares_same_documents_as_prepare(self):
+        documents = []
+        expected = [self.dataset_index.prepare(data_set)
+                    for data_set in DataSet.objects.order_by('id')]
+        with mock.patch.object(DataSetIndex, '_get_backend') as backend:
+            backend.return_value.update.side_effect = \
+                lambda index, batch, commit: documents.append(
+                    [index.prepare(data_set) for data_set in batch]
+                )
+            count = self.dataset_index.update_objects(
+                DataSet.objects.order_by('id'), batch_size=1
+            )
+        self.assertEqual(count, 2)
+        self.assertEqual(documents, [[document] for document in expected])
+        backend.return_value.conn.commit.assert_called_once_with()
+
 
 class TestMigrations(TestCase):
     """
@@ -1849,6 +2252,80 @@ class InitialSiteStatisticsCreationTest(TestMigrations):
             initial_site_statistics.total_visualization_launches, 0)
 
 
+class SharingStatisticsTest(TestCase):
+    def setUp(self):
+        cache_patcher = mock.patch('core.utils.cache',
+                                   LocMemCache('sharing-statistics', {}))
+        self.cache = cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        self.group_a = ExtendedGroup.objects.create(name="Group A")
+        self.group_b = ExtendedGroup.objects.create(name="Group B")
+        self.public_group = ExtendedGroup.objects.public_group()
+
+    def _create_data_sets(self):
+        create_dataset_with_necessary_models()
+        create_dataset_with_necessary_models().share(self.public_group)
+        create_dataset_with_necessary_models().share(self.group_a)
+        shared_data_set = create_dataset_with_necessary_models()
+        shared_data_set.share(self.group_a)
+        shared_data_set.share(self.group_b)
+        public_data_set = create_dataset_with_necessary_models()
+        public_data_set.share(self.group_a)
+        public_data_set.share(self.public_group)
+
+    def test_get_sharing_statistics(self):
+        self._create_data_sets()
+        self.assertEqual(
+            get_sharing_statistics(DataSet),
+            {'total': 5, 'public': 2, 'private': 2, 'private_shared': 1}
+        )
+
+    def test_get_sharing_statistics_matches_resource_methods(self):
+        self._create_data_sets()
+        data_sets = DataSet.objects.all()
+        public = len([d for d in data_sets if d.is_public()])
+        private_shared = len([d for d in data_sets if not d.is_public() and
+                              len(d.get_groups()) > 1])
+        self.assertEqual(get_sharing_statistics(DataSet), {
+            'total': len(data_sets), 'public': public,
+            'private': len(data_sets) - public - private_shared,
+            'private_shared': private_shared
+        })
+
+    def test_get_sharing_statistics_query_count(self):
+        self._create_data_sets()
+        with CaptureQueriesContext(connection) as queries:
+            get_sharing_statistics(DataSet)
+        self._create_data_sets()
+        with self.assertNumQueries(len(queries)):
+            get_sharing_statistics(DataSet, refresh=True)
+
+    def test_get_sharing_statistics_is_cached(self):
+        self._create_data_sets()
+        get_sharing_statistics(DataSet)
+        create_dataset_with_necessary_models()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_sharing_statistics(DataSet)['total'], 5)
+
+    def test_collect_site_statistics_refreshes_cache(self):
+        self._create_data_sets()
+        get_sharing_statistics(DataSet)
+        create_dataset_with_necessary_models()
+        collect_site_statistics()
+        self.assertEqual(get_sharing_statistics(DataSet)['total'], 6)
+
+    def test_get_sharing_statistics_of_active_workflows(self):
+        engine = WorkflowEngine.objects.create(
+            instance=GalaxyInstanceFactory()
+        )
+        Workflow.objects.create(workflow_engine=engine)
+        Workflow.objects.create(workflow_engine=engine, is_active=False)
+        self.assertEqual(get_sharing_statistics(Workflow)['total'], 2)
+        self.assertEqual(
+            get_sharing_statistics(Workflow, active_only=True)['total'], 1
+        )
+
+
 class SiteStatisticsUnitTests(TestCase):
     def setUp(self):
         # Simulate a day of user activity
@@ -3,18 +3,23 @@ from __future__ import absolute_import
 import ast
 import logging
 import sys
+import time
 from urlparse import urljoin
 
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.mail import send_mail
-from django.db import connection
+from django.db import connection, models
+from django.db.models import Count, Q
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.db.models.signals import post_delete, pre_delete
 from django.utils import timezone
 
 from celery.task import task
+from guardian.models import GroupObjectPermission
 from guardian.shortcuts import get_objects_for_user
 from guardian.utils import get_anonymous_user
 import py2neo
@@ -30,6 +35,9 @@ import data_set_manager
 
 logger = logging.getLogger(__name__)
 
+# lifetime of the sharing summaries served by the statistics API
+SHARING_STATISTICS_CACHE_TIMEOUT = 5 * 60  # seconds
+
 
 def skip_if_test_run(func):
     """Decorator to be used on functions that don't necessarily need to
@@ -808,6 +816,102 @@ def delete_analysis_index(node_instance):
         logger.error("Could not delete from NodeIndex: %s", e)
 
 
+def _has_delete_receivers(model):
+    return (pre_delete.has_listeners(model) or
+            post_delete.has_listeners(model))
+
+
+def bulk_delete(queryset):
+    """Delete the rows of a queryset and the rows depending on them with one
+    DELETE (or UPDATE for SET_NULL relations) per table instead of loading
+    every object like QuerySet.delete() does.
+    Pre/post_delete receivers are not sent for the rows of the queryset
+    itself, so callers have to take care of their side effects; related
+    models with receivers or multi-table inheritance are deleted with
+    QuerySet.delete() to keep their signals and parent rows.
+    The queryset is evaluated as a subquery once per related table, so it
+    must not filter on rows that are deleted along with it
+    :param queryset: QuerySet of the rows to delete
+    """
+    model = queryset.model
+    for related in get_candidate_relations_to_delete(model._meta):
+        on_delete = related.field.rel.on_delete
+        if on_delete == models.DO_NOTHING:
+            continue
+        related_model = related.related_model
+        related_queryset = related_model._base_manager.filter(**{
+            related.field.name + '__in':
+                queryset.values(related.field.rel.get_related_field().name)
+        })
+        if on_delete == models.SET_NULL:
+            related_queryset.update(**{related.field.name: None})
+        elif (on_delete == models.CASCADE and related_model != model and
+                not related_model._meta.parents and
+                not _has_delete_receivers(related_model)):
+            bulk_delete(related_queryset)
+        else:
+            related_queryset.delete()
+    if model._meta.parents:
+        queryset.delete()
+    else:
+        queryset._raw_delete(queryset.db)
+
+
+def _get_cache_generation_key(model_name):
+    return '{}-generation'.format(model_name)
+
+
+def _new_cache_generation():
+    # never reuse a generation that might still have values cached under it,
+    # e.g. after memcached evicted the generation counter
+    return int(time.time() * 1000)
+
+
+def get_cache_generation(key):
+    """Returns the generation counter stored under key, which namespaces
+    cached values so that all of them can be dropped at once with
+    bump_cache_generation()
+    """
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_cache_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_cache_generation(key):
+    """Makes values cached under the current generation unreachable"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # nothing cached under this generation yet (or evicted)
+        cache.set(key, _new_cache_generation(), None)
+
+
+def incr_cache_counter(key, delta=1):
+    """Increments a counter kept in the cache that does not expire
+    :returns: int -- new value of the counter
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        return cache.incr(key, delta)
+
+
+def get_resource_list_cache_key(user_id, model_name):
+    """
+        Returns the key of a user's cached list of resources of the given
+        model (see SharableResourceAPIInterface.transform_res_list).
+
+        Keys are namespaced by a per-model generation counter, so that
+        invalidate_cached_object() can drop the lists of all users by
+        bumping the counter instead of deleting one key per user.
+    """
+    generation = get_cache_generation(_get_cache_generation_key(model_name))
+    return '{}-{}-{}'.format(user_id, model_name, generation)
+
+
 def invalidate_cached_object(instance, is_test=False):
     """
         Removes cached objects for all users based on the class name of the
@@ -817,17 +921,20 @@ def invalidate_cached_object(instance, is_test=False):
         DataSets will be deleted to represent the saving, updating,
         deletion, or perms change that was performed upon it.
 
+        Stale lists are not deleted but become unreachable when the
+        generation of the model is bumped and expire from memcached on their
+        own, so the cost does not depend on the number of users.
+
         If the is_test flag is set, a new instance of a mockcache Client
         will be returned
     """
     if not is_test:
         try:
-            cache.delete_many(['{}-{}'.format(user.id, instance.__class__.
-                                              __name__)
-                               for user in User.objects.all()])
-
+            bump_cache_generation(
+                _get_cache_generation_key(instance.__class__.__name__)
+            )
         except Exception as e:
-            logger.debug("Could not delete %s from cache" %
+            logger.debug("Could not delete %s from cache: %s",
                          instance.__class__.__name__, e)
     else:
         from mockcache import Client
@@ -835,6 +942,72 @@ def invalidate_cached_object(instance, is_test=False):
         return mc
 
 
+def _get_sharing_statistics_cache_key(model, active_only):
+    return 'sharing-statistics-{}-{}'.format(model._meta.model_name,
+                                             int(active_only))
+
+
+def _count_shared_resources(model, active_only):
+    resources = model.objects.all()
+    if active_only:
+        resources = resources.filter(is_active=True)
+    # guardian keeps the object IDs of permissions as strings
+    resource_ids = set(
+        str(pk) for pk in resources.values_list('pk', flat=True)
+    )
+    group_permissions = GroupObjectPermission.objects.filter(
+        content_type=ContentType.objects.get_for_model(model)
+    )
+    # same as SharableResource.is_public()
+    public_ids = resource_ids.intersection(group_permissions.filter(
+        Q(permission__codename__startswith='change') |
+        Q(permission__codename__startswith='read'),
+        group_id=core.models.ExtendedGroup.objects.public_group().id
+    ).values_list('object_pk', flat=True).distinct())
+    # resources with permissions for more than one group
+    shared_ids = resource_ids.intersection(group_permissions.values(
+        'object_pk'
+    ).annotate(
+        group_count=Count('group', distinct=True)
+    ).filter(
+        group_count__gt=1
+    ).values_list('object_pk', flat=True))
+
+    total = len(resource_ids)
+    public = len(public_ids)
+    private_shared = len(shared_ids - public_ids)
+    return {
+        'total': total, 'public': public,
+        'private': total - public - private_shared,
+        'private_shared': private_shared
+    }
+
+
+def get_sharing_statistics(model, active_only=False, refresh=False):
+    """Return the number of public, shared and private resources of a
+    SharableResource model
+    Counts are computed with a few aggregate queries over the group
+    permissions and cached for SHARING_STATISTICS_CACHE_TIMEOUT
+    :param active_only: only count resources that are active (Workflows)
+    :param refresh: recompute the cached counts
+    """
+    cache_key = _get_sharing_statistics_cache_key(model, active_only)
+    summary = None if refresh else cache.get(cache_key)
+    if summary is None:
+        summary = _count_shared_resources(model, active_only)
+        cache.set(cache_key, summary, SHARING_STATISTICS_CACHE_TIMEOUT)
+    return summary
+
+
+def update_sharing_statistics():
+    """Refresh the cached counts of all models in the statistics API"""
+    for model, active_only in ((core.models.DataSet, False),
+                               (core.models.Project, False),
+                               (core.models.Workflow, False),
+                               (core.models.Workflow, True)):
+        get_sharing_statistics(model, active_only, refresh=True)
+
+
 def get_absolute_url(string):
     """Creates an absolute URL from a relative URL using the current Site
     domain and REFINERY_URL_SCHEME Django setting
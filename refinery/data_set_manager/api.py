@@ -4,6 +4,8 @@ Created on Nov 29, 2012
 @author: nils
 '''
 
+from django.db.models import Prefetch
+
 from tastypie import fields
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
 from tastypie.resources import ModelResource
@@ -13,6 +15,22 @@ from .models import (Assay, Attribute, Investigation, Node, Protocol,
                      Publication, Study)
 
 
+def get_organism_attributes_prefetch():
+    """Prefetch only the non-empty organism Attributes of Nodes into
+    Node.attribute_set (as exposed by NodeResource)
+    """
+    return Prefetch(
+        'attribute_set',
+        queryset=Attribute.objects.exclude(
+            value__isnull=True
+        ).exclude(
+            value__exact=''
+        ).filter(
+            subtype='organism'
+        )
+    )
+
+
 class AttributeResource(ModelResource):
     node = fields.ForeignKey('core.api.NodeResource', 'node', use_in='all')
 
@@ -144,11 +162,14 @@ class StudyResource(ModelResource):
     sources = fields.ToManyField(
         'core.api.NodeResource',
         attribute=lambda bundle: (
-            Node.objects
-                .filter(
-                    study=bundle.obj,
-                    type='Source Name'
-                )
+            Node.objects.filter(
+                study=bundle.obj,
+                type='Source Name'
+            ).select_related(
+                'study', 'assay'
+            ).prefetch_related(
+                'parents', get_organism_attributes_prefetch()
+            )
         ),
         full=True,
         null=True
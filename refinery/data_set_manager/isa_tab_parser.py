@@ -4,7 +4,7 @@ Created on May 11, 2012
 @author: nils
 '''
 
-from collections import deque
+from collections import OrderedDict, deque
 import csv
 import glob
 import itertools
@@ -13,18 +13,24 @@ import os
 import re
 import string
 import tempfile
+import time
+import uuid
 from zipfile import ZipFile
 
 from file_store.models import FileStoreItem
 from file_store.tasks import import_file
 
 from .models import (Assay, Attribute, Contact, Design, Factor, Investigation,
-                     Node, Ontology, Protocol, ProtocolReference,
-                     ProtocolReferenceParameter, Publication, Study)
+                     ISATabImportJob, Node, Ontology, Protocol,
+                     ProtocolReference, ProtocolReferenceParameter,
+                     Publication, Study)
 from .utils import fix_last_column
 
 logger = logging.getLogger(__name__)
 
+# number of objects inserted per query in bulk mode
+BULK_CREATE_BATCH_SIZE = 1000
+
 
 class ParserException(Exception):
     pass
@@ -253,7 +259,11 @@ class IsaTabParser:
     }
 
     def __init__(self, file_source_translator,
-                 additional_raw_data_file_extension=None):
+                 additional_raw_data_file_extension=None, bulk=False):
+        """If bulk is True the node graph (nodes, parent/child links,
+        attributes, protocol references and file store items) is built in
+        memory while parsing and written with bulk inserts at the end of run()
+        """
         self.file_source_translator = file_source_translator
         # TODO: remove this temporary fix to deal with ISA-Tab from
         # ArrayExpress (see also _parse_node)
@@ -273,6 +283,19 @@ class IsaTabParser:
         self._current_reader = None
         self._current_file = None
         self._current_file_name = None
+        self._current_protocol_reference_parameters = None
+        self._protocols = {}
+        # bulk mode
+        self.bulk = bulk
+        self.timings = OrderedDict()
+        self._bulk_nodes = []
+        self._bulk_node_lookup = {}
+        self._bulk_parents = []
+        self._bulk_parent_lookup = set()
+        self._bulk_attributes = []
+        self._bulk_node_attributes = {}
+        self._bulk_file_store_items = []
+        self._bulk_protocol_references = []
 
     def _split_header(self, header):
         return [x.strip() for x in header.replace("]", "").strip().split("[")]
@@ -307,13 +330,11 @@ class IsaTabParser:
                 len(node_name) > 0) or \
                 (header_components[0] in Node.FILES and len(node_name) > 0):
             if header_components[0] in {Node.SAMPLE, Node.SOURCE}:
-                node, is_new = Node.objects.get_or_create(
-                    study=self._current_study,
+                node, is_new = self._get_or_create_node(
                     type=header_components[0],
                     name=node_name)
             else:
-                node, is_new = Node.objects.get_or_create(
-                    study=self._current_study,
+                node, is_new = self._get_or_create_node(
                     assay=self._current_assay,
                     type=header_components[0],
                     name=node_name)
@@ -324,25 +345,14 @@ class IsaTabParser:
                     node_name is not ""):
                 # create the nodes for the data file in this row
                 file_path = self.file_source_translator(node_name)
-                file_store_item = FileStoreItem.objects.create(
-                    source=file_path
-                )
-                if file_store_item:
-                    node.file_uuid = file_store_item.uuid
-                    node.save()
-                else:
-                    raise ParserException(
-                        "Unable to add {} to file store as a temporary file."
-                        .format(file_path)
-                    )
+                self._create_file_store_item(node, file_path)
             if is_new:
-                logger.info("New node %s created", str(node))
+                logger.info("New node %s: %s created", node.type, node.name)
             else:
-                logger.info("Node %s retrieved", str(node))
+                logger.info("Node %s: %s retrieved", node.type, node.name)
         else:
             if len(node_name) > 0:
-                node = Node.objects.create(
-                    study=self._current_study,
+                node = self._create_node(
                     assay=self._current_assay,
                     type=header_components[0],
                     name=node_name)
@@ -353,15 +363,7 @@ class IsaTabParser:
         self._current_node = node
 
         if self._previous_node is not None and self._current_node is not None:
-            try:
-                # test if the node has already been created (??? why not use an
-                # if statement ???)
-                node.parents.get(to_node_id=self._previous_node.id)
-            except:
-                self._previous_node.children.add(node)
-                node.parents.add(self._previous_node)
-                node.save()
-                self._previous_node.save()
+            self._add_parent_node(node, self._previous_node)
         else:
             # TODO: look up parent nodes in DB
             pass
@@ -388,12 +390,108 @@ class IsaTabParser:
                 # can't be attached to anything
                 row.popleft()
         if self._current_node is not None:
-            node.save()
+            if not self.bulk:
+                node.save()
             self._previous_node = node
             self._current_node = None
 
         return node
 
+    def _get_or_create_node(self, **kwargs):
+        """Returns a tuple of the node matching the given fields in the current
+        study and a flag indicating whether it was newly created
+        """
+        kwargs["study"] = self._current_study
+        if not self.bulk:
+            return Node.objects.get_or_create(**kwargs)
+
+        assay = kwargs.get("assay")
+        key = (
+            kwargs["study"].id,
+            None if assay is None else assay.id,
+            kwargs["type"],
+            kwargs["name"]
+        )
+        try:
+            return self._bulk_node_lookup[key], False
+        except KeyError:
+            node = self._create_node(**kwargs)
+            self._bulk_node_lookup[key] = node
+            return node, True
+
+    def _create_node(self, **kwargs):
+        kwargs["study"] = self._current_study
+        if not self.bulk:
+            return Node.objects.create(**kwargs)
+
+        # UUID is needed to refer to the node before it has been saved
+        node = Node(uuid=str(uuid.uuid4()), **kwargs)
+        self._bulk_nodes.append(node)
+        self._bulk_node_attributes[node.uuid] = []
+        return node
+
+    def _create_file_store_item(self, node, file_path):
+        if not self.bulk:
+            file_store_item = FileStoreItem.objects.create(source=file_path)
+            if file_store_item:
+                node.file_uuid = file_store_item.uuid
+                node.save()
+            else:
+                raise ParserException(
+                    "Unable to add {} to file store as a temporary file."
+                    .format(file_path)
+                )
+        else:
+            file_store_item = FileStoreItem(
+                source=file_path, uuid=str(uuid.uuid4())
+            )
+            self._bulk_file_store_items.append(file_store_item)
+            node.file_uuid = file_store_item.uuid
+
+    def _add_parent_node(self, node, parent):
+        """Links node and parent unless they are linked already"""
+        if not self.bulk:
+            try:
+                # test if the node has already been created (??? why not use an
+                # if statement ???)
+                node.parents.get(to_node_id=parent.id)
+            except:
+                parent.children.add(node)
+                node.parents.add(parent)
+                node.save()
+                parent.save()
+        elif (node.uuid, parent.uuid) not in self._bulk_parent_lookup:
+            self._bulk_parent_lookup.add((node.uuid, parent.uuid))
+            self._bulk_parents.append((node.uuid, parent.uuid))
+
+    def _has_attribute(self, type, value, subtype=None):
+        """Tests if the current node already has an attribute with these
+        properties (subtype is ignored if it is None)
+        """
+        if not self.bulk:
+            attributes = self._current_node.attribute_set.filter(
+                type=type, value=value
+            )
+            if subtype is not None:
+                attributes = attributes.filter(subtype=subtype)
+            return attributes.count() > 0
+
+        for attribute in self._bulk_node_attributes[self._current_node.uuid]:
+            if (attribute.type == type and attribute.value == value and
+                    (subtype is None or attribute.subtype == subtype)):
+                return True
+        return False
+
+    def _save_attribute(self, attribute):
+        if not self.bulk:
+            attribute.node = self._current_node
+            attribute.save()
+        else:
+            self._bulk_attributes.append((self._current_node.uuid, attribute))
+            self._bulk_node_attributes[self._current_node.uuid].append(
+                attribute
+            )
+
     def _parse_attribute(self, headers, row):
         """row is a deque, column header is at position len(headers) - len(row)
         """
@@ -409,25 +507,15 @@ class IsaTabParser:
 
         # test if the current node already has an attribute with these
         # properties
-        has_attribute = False
-
         if len(header_components) > 1:
-            if self._current_node.attribute_set.filter(
-                    type=header_components[0],
-                    value=row[0],
-                    subtype=header_components[1]
-            ).count() > 0:
-                has_attribute = True
+            has_attribute = self._has_attribute(
+                header_components[0], row[0], header_components[1]
+            )
         else:
-            if self._current_node.attribute_set.filter(
-                    type=header_components[0],
-                    value=row[0]
-            ).count() > 0:
-                has_attribute = True
+            has_attribute = self._has_attribute(header_components[0], row[0])
         # add attribute if it does not exist yet
         if not has_attribute:
-            attribute = Attribute.objects.create(node=self._current_node)
-            attribute.study = self._current_study
+            attribute = Attribute()
             attribute.type = header_components[0]
             attribute.value = row[0]
 
@@ -463,7 +551,7 @@ class IsaTabParser:
 
         if not has_attribute:
             # done
-            attribute.save()
+            self._save_attribute(attribute)
             return attribute
 
         # remove the attribute from the row
@@ -472,37 +560,17 @@ class IsaTabParser:
     def _parse_protocol_reference(self, headers, row):
 
         if self.is_protocol_reference(headers[-len(row)]):
-
+            protocol_key = (self._current_study.id, row[0])
             try:
-                protocol = self._current_study.protocol_set.get(name=row[0])
-                # if protocol is None:
-            except:
-                if self.ignore_missing_protocols:
-                    protocol, is_created = Protocol.objects.get_or_create(
-                        name=row[0],
-                        study=self._current_study)
-                    logger.info(
-                        "Undeclared protocol " + row[0] + " when parsing term "
-                        "protocol in line " +
-                        str(self._current_reader.line_num) + ", column " +
-                        str(len(headers) - len(row)) + "." + " This protocol "
-                        "was created since the parser is being run with "
-                        "ignore_missing_protocols = True.")
-                else:
-                    raise ParserException(
-                        "Undeclared protocol {} when parsing term "
-                        "protocol in line {}, column {}. An attempt to "
-                        "create this protocol failed.".format(
-                            row[0],
-                            self._current_reader.line_num,
-                            len(headers) - len(row)
-                        )
-                    )
+                protocol = self._protocols[protocol_key]
+            except KeyError:
+                protocol = self._get_protocol(headers, row)
+                self._protocols[protocol_key] = protocol
 
-            protocol_reference = ProtocolReference.objects.create(
-                node=self._current_node,
-                protocol=protocol)
+            protocol_reference = ProtocolReference(protocol=protocol)
             self._current_protocol_reference = protocol_reference
+            parameters = []
+            self._current_protocol_reference_parameters = parameters
 
             row.popleft()
 
@@ -521,9 +589,48 @@ class IsaTabParser:
                 else:
                     pass
 
-            protocol_reference.save()
+            if not self.bulk:
+                protocol_reference.node = self._current_node
+                protocol_reference.save()
+                for parameter in parameters:
+                    parameter.protocol_reference = protocol_reference
+                    parameter.save()
+            else:
+                self._bulk_protocol_references.append(
+                    (self._current_node.uuid, protocol_reference, parameters)
+                )
             return protocol_reference
 
+    def _get_protocol(self, headers, row):
+        """Returns the protocol of the current study named in the protocol
+        reference column
+        """
+        try:
+            return self._current_study.protocol_set.get(name=row[0])
+        except:
+            if self.ignore_missing_protocols:
+                protocol, is_created = Protocol.objects.get_or_create(
+                    name=row[0],
+                    study=self._current_study)
+                logger.info(
+                    "Undeclared protocol " + row[0] + " when parsing term "
+                    "protocol in line " +
+                    str(self._current_reader.line_num) + ", column " +
+                    str(len(headers) - len(row)) + "." + " This protocol "
+                    "was created since the parser is being run with "
+                    "ignore_missing_protocols = True.")
+                return protocol
+            else:
+                raise ParserException(
+                    "Undeclared protocol {} when parsing term "
+                    "protocol in line {}, column {}. An attempt to "
+                    "create this protocol failed.".format(
+                        row[0],
+                        self._current_reader.line_num,
+                        len(headers) - len(row)
+                    )
+                )
+
     def _parse_protocol_reference_parameter(self, headers, row):
         header_components = self._split_header(headers[-len(row)])
 
@@ -532,8 +639,7 @@ class IsaTabParser:
         # ISA-Tab Spec 5.4.2)
         # assert(len(header_components)) > 1 and <= 3
 
-        parameter = ProtocolReferenceParameter.objects.create(
-            protocol_reference=self._current_protocol_reference)
+        parameter = ProtocolReferenceParameter()
         parameter.name = header_components[1]
         parameter.value = row[0]
 
@@ -552,7 +658,7 @@ class IsaTabParser:
             parameter.value_accession = unit_information["accession"]
             parameter.value_source = unit_information["source"]
         # done
-        parameter.save()
+        self._current_protocol_reference_parameters.append(parameter)
         return parameter
 
     def _parse_term_information(self, headers, row):
@@ -926,14 +1032,19 @@ class IsaTabParser:
             if section_title is None:
                 return
 
-    def run(self, path, isa_archive=None, preisa_archive=None):
+    def run(self, path, isa_archive=None, preisa_archive=None,
+            phase_callback=None):
         """If path is a file it will be treated as an ISArchive, if it is a
         directory it will be treated as an extracted ISArchive. Assumes that
         the archive extracts into a subdirectory named <archive> if the
         ISArchive is called <archive>.zip.
+        phase_callback is called with ISATabImportJob.EXTRACT and PARSE when
+        these phases start
         """
         # 1. test if archive needs to be extracted and extract if necessary
         if not os.path.isdir(path):
+            if phase_callback:
+                phase_callback(ISATabImportJob.EXTRACT)
             # assign to isa_archive if it's an archive anyway
             isa_archive = path
             logger.info(
@@ -975,6 +1086,8 @@ class IsaTabParser:
                     "Unable to extract assumed ISArchive file {!r}."
                     .format(path)
                 )
+        if phase_callback:
+            phase_callback(ISATabImportJob.PARSE)
         # 2. identify investigation file
         try:
             investigation_file_name = glob.glob("%s/i*.txt" % path).pop()
@@ -987,6 +1100,7 @@ class IsaTabParser:
             )
         # 3. parse investigation file and identify study files and
         # corresponding assay files
+        start = time.time()
         self._parse_investigation_file(investigation_file_name)
         # 4. parse all study files and corresponding assay files
         if self._current_investigation is not None:
@@ -1009,6 +1123,14 @@ class IsaTabParser:
                 "No investigation was identified when parsing investigation "
                 "file \"" + investigation_file_name + "\""
             )
+        self.timings["parse"] = time.time() - start
+        if self.bulk:
+            self._write_bulk_graph()
+        logger.info(
+            "Parsed ISA-Tab in %s",
+            ", ".join("{}: {:.3f} sec".format(phase, duration)
+                      for phase, duration in self.timings.iteritems())
+        )
         # 5. assign ISA-Tab archive and pre-ISA-Tab archive if present
         if isa_archive:
             file_store_item = FileStoreItem.objects.create(source=isa_archive)
@@ -1027,6 +1149,80 @@ class IsaTabParser:
         self._current_investigation.save()
         return self._current_investigation
 
+    def _write_bulk_graph(self):
+        """Inserts the node graph collected in bulk mode into the database"""
+        start = time.time()
+        filetypes = {}
+        for file_store_item in self._bulk_file_store_items:
+            # bulk_create() does not call save()
+            file_store_item.prepare_for_save(filetypes)
+        FileStoreItem.objects.bulk_create(
+            self._bulk_file_store_items, batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        self.timings["file store items"] = time.time() - start
+
+        start = time.time()
+        Node.objects.bulk_create(
+            self._bulk_nodes, batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        # bulk_create() does not set primary keys
+        node_ids = dict(
+            Node.objects.filter(
+                study__investigation=self._current_investigation
+            ).values_list("uuid", "id")
+        )
+        self.timings["nodes"] = time.time() - start
+
+        start = time.time()
+        Node.children.through.objects.bulk_create(
+            [Node.children.through(from_node_id=node_ids[parent_uuid],
+                                   to_node_id=node_ids[node_uuid])
+             for node_uuid, parent_uuid in self._bulk_parents],
+            batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        Node.parents.through.objects.bulk_create(
+            [Node.parents.through(from_node_id=node_ids[node_uuid],
+                                  to_node_id=node_ids[parent_uuid])
+             for node_uuid, parent_uuid in self._bulk_parents],
+            batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        self.timings["node links"] = time.time() - start
+
+        start = time.time()
+        for node_uuid, attribute in self._bulk_attributes:
+            attribute.node_id = node_ids[node_uuid]
+        Attribute.objects.bulk_create(
+            [attribute for node_uuid, attribute in self._bulk_attributes],
+            batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        self.timings["attributes"] = time.time() - start
+
+        start = time.time()
+        protocol_references = []
+        for node_uuid, protocol_reference, parameters in \
+                self._bulk_protocol_references:
+            protocol_reference.node_id = node_ids[node_uuid]
+            if parameters:
+                # primary key is required to link the parameters
+                protocol_reference.save()
+                for parameter in parameters:
+                    parameter.protocol_reference = protocol_reference
+                ProtocolReferenceParameter.objects.bulk_create(parameters)
+            else:
+                protocol_references.append(protocol_reference)
+        ProtocolReference.objects.bulk_create(
+            protocol_references, batch_size=BULK_CREATE_BATCH_SIZE
+        )
+        self.timings["protocol references"] = time.time() - start
+
+        logger.info(
+            "Inserted %s nodes, %s node links, %s attributes, %s protocol "
+            "references and %s file store items",
+            len(self._bulk_nodes), len(self._bulk_parents),
+            len(self._bulk_attributes), len(self._bulk_protocol_references),
+            len(self._bulk_file_store_items)
+        )
+
     # Utility Functions
     def is_multiline_start(self, string):
         start_quote = False
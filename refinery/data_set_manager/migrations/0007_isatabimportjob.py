@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data_set_manager', '0006_auto_20180124_1042'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ISATabImportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('uuid', django_extensions.db.fields.UUIDField(
+                    unique=True, max_length=36, editable=False, blank=True)),
+                ('source', models.CharField(max_length=1024)),
+                ('path', models.CharField(max_length=1024)),
+                ('identity_id', models.CharField(max_length=255, null=True,
+                                                 blank=True)),
+                ('checksum', models.CharField(db_index=True, max_length=32,
+                                              blank=True)),
+                ('phase', models.CharField(
+                    default='PENDING', max_length=10,
+                    choices=[('PENDING', 'Pending'),
+                             ('DOWNLOAD', 'Downloading archive'),
+                             ('EXTRACT', 'Extracting archive'),
+                             ('PARSE', 'Parsing ISA-Tab'),
+                             ('ANNOTATE', 'Annotating nodes'),
+                             ('INDEX', 'Indexing data set'),
+                             ('SUCCESS', 'Imported'),
+                             ('FAILURE', 'Failed')])),
+                ('message', models.TextField(blank=True)),
+                ('data_set_uuid', django_extensions.db.fields.UUIDField(
+                    max_length=36, null=True, editable=False, blank=True)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
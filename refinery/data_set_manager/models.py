@@ -3,13 +3,20 @@ Created on May 10, 2012
 
 @author: nils
 '''
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import os
+import shutil
+import tempfile
+import time
 
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
 from celery.result import AsyncResult
 from django_extensions.db.fields import UUIDField
@@ -17,9 +24,10 @@ import requests
 from requests.exceptions import HTTPError
 
 import core
-from core.utils import delete_analysis_index, skip_if_test_run
+from core.utils import (bump_cache_generation, delete_analysis_index,
+                        get_cache_generation, skip_if_test_run)
 import data_set_manager
-from file_store.models import FileStoreItem
+from file_store.models import FileStoreItem, get_temp_dir
 
 """
 TODO: Refactor import data_set_manager. Importing
@@ -844,7 +852,11 @@ def _is_ignored_attribute(attribute):
     return attribute in ["django_ct", "django_id", "id"]
 
 
-def _query_solr(study, assay, attribute=None):
+# facet cardinalities of an assay's Solr fields are kept this long (seconds)
+FACET_CARDINALITY_CACHE_TIMEOUT = 60 * 60
+
+
+def _query_solr(study, assay, attributes=None, facet_limit=-1):
     types = ' OR '.join(
         '"{0}"'.format(type) for type in Node.FILES
     )
@@ -868,12 +880,12 @@ def _query_solr(study, assay, attribute=None):
         'wt': 'json'
     }
 
-    if attribute is not None:
+    if attributes:
         params.update({
             'facet': 'true',
-            'facet.field': attribute,
+            'facet.field': list(attributes),
             'facet.sort': 'count',
-            'facet.limit': '-1'
+            'facet.limit': facet_limit
         })
 
     # This log tends to be massive and spams the log file. Turn on only when
@@ -882,7 +894,9 @@ def _query_solr(study, assay, attribute=None):
 
     headers = {'Accept': 'application/json'}
     try:
-        response = requests.get(url, params=params, headers=headers)
+        # POST, since a facet request for all fields of an assay can exceed
+        # the maximum length of a URL
+        response = requests.post(url, data=params, headers=headers)
         response.raise_for_status()
     except HTTPError as e:
         logger.error(e)
@@ -900,21 +914,76 @@ def _query_solr(study, assay, attribute=None):
     return results
 
 
-def _is_facet_attribute(attribute, study, assay):
+def _get_facet_cardinality_cache_key(assay_uuid):
+    return "facet-cardinalities-{}".format(assay_uuid)
+
+
+def invalidate_facet_cardinalities(assay_uuids):
+    cache.delete_many([_get_facet_cardinality_cache_key(assay_uuid)
+                       for assay_uuid in assay_uuids])
+
+
+def _get_assay_index_version_key(assay_uuid):
+    return "assay-index-version-{}".format(assay_uuid)
+
+
+def get_assay_index_version(assay_uuid):
+    """Returns the version of the Solr documents and attribute order of an
+    assay, which namespaces cached responses of the assay's files
+    """
+    return get_cache_generation(_get_assay_index_version_key(assay_uuid))
+
+
+def invalidate_assay_index_versions(assay_uuids):
+    """Bumps the versions of assays whose Solr documents or attribute order
+    changed, so that their cached responses are no longer used
+    """
+    for assay_uuid in set(assay_uuids):
+        bump_cache_generation(_get_assay_index_version_key(assay_uuid))
+
+
+def _get_facet_cardinalities(attributes, items, study, assay):
+    """Counts the values of several attributes with a single facet request.
+    Counts are capped at the number of items, which is all _is_facet_attribute
+    needs, and cached per assay until the assay is re-indexed.
+    :param attributes: The names of the attributes.
+    :type attributes: list
+    :param items: The number of items in the assay.
+    :type items: int
+    :returns: dict of attribute name to number of values.
+    """
+    cache_key = _get_facet_cardinality_cache_key(assay.uuid)
+    cached = cache.get(cache_key)
+    if cached is not None and cached['items'] == items:
+        cardinalities = cached['cardinalities']
+    else:
+        cardinalities = {}
+
+    missing_attributes = [attribute for attribute in attributes
+                          if attribute not in cardinalities]
+    if missing_attributes:
+        results = _query_solr(study, assay, attributes=missing_attributes,
+                              facet_limit=items)
+        facet_fields = results['facet_counts']['facet_fields']
+        for attribute in missing_attributes:
+            cardinalities[attribute] = len(facet_fields[attribute]) / 2
+        cache.set(cache_key, {'items': items, 'cardinalities': cardinalities},
+                  FACET_CARDINALITY_CACHE_TIMEOUT)
+
+    return cardinalities
+
+
+def _is_facet_attribute(attribute_values, items):
     """Tests if a an attribute should be used as a facet by default.
-    :param attribute: The name of the attribute.
-    :type attribute: string
+    :param attribute_values: The number of values of the attribute.
+    :type attribute_values: int
+    :param items: The number of items in the data set.
+    :type items: int
     :returns: True if the ratio between items in the data set and the number of
     facet attribute values is smaller than
     settings.DEFAULT_FACET_ATTRIBUTE_VALUES_RATIO, false otherwise.
     """
     ratio = 0.5
-    results = _query_solr(attribute=attribute, study=study, assay=assay)
-    items = results['response']['numFound']
-    attribute_values = len(
-        results['facet_counts']['facet_fields'][attribute]
-    ) / 2
-
     return (attribute_values / items) < ratio
 
 
@@ -928,29 +997,33 @@ def initialize_attribute_order(study, assay):
     :type assay: Assay
     :returns: Number of attributes that were indexed.
     """
+    start = time.time()
     results = _query_solr(study=study, assay=assay)
+    items = results['response']['numFound']
+    attributes = [key for key in results['response']['docs'][0]
+                  if not _is_ignored_attribute(key)]
+    cardinalities = _get_facet_cardinalities(attributes, items, study, assay)
 
     attribute_order_objects = []
-    for key in results['response']['docs'][0]:
-        is_facet = _is_facet_attribute(key, study, assay)
-        is_exposed = _is_exposed_attribute(key)
-        is_internal = _is_internal_attribute(key)
-        is_active = _is_active_attribute(key)
-        if not _is_ignored_attribute(key):
-            attribute_order_objects.append(
-                AttributeOrder(
-                    study=study,
-                    assay=assay,
-                    solr_field=key,
-                    rank=0,
-                    is_facet=is_facet,
-                    is_exposed=is_exposed,
-                    is_internal=is_internal,
-                    is_active=is_active
-                )
+    for key in attributes:
+        attribute_order_objects.append(
+            AttributeOrder(
+                study=study,
+                assay=assay,
+                solr_field=key,
+                rank=0,
+                is_facet=_is_facet_attribute(cardinalities[key], items),
+                is_exposed=_is_exposed_attribute(key),
+                is_internal=_is_internal_attribute(key),
+                is_active=_is_active_attribute(key)
             )
+        )
     # insert AttributeOrder objects into database
     AttributeOrder.objects.bulk_create(attribute_order_objects)
+    invalidate_assay_index_versions([assay.uuid])
+
+    logger.info("Initialized %s attribute orders for assay %s in %s sec",
+                len(attribute_order_objects), assay.uuid, time.time() - start)
 
     return len(attribute_order_objects)
 
@@ -980,3 +1053,145 @@ class ProtocolReferenceParameter(models.Model):
 
     def __unicode__(self):
         return unicode(self.name) + " = " + unicode(self.value)
+
+
+ISA_TAB_IMPORT_PHASE_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+# active jobs that did not change phase for this long are assumed to have
+# been lost, e.g. because the worker was killed
+ISA_TAB_IMPORT_STALE_TIMEOUT = 6 * 60 * 60  # seconds
+
+
+class ISATabImportJob(models.Model):
+    """Import of an ISA-Tab archive running in a Celery worker
+    The current phase is published through the cache while the import
+    transaction is open and stored in the database once the job finishes
+    """
+    PENDING = 'PENDING'
+    DOWNLOAD = 'DOWNLOAD'
+    EXTRACT = 'EXTRACT'
+    PARSE = 'PARSE'
+    ANNOTATE = 'ANNOTATE'
+    INDEX = 'INDEX'
+    SUCCESS = 'SUCCESS'
+    FAILURE = 'FAILURE'
+    PHASES = (
+        (PENDING, 'Pending'),
+        (DOWNLOAD, 'Downloading archive'),
+        (EXTRACT, 'Extracting archive'),
+        (PARSE, 'Parsing ISA-Tab'),
+        (ANNOTATE, 'Annotating nodes'),
+        (INDEX, 'Indexing data set'),
+        (SUCCESS, 'Imported'),
+        (FAILURE, 'Failed')
+    )
+    ACTIVE_PHASES = (PENDING, DOWNLOAD, EXTRACT, PARSE, ANNOTATE, INDEX)
+    # prefix of the temp directories holding the archives of single jobs
+    ARCHIVE_DIR_PREFIX = 'isa-tab-import-'
+
+    uuid = UUIDField(unique=True, auto=True)
+    user = models.ForeignKey(User)
+    #: URL or name of the uploaded file
+    source = models.CharField(max_length=1024)
+    #: temporary file the archive is (downloaded) to
+    path = models.CharField(max_length=1024)
+    identity_id = models.CharField(max_length=255, blank=True, null=True)
+    #: MD5 of the archive, known after uploading or downloading it
+    checksum = models.CharField(max_length=32, blank=True, db_index=True)
+    phase = models.CharField(max_length=10, choices=PHASES, default=PENDING)
+    message = models.TextField(blank=True)
+    data_set_uuid = UUIDField(blank=True, null=True, auto=False)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    modification_date = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "{} ({})".format(self.source, self.phase)
+
+    def _get_phase_cache_key(self):
+        return 'isa_tab_import_phase_{}'.format(self.uuid)
+
+    def is_url(self):
+        return self.source.startswith(('http://', 'https://', 'ftp://'))
+
+    @classmethod
+    def make_archive_path(cls, file_name):
+        """Returns a path for an archive in a new temp directory, so that
+        queued jobs importing archives with the same name don't overwrite
+        each other's files
+        """
+        directory = tempfile.mkdtemp(prefix=cls.ARCHIVE_DIR_PREFIX,
+                                     dir=get_temp_dir())
+        return os.path.join(directory,
+                            os.path.basename(file_name) or 'archive.zip')
+
+    def remove_archive(self):
+        """Delete the archive along with its temp directory"""
+        directory = os.path.dirname(self.path)
+        try:
+            if os.path.basename(directory).startswith(
+                    self.ARCHIVE_DIR_PREFIX):
+                shutil.rmtree(directory)
+            else:  # queued before jobs had directories of their own
+                os.unlink(self.path)
+        except OSError as exc:
+            logger.error("Couldn't remove ISA-Tab file '%s': %s",
+                         self.path, exc)
+
+    def get_duplicate(self):
+        """Returns another active import of the same archive by the same
+        user or None
+        """
+        if not self.checksum:
+            return None
+        for job in ISATabImportJob.objects.filter(
+            user=self.user, checksum=self.checksum,
+            phase__in=self.ACTIVE_PHASES
+        ).exclude(pk=self.pk):
+            if not job.fail_if_stale():
+                return job
+        return None
+
+    def fail_if_stale(self):
+        """Marks an active job that has not changed phase for
+        ISA_TAB_IMPORT_STALE_TIMEOUT as failed
+        :returns: bool -- True if the job was marked as failed
+        """
+        if self.phase not in self.ACTIVE_PHASES:
+            return False
+        modification_date = self.modification_date
+        published = cache.get(self._get_phase_cache_key())
+        if published is not None and published.get('modification_date'):
+            # phase changes made inside the import transaction
+            modification_date = max(modification_date,
+                                    published['modification_date'])
+        if timezone.now() - modification_date < timedelta(
+                seconds=ISA_TAB_IMPORT_STALE_TIMEOUT):
+            return False
+        logger.warning("ISA-Tab import job '%s' has not changed phase since "
+                       "%s, marking it as failed", self.uuid,
+                       modification_date)
+        self.set_phase(self.FAILURE, "Import was interrupted")
+        return True
+
+    def set_phase(self, phase, message=''):
+        """Publish the phase of the import immediately and store it"""
+        self.phase = phase
+        self.message = message
+        self.modification_date = timezone.now()
+        cache.set(self._get_phase_cache_key(),
+                  {'phase': phase, 'message': message,
+                   'modification_date': self.modification_date},
+                  ISA_TAB_IMPORT_PHASE_CACHE_TIMEOUT)
+        ISATabImportJob.objects.filter(pk=self.pk).update(
+            phase=phase, message=message, data_set_uuid=self.data_set_uuid,
+            modification_date=self.modification_date
+        )
+
+    def get_phase(self):
+        """Returns (phase, message) including progress not committed to the
+        database yet
+        """
+        if self.phase in self.ACTIVE_PHASES:
+            published = cache.get(self._get_phase_cache_key())
+            if published is not None:
+                return published['phase'], published['message']
+        return self.phase, self.message
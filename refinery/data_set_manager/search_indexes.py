@@ -4,6 +4,7 @@ Created on Jul 2, 2012
 @author: nils
 '''
 
+from collections import Counter, defaultdict
 import logging
 import re
 
@@ -12,12 +13,14 @@ from django.conf import settings
 import celery
 from haystack import indexes
 from haystack.exceptions import SkipDocument
+from pysolr import SolrError
 
 import constants
 import core
 from file_store.models import FileStoreItem
 
-from .models import AnnotatedNode, Assay, Node
+from .models import (AnnotatedNode, Assay, Node,
+                     invalidate_assay_index_versions)
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +51,10 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
                                         null=True)
     # TODO: add modification date (based on registry)
 
+    # relations of the Nodes being indexed by update_objects(), keyed by
+    # Node ID (or by UUID for FileStoreItems and Analyses)
+    _prefetched = None
+
     def get_model(self):
         return Node
 
@@ -71,11 +78,15 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
                     data[key].add(assay_attr)
         return data
 
-    @staticmethod
-    def _check_skip_indexing_conditions(node):
+    def _check_skip_indexing_conditions(self, node):
         if node.type not in Node.INDEXED_FILES:
             raise SkipDocument()
 
+        if self._prefetched is not None:
+            if node.id in self._prefetched["output_node_ids"]:
+                raise SkipDocument()
+            return
+
         try:
             core.models.AnalysisNodeConnection.objects.get(
                 node=node,
@@ -90,6 +101,174 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
         else:
             raise SkipDocument()
 
+    def _get_annotations(self, node):
+        if self._prefetched is not None:
+            return self._prefetched["annotations"].get(node.id, [])
+        return AnnotatedNode.objects.filter(node=node)
+
+    def _get_data_set(self, node):
+        if self._prefetched is not None:
+            data_sets = self._prefetched["data_sets"]
+            if node.study_id not in data_sets:
+                try:
+                    data_sets[node.study_id] = node.study.get_dataset()
+                except RuntimeError as e:
+                    data_sets[node.study_id] = e
+            if isinstance(data_sets[node.study_id], RuntimeError):
+                raise data_sets[node.study_id]
+            return data_sets[node.study_id]
+        return node.study.get_dataset()
+
+    def _get_file_store_item(self, node):
+        if self._prefetched is not None:
+            file_store_item = self._prefetched["file_store_items"].get(
+                node.file_uuid
+            )
+            if file_store_item is None:
+                raise FileStoreItem.DoesNotExist(
+                    "No single FileStoreItem with UUID '{}'".format(
+                        node.file_uuid
+                    )
+                )
+            return file_store_item
+        return FileStoreItem.objects.get(uuid=node.file_uuid)
+
+    def _get_analysis(self, node):
+        if self._prefetched is not None:
+            return self._prefetched["analyses"].get(node.analysis_uuid)
+        return node.get_analysis()
+
+    @staticmethod
+    def _unique_by(objects, key):
+        """Map key -> object, leaving out keys shared by several objects to
+        mirror the MultipleObjectsReturned handling of single lookups
+        """
+        counts = Counter(getattr(obj, key) for obj in objects)
+        return {getattr(obj, key): obj for obj in objects
+                if counts[getattr(obj, key)] == 1}
+
+    def _prefetch(self, nodes, data_sets):
+        """Load the relations prepare() needs for a batch of Nodes"""
+        node_ids = [node.id for node in nodes]
+
+        annotations = defaultdict(list)
+        for annotation in AnnotatedNode.objects.filter(node_id__in=node_ids):
+            annotations[annotation.node_id].append(annotation)
+
+        output_counts = Counter(
+            core.models.AnalysisNodeConnection.objects.filter(
+                node_id__in=node_ids,
+                is_refinery_file=False,
+                direction=core.models.OUTPUT_CONNECTION
+            ).values_list("node_id", flat=True)
+        )
+
+        file_uuids = set(node.file_uuid for node in nodes if node.file_uuid)
+        file_store_items = list(
+            FileStoreItem.objects.filter(
+                uuid__in=file_uuids
+            ).select_related("filetype")
+        )
+
+        analysis_uuids = set(
+            node.analysis_uuid for node in nodes if node.analysis_uuid
+        )
+        analyses = list(
+            core.models.Analysis.objects.filter(uuid__in=analysis_uuids)
+        )
+
+        self._prefetched = {
+            "annotations": annotations,
+            "output_node_ids": set(
+                node_id for node_id, count in output_counts.iteritems()
+                if count == 1
+            ),
+            "file_store_items": self._unique_by(file_store_items, "uuid"),
+            "analyses": self._unique_by(analyses, "uuid"),
+            "data_sets": data_sets
+        }
+
+    def update_objects(self, nodes, using=None, batch_size=None):
+        """Index many Nodes at once
+        Relations needed to build the documents are loaded with a few queries
+        per batch instead of several per Node, documents are posted to Solr
+        batch_size at a time and committed once at the end
+        :param nodes: Node queryset (or list of Nodes)
+        :returns: number of Nodes sent for indexing
+        """
+        if batch_size is None:
+            batch_size = settings.REFINERY_SOLR_INDEX_BATCH_SIZE
+        if hasattr(nodes, "select_related"):
+            nodes = nodes.select_related("study", "assay").iterator()
+
+        backend = self._get_backend(using)
+        if backend is None:
+            return 0
+
+        data_sets = {}  # Study ID -> DataSet, shared by all batches
+        assay_ids = set()
+        counter = 0
+        batch = []
+        for node in nodes:
+            batch.append(node)
+            assay_ids.add(node.assay_id)
+            if len(batch) == batch_size:
+                counter += self._update_batch(backend, batch, data_sets)
+                batch = []
+        if batch:
+            counter += self._update_batch(backend, batch, data_sets)
+
+        if counter:
+            try:
+                backend.conn.commit()
+            except (IOError, SolrError) as e:
+                logger.error("Failed to commit %s indexed Nodes: %s",
+                             counter, e)
+            self._invalidate_assays(assay_ids)
+        return counter
+
+    def _update_batch(self, backend, nodes, data_sets):
+        self._prefetch(nodes, data_sets)
+        try:
+            backend.update(self, nodes, commit=False)
+        finally:
+            self._prefetched = None
+        return len(nodes)
+
+    def update_object(self, instance, using=None, **kwargs):
+        super(NodeIndex, self).update_object(instance, using=using, **kwargs)
+        self._invalidate_assays([instance.assay_id])
+
+    def remove_object(self, instance, using=None, **kwargs):
+        super(NodeIndex, self).remove_object(instance, using=using, **kwargs)
+        self._invalidate_assays([getattr(instance, "assay_id", None)])
+
+    @staticmethod
+    def _invalidate_assays(assay_ids):
+        """Drop the cached responses of assays whose documents changed"""
+        assay_ids = [assay_id for assay_id in assay_ids if assay_id]
+        if assay_ids:
+            invalidate_assay_index_versions(
+                Assay.objects.filter(
+                    id__in=assay_ids
+                ).values_list("uuid", flat=True)
+            )
+
+    def remove_objects(self, query, using=None):
+        """Remove all Node documents matching a Solr query with a single
+        delete-by-query request instead of one request per Node
+        :param query: Solr query, e.g. 'study_uuid:("<uuid>")'
+        """
+        backend = self._get_backend(using)
+        if backend is None:
+            return
+        try:
+            backend.conn.delete(q=query, commit=True)
+        except (IOError, SolrError) as e:
+            logger.error("Failed to remove Nodes matching '%s': %s", query, e)
+        else:
+            logger.debug("Removed Nodes matching '%s'", query)
+
     # dynamic fields:
     # https://groups.google.com/forum/?fromgroups#!topic/django-haystack/g39QjTkN-Yg
     # http://stackoverflow.com/questions/7399871/django-haystack-sort-results-by-title
@@ -97,11 +276,11 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
         self._check_skip_indexing_conditions(node)
 
         data = super(NodeIndex, self).prepare(node)
-        annotations = AnnotatedNode.objects.filter(node=node)
+        annotations = self._get_annotations(node)
         id_suffix = str(node.study.id)
 
         try:
-            data_set = node.study.get_dataset()
+            data_set = self._get_data_set(node)
             data['data_set_uuid'] = data_set.uuid
         except RuntimeError as e:
             logger.warn(e)
@@ -112,7 +291,7 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
         id_suffix = "_" + id_suffix + "_s"
 
         try:
-            file_store_item = FileStoreItem.objects.get(uuid=node.file_uuid)
+            file_store_item = self._get_file_store_item(node)
         except(FileStoreItem.DoesNotExist,
                FileStoreItem.MultipleObjectsReturned) as e:
             logger.error("Couldn't properly fetch FileStoreItem: %s", e)
@@ -130,6 +309,7 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
                     download_url_or_state = constants.NOT_AVAILABLE
 
         data.update(self._assay_data(node))
+        analysis = self._get_analysis(node)
 
         # create dynamic fields for each attribute
         for annotation in annotations:
@@ -176,8 +356,8 @@ class NodeIndex(indexes.SearchIndex, indexes.Indexable):
                 "" if file_store_item is None
                 else file_store_item.filetype,
             NodeIndex.ANALYSIS_UUID_PREFIX + id_suffix:
-                constants.NOT_AVAILABLE if node.get_analysis() is None
-                else node.get_analysis().name,
+                constants.NOT_AVAILABLE if analysis is None
+                else analysis.name,
             NodeIndex.SUBANALYSIS_PREFIX + id_suffix:
                 (-1 if node.subanalysis is None  # TODO: upgrade flake8
                  else node.subanalysis),         # and remove parentheses
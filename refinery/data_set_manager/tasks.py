@@ -26,14 +26,19 @@ from core.utils import (add_data_set_to_neo4j,
                         async_update_annotation_sets_neo4j,
                         update_data_set_index)
 from file_store.models import FileExtension, generate_file_source_translator
+from file_store.tasks import download_file, import_file
 
-from .isa_tab_parser import IsaTabParser
-from .models import Investigation, Node, initialize_attribute_order
+from .isa_tab_parser import IsaTabParser, ParserException
+from .models import (Investigation, ISATabImportJob, Node,
+                     initialize_attribute_order)
 from .utils import (calculate_checksum, fix_last_column, get_node_types,
                     index_annotated_nodes, update_annotated_nodes)
 
 logger = logging.getLogger(__name__)
 
+PARSER_ERROR_MESSAGE = "Improperly structured ISA-Tab file: "
+PARSER_UNEXPECTED_ERROR_MESSAGE = "ISA-Tab import Failure: "
+
 
 def create_dir(file_path):
     """creates a directory if it needs to be created
@@ -194,7 +199,8 @@ def get_arrayexpress_studies():
 
 @task()
 def create_dataset(investigation_uuid, username, identifier=None, title=None,
-                   dataset_name=None, slug=None, public=False):
+                   dataset_name=None, slug=None, public=False,
+                   phase_callback=None):
     """creates (or updates) a dataset with the given investigation and user and
     returns the dataset UUID or None if something went wrong
     Parameters:
@@ -205,6 +211,8 @@ def create_dataset(investigation_uuid, username, identifier=None, title=None,
     set.
     title: If not None, this will be
     public: boolean value that determines if the dataset is public or not
+    phase_callback: called with ISATabImportJob.ANNOTATE and INDEX when these
+    phases start
     """
     # get User for assigning DataSets
     try:
@@ -217,6 +225,8 @@ def create_dataset(investigation_uuid, username, identifier=None, title=None,
         user = User.objects.create_user(username, "", "test")
     if investigation_uuid is None:
         return None  # TODO: make sure this is never happens
+    if phase_callback:
+        phase_callback(ISATabImportJob.ANNOTATE)
     annotate_nodes(investigation_uuid)
     dataset = None
     investigation = Investigation.objects.get(uuid=investigation_uuid)
@@ -261,6 +271,8 @@ def create_dataset(investigation_uuid, username, identifier=None, title=None,
     dataset.file_count = dataset.get_file_count()
     dataset.save()
     # Finally index data set
+    if phase_callback:
+        phase_callback(ISATabImportJob.INDEX)
     update_data_set_index(dataset)
     add_data_set_to_neo4j(dataset, user.id)
     async_update_annotation_sets_neo4j()
@@ -304,7 +316,8 @@ def annotate_nodes(investigation_uuid):
 @task()
 def parse_isatab(username, public, path, identity_id=None,
                  additional_raw_data_file_extension=None, isa_archive=None,
-                 pre_isa_archive=None, file_base_path=None, overwrite=False):
+                 pre_isa_archive=None, file_base_path=None, overwrite=False,
+                 phase_callback=None):
     """parses in an ISA-TAB file to create database entries and creates or
     updates a dataset for the investigation to belong to; returns the dataset
     UUID or None if something went wrong. Use like this: parse_isatab(username,
@@ -320,6 +333,7 @@ def parse_isatab(username, public, path, identity_id=None,
     directory for storage and legacy purposes
     pre_isa_archive: optional copy of files that were converted to ISA-Tab
     file_base_path: if your file locations are relative paths, this is the base
+    phase_callback: called with the ISATabImportJob phase the import enters
     """
     file_source_translator = generate_file_source_translator(
         username=username, base_path=file_base_path, identity_id=identity_id
@@ -327,6 +341,7 @@ def parse_isatab(username, public, path, identity_id=None,
     parser = IsaTabParser(
         file_source_translator=file_source_translator,
         additional_raw_data_file_extension=additional_raw_data_file_extension,
+        bulk=settings.REFINERY_ISA_TAB_BULK_IMPORT
     )
     """Get the study title and investigation id and see if anything is in the
     database and if so compare the checksum
@@ -365,9 +380,8 @@ def parse_isatab(username, public, path, identity_id=None,
                         if fileStoreItem:
                             try:
                                 logger.info("Get file: %s", fileStoreItem)
-                                checksum = calculate_checksum(
-                                    fileStoreItem.datafile
-                                )
+                                # stored when the archive was imported
+                                checksum = fileStoreItem.get_md5()
                             except IOError as exc:
                                 logger.error(
                                     "Original ISA-tab archive wasn't found. "
@@ -389,14 +403,93 @@ def parse_isatab(username, public, path, identity_id=None,
 
     with transaction.atomic():
         investigation = parser.run(
-            path, isa_archive=isa_archive, preisa_archive=pre_isa_archive
+            path, isa_archive=isa_archive, preisa_archive=pre_isa_archive,
+            phase_callback=phase_callback
         )
         data_uuid = create_dataset(
-            investigation.uuid, username, public=public
+            investigation.uuid, username, public=public,
+            phase_callback=phase_callback
         )
         return data_uuid
 
 
+def import_data_set_files(dataset_uuid):
+    """Start importing the uploaded data files of a new data set"""
+    try:
+        dataset = DataSet.objects.get(uuid=dataset_uuid)
+    except (DataSet.DoesNotExist, DataSet.MultipleObjectsReturned):
+        logger.error("Cannot import data files for data set UUID '%s'",
+                     dataset_uuid)
+        return
+    for file_store_item in dataset.get_file_store_items():
+        if file_store_item.source.startswith(
+            (settings.REFINERY_DATA_IMPORT_DIR, 's3://')
+        ):
+            import_file.delay(file_store_item.uuid)
+
+
+@task()
+def import_isatab(job_uuid):
+    """Download (if necessary) and parse the ISA-Tab archive of an
+    ISATabImportJob, publishing the phases of the import as it goes
+    """
+    try:
+        job = ISATabImportJob.objects.select_related('user').get(
+            uuid=job_uuid
+        )
+    except ISATabImportJob.DoesNotExist:
+        logger.error("ISA-Tab import job '%s' does not exist", job_uuid)
+        return
+
+    try:
+        if job.is_url():
+            job.set_phase(ISATabImportJob.DOWNLOAD)
+            try:
+                download_file(job.source, job.path)
+            except RuntimeError as exc:
+                logger.error("Problem downloading ISA-Tab file. %s", exc)
+                job.set_phase(
+                    ISATabImportJob.FAILURE,
+                    "Problem downloading ISA-Tab file from: " + job.source
+                )
+                return
+            with open(job.path, 'rb') as archive:
+                job.checksum = calculate_checksum(archive)
+            ISATabImportJob.objects.filter(pk=job.pk).update(
+                checksum=job.checksum
+            )
+            duplicate = job.get_duplicate()
+            if duplicate is not None:
+                job.set_phase(
+                    ISATabImportJob.FAILURE,
+                    "This ISA-Tab archive is already being imported "
+                    "(job '{}')".format(duplicate.uuid)
+                )
+                return
+        data_set_uuid = parse_isatab(
+            job.user.username, False, job.path,
+            identity_id=job.identity_id, phase_callback=job.set_phase
+        )
+    except ParserException as exc:
+        error_message = PARSER_ERROR_MESSAGE + exc.message
+        logger.error(error_message)
+        job.set_phase(ISATabImportJob.FAILURE, error_message)
+    except Exception as exc:
+        logger.exception("Failed to import ISA-Tab job '%s'", job.uuid)
+        job.set_phase(ISATabImportJob.FAILURE,
+                      PARSER_UNEXPECTED_ERROR_MESSAGE + str(exc))
+    else:
+        if data_set_uuid:
+            import_data_set_files(data_set_uuid)
+            job.data_set_uuid = data_set_uuid
+            job.set_phase(ISATabImportJob.SUCCESS)
+        else:
+            job.set_phase(ISATabImportJob.FAILURE,
+                          "Problem parsing ISA-Tab file")
+    finally:
+        job.remove_archive()
+
+
 @task()
 def generate_auxiliary_file(auxiliary_node, datafile_path,
                             parent_node_file_store_item):
@@ -1,5 +1,6 @@
 from StringIO import StringIO
 import contextlib
+from datetime import timedelta
 import json
 import logging
 import os
@@ -11,12 +12,16 @@ import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.files.uploadedfile import (InMemoryUploadedFile,
                                             SimpleUploadedFile)
 from django.core.management import call_command, CommandError
+from django.db import connection
 from django.db.models import Q
 from django.http import QueryDict
 from django.test import LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from celery.states import FAILURE, PENDING, STARTED, SUCCESS
 from djcelery.models import TaskMeta
@@ -42,18 +47,29 @@ from factory_boy.utils import (create_dataset_with_necessary_models,
 from file_store.models import FileStoreItem, generate_file_source_translator
 from file_store.tasks import import_file
 
-from .models import (AnnotatedNode, Assay, AttributeOrder, Investigation, Node,
-                     Study)
+from .models import (AnnotatedNode, Assay, Attribute, AttributeOrder,
+                     Investigation, ISATabImportJob, Node, Protocol,
+                     ProtocolReference, ProtocolReferenceParameter, Study,
+                     _get_facet_cardinalities, _is_facet_attribute,
+                     get_assay_index_version, invalidate_assay_index_versions,
+                     invalidate_facet_cardinalities)
 from .search_indexes import NodeIndex
 from .serializers import AttributeOrderSerializer
 from .utils import (_create_solr_params_from_node_uuids,
-                    create_facet_filter_query, cull_attributes_from_list,
-                    customize_attribute_response, escape_character_solr,
+                    _get_assay_files_cache_key, _get_attribute_closures,
+                    _retrieve_nodes,
+                    calculate_checksum, create_facet_filter_query,
+                    cull_attributes_from_list,
+                    customize_attribute_response, delete_nodes,
+                    escape_character_solr,
                     format_solr_response, generate_facet_fields_query,
                     generate_filtered_facet_fields,
                     generate_solr_params_for_assay,
-                    get_file_url_from_node_uuid, get_owner_from_assay,
-                    hide_fields_from_list, initialize_attribute_order_ranks,
+                    get_assay_files_cache_metrics, get_assay_files_response,
+                    get_file_url_from_node_uuid, get_node_files,
+                    get_solr_node_pages,
+                    get_owner_from_assay, hide_fields_from_list,
+                    initialize_attribute_order_ranks,
                     insert_facet_field_filter, is_field_in_hidden_list,
                     objectify_facet_field_counts, update_attribute_order_ranks)
 from .views import Assays, AssaysAttributes
@@ -413,14 +429,21 @@ class AssaysFilesAPITests(APITestCase):
         self.url = "/api/v2/assays/%s/files/"
         self.non_meta_attributes = ['REFINERY_DOWNLOAD_URL', 'REFINERY_NAME']
         self.client = APIClient()
+        self.cache = LocMemCache('assay-files', {})
+        self.cache.clear()
+        for module in ('core.utils', 'data_set_manager.utils',
+                       'data_set_manager.models'):
+            cache_patcher = mock.patch(module + '.cache', self.cache)
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
 
     def tearDown(self):
         self.client.logout()
         super(AssaysFilesAPITests, self).tearDown()
 
-    @mock.patch('data_set_manager.views.generate_solr_params_for_assay')
-    @mock.patch('data_set_manager.views.search_solr')
-    @mock.patch('data_set_manager.views.format_solr_response')
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
     def test_get_from_owner_with_valid_params(self,
                                               mock_format,
                                               mock_search,
@@ -438,7 +461,7 @@ class AssaysFilesAPITests(APITestCase):
         self.assertTrue(mock_search.called)
         qdict = QueryDict('', mutable=True)
         qdict.update(params)
-        mock_generate.assert_called_once_with(qdict, uuid)
+        mock_generate.assert_called_once_with(qdict, uuid, [])
         self.assertEqual(response.status_code, 200)
 
     def test_get_from_owner_invalid_params(self):
@@ -451,9 +474,9 @@ class AssaysFilesAPITests(APITestCase):
         response = self.client.get(self.url % uuid, params)
         self.assertEqual(response.status_code, 404)
 
-    @mock.patch('data_set_manager.views.generate_solr_params_for_assay')
-    @mock.patch('data_set_manager.views.search_solr')
-    @mock.patch('data_set_manager.views.format_solr_response')
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
     def test_get_from_user_no_perms(self,
                                     mock_format,
                                     mock_search,
@@ -472,9 +495,9 @@ class AssaysFilesAPITests(APITestCase):
         self.assertFalse(mock_generate.called)
         self.assertEqual(response.status_code, 401)
 
-    @mock.patch('data_set_manager.views.generate_solr_params_for_assay')
-    @mock.patch('data_set_manager.views.search_solr')
-    @mock.patch('data_set_manager.views.format_solr_response')
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
     def test_get_from_user_with_read_perms(self,
                                            mock_format,
                                            mock_search,
@@ -493,12 +516,12 @@ class AssaysFilesAPITests(APITestCase):
         self.assertTrue(mock_search.called)
         qdict = QueryDict('', mutable=True)
         qdict.update(params)
-        mock_generate.assert_called_once_with(qdict, uuid)
+        mock_generate.assert_called_once_with(qdict, uuid, [])
         self.assertEqual(response.status_code, 200)
 
-    @mock.patch('data_set_manager.views.generate_solr_params_for_assay')
-    @mock.patch('data_set_manager.views.search_solr')
-    @mock.patch('data_set_manager.views.format_solr_response')
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
     def test_get_from_user_with_read_meta_perms(self,
                                                 mock_format,
                                                 mock_search,
@@ -523,6 +546,115 @@ class AssaysFilesAPITests(APITestCase):
                                               self.non_meta_attributes)
         self.assertEqual(response.status_code, 200)
 
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
+    def test_get_cached_response(self, mock_format, mock_search,
+                                 mock_generate):
+        mock_format.return_value = {'status': 200}
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        url = self.url % self.valid_uuid
+        self.client.get(url, {'limit': '0', 'sort': 'name asc',
+                              'data_set_uuid': self.data_set.uuid})
+        response = self.client.get(url, {'sort': 'name asc', 'limit': '0',
+                                         'data_set_uuid': self.data_set.uuid})
+        self.assertEqual(response.data, {'status': 200})
+        self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(get_assay_files_cache_metrics(), {
+            'hits': 1, 'coalesced': 0, 'misses': 1, 'hit_ratio': 0.5
+        })
+
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
+    def test_get_after_attribute_order_change(self, mock_format, mock_search,
+                                              mock_generate):
+        mock_format.return_value = {'status': 200}
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        params = {'limit': '0', 'data_set_uuid': self.data_set.uuid}
+        self.client.get(self.url % self.valid_uuid, params)
+        invalidate_assay_index_versions([self.valid_uuid])
+        self.client.get(self.url % self.valid_uuid, params)
+        self.assertEqual(mock_search.call_count, 2)
+
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
+    def test_get_separate_response_for_read_meta_perms(self, mock_format,
+                                                       mock_search,
+                                                       mock_generate):
+        mock_format.return_value = {'status': 200}
+        assign_perm('read_meta_%s' % DataSet._meta.model_name,
+                    self.user2,
+                    self.data_set)
+        params = {'limit': '0', 'data_set_uuid': self.data_set.uuid}
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        self.client.get(self.url % self.valid_uuid, params)
+        self.client.logout()
+        self.client.login(username=self.user_guest,
+                          password=self.fake_password)
+        self.client.get(self.url % self.valid_uuid, params)
+        self.assertEqual(mock_search.call_count, 2)
+
+    @mock.patch('data_set_manager.utils.ASSAY_FILES_COALESCE_INTERVAL', 0)
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    def test_get_assay_files_response_coalesced(self, mock_search,
+                                                mock_generate):
+        params = QueryDict('limit=0')
+        cache_key = _get_assay_files_cache_key(params, self.valid_uuid, [])
+        self.cache.add(cache_key + '-lock', True)
+
+        def finish_first_request(seconds):
+            self.cache.set(cache_key, {'status': 200})
+
+        with mock.patch('data_set_manager.utils.time.sleep',
+                        side_effect=finish_first_request):
+            response = get_assay_files_response(params, self.valid_uuid)
+        self.assertEqual(response, {'status': 200})
+        self.assertFalse(mock_search.called)
+        self.assertEqual(get_assay_files_cache_metrics()['coalesced'], 1)
+
+    @mock.patch('data_set_manager.utils.ASSAY_FILES_COALESCE_INTERVAL', 0)
+    @mock.patch('data_set_manager.utils.generate_solr_params_for_assay')
+    @mock.patch('data_set_manager.utils.search_solr')
+    @mock.patch('data_set_manager.utils.format_solr_response')
+    def test_get_assay_files_response_after_first_request_failed(
+            self, mock_format, mock_search, mock_generate):
+        mock_format.return_value = {'status': 200}
+        params = QueryDict('limit=0')
+        cache_key = _get_assay_files_cache_key(params, self.valid_uuid, [])
+        self.cache.add(cache_key + '-lock', True)
+
+        def fail_first_request(seconds):
+            self.cache.delete(cache_key + '-lock')
+
+        with mock.patch('data_set_manager.utils.time.sleep',
+                        side_effect=fail_first_request):
+            response = get_assay_files_response(params, self.valid_uuid)
+        self.assertEqual(response, {'status': 200})
+        self.assertTrue(mock_search.called)
+
+    def test_get_cache_metrics_requires_admin(self):
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        response = self.client.get('/api/v2/assays/files/cache-metrics/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_cache_metrics(self):
+        self.user1.is_staff = True
+        self.user1.save()
+        self.client.login(username=self.user_owner,
+                          password=self.fake_password)
+        response = self.client.get('/api/v2/assays/files/cache-metrics/')
+        self.assertEqual(response.data, {
+            'hits': 0, 'coalesced': 0, 'misses': 0, 'hit_ratio': None
+        })
+
 
 class UtilitiesTests(TestCase):
 
@@ -1568,6 +1700,87 @@ class UtilitiesTests(TestCase):
                                         require_valid_url=True)
         self.assertIn("has no associated file url", context.exception.message)
 
+    @mock.patch("data_set_manager.utils.core.utils.get_absolute_url",
+                side_effect=lambda url: "http://example.com" + url)
+    def test_get_node_files(self, mock_get_url):
+        with self.assertNumQueries(2):
+            node_files = get_node_files([self.node_a.uuid, self.node_b.uuid,
+                                         self.node_a.uuid])
+        self.assertEqual(node_files[self.node_a.uuid]["node"], self.node_a)
+        self.assertEqual(
+            node_files[self.node_a.uuid]["file_store_item"].uuid,
+            self.node_a.file_uuid
+        )
+        self.assertIn("test_file_a",
+                      node_files[self.node_a.uuid]["url"])
+        self.assertEqual(node_files[self.node_b.uuid],
+                         {"node": self.node_b, "file_store_item": None,
+                          "url": None})
+
+    def test_get_node_files_bad_uuid(self):
+        with self.assertRaises(RuntimeError) as context:
+            get_node_files([self.node_a.uuid, "coffee"])
+        self.assertEqual("Couldn't fetch Node by UUID from: coffee",
+                         context.exception.message)
+
+    def test_get_node_files_with_no_file_url_required(self):
+        with self.assertRaises(RuntimeError) as context:
+            get_node_files([self.node_a.uuid, self.node_b.uuid],
+                           require_valid_urls=True)
+        self.assertIn("has no associated file url", context.exception.message)
+
+    def test_get_solr_node_pages_follows_cursor_marks(self):
+        pages = [
+            {"response": {"numFound": 3, "docs": [{"uuid": "a"},
+                                                  {"uuid": "b"}]},
+             "nextCursorMark": "b"},
+            {"response": {"numFound": 3, "docs": [{"uuid": "c"}]},
+             "nextCursorMark": "c"}
+        ]
+        with mock.patch(
+            "data_set_manager.utils.search_solr",
+            side_effect=[json.dumps(page) for page in pages]
+        ) as search_solr_mock:
+            node_pages = list(get_solr_node_pages("study_uuid:x", rows=2))
+        self.assertEqual(node_pages, [[{"uuid": "a"}, {"uuid": "b"}],
+                                      [{"uuid": "c"}]])
+        self.assertEqual(
+            [call[0][0]["cursorMark"]
+             for call in search_solr_mock.call_args_list],
+            ["*", "b"]
+        )
+        self.assertEqual(search_solr_mock.call_args[0][0]["sort"], "id asc")
+
+    def test_get_solr_node_pages_stops_at_unchanged_cursor_mark(self):
+        page = {"response": {"numFound": 2, "docs": [{"uuid": "a"},
+                                                     {"uuid": "b"}]},
+                "nextCursorMark": "b"}
+        last_page = {"response": {"numFound": 2, "docs": []},
+                     "nextCursorMark": "b"}
+        with mock.patch(
+            "data_set_manager.utils.search_solr",
+            side_effect=[json.dumps(page), json.dumps(last_page)]
+        ) as search_solr_mock:
+            node_pages = list(get_solr_node_pages("study_uuid:x", rows=2))
+        self.assertEqual(node_pages, [[{"uuid": "a"}, {"uuid": "b"}]])
+        self.assertEqual(search_solr_mock.call_count, 2)
+
+    def test_get_solr_node_pages_with_sort_and_fields(self):
+        page = {"response": {"numFound": 1, "docs": [{"uuid": "a"}]},
+                "nextCursorMark": "a"}
+        with mock.patch(
+            "data_set_manager.utils.search_solr",
+            return_value=json.dumps(page)
+        ) as search_solr_mock:
+            list(get_solr_node_pages(["study_uuid:x", "type:y"], rows=2,
+                                     sort="name desc", fields=["uuid", "name"],
+                                     post=True))
+        params, core, post = search_solr_mock.call_args[0]
+        self.assertEqual(params["sort"], "name desc, id asc")
+        self.assertEqual(params["fl"], "uuid,name")
+        self.assertEqual(params["fq"], ["study_uuid:x", "type:y"])
+        self.assertTrue(post)
+
     def test__create_solr_params_from_node_uuids(self):
         fake_node_uuids = [str(uuid.uuid4()), str(uuid.uuid4())]
         node_solr_params = _create_solr_params_from_node_uuids(fake_node_uuids)
@@ -1606,6 +1819,260 @@ class UtilitiesTests(TestCase):
         # TODO: Is this the behavior we expect?
 
 
+class RetrieveNodesTests(TestCase):
+    def setUp(self):
+        investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=investigation)
+        self.assay = Assay.objects.create(study=self.study)
+        self.source = Node.objects.create(
+            study=self.study, type=Node.SOURCE, name="source"
+        )
+        self.sample = Node.objects.create(
+            study=self.study, assay=self.assay, type=Node.SAMPLE,
+            name="sample"
+        )
+        self.source.add_child(self.sample)
+        self.source_attribute = Attribute.objects.create(
+            node=self.source, type=Attribute.CHARACTERISTICS,
+            subtype="organism", value="Mus musculus"
+        )
+        self.sample_attribute = Attribute.objects.create(
+            node=self.sample, type=Attribute.FACTOR_VALUE,
+            subtype="treatment", value="none"
+        )
+        # unrelated study whose attributes must not be loaded
+        other_study = Study.objects.create(investigation=investigation)
+        other_node = Node.objects.create(
+            study=other_study, type=Node.SOURCE, name="other"
+        )
+        Attribute.objects.create(
+            node=other_node, type=Attribute.CHARACTERISTICS,
+            subtype="organism", value="Homo sapiens"
+        )
+
+    def test_retrieve_nodes(self):
+        nodes = _retrieve_nodes(self.study.uuid, self.assay.uuid)
+        self.assertEqual(
+            sorted(nodes.keys()), sorted([self.source.id, self.sample.id])
+        )
+        self.assertEqual(nodes[self.sample.id]["parents"], [self.source.id])
+        self.assertEqual(nodes[self.source.id]["parents"], [])
+
+    def test_retrieve_nodes_scopes_attributes(self):
+        nodes = _retrieve_nodes(self.study.uuid, self.assay.uuid)
+        self.assertEqual(
+            [attr[0] for attr in nodes[self.source.id]["attributes"]],
+            [self.source_attribute.id]
+        )
+        self.assertEqual(
+            [attr[0] for attr in nodes[self.sample.id]["attributes"]],
+            [self.sample_attribute.id]
+        )
+
+    def test_retrieve_nodes_attribute_fields(self):
+        nodes = _retrieve_nodes(self.study.uuid, self.assay.uuid, True)
+        self.assertEqual(
+            len(nodes[self.source.id]["attributes"][0]),
+            len(Attribute.ALL_FIELDS)
+        )
+        nodes = _retrieve_nodes(self.study.uuid, self.assay.uuid, False)
+        self.assertEqual(
+            len(nodes[self.source.id]["attributes"][0]),
+            len(Attribute.NON_ONTOLOGY_FIELDS)
+        )
+
+    def test_retrieve_nodes_study_only(self):
+        nodes = _retrieve_nodes(self.study.uuid)
+        self.assertEqual(nodes.keys(), [self.source.id])
+
+
+class DeleteNodesTests(TestCase):
+    def setUp(self):
+        investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=investigation)
+        self.other_study = Study.objects.create(investigation=investigation)
+        self.other_node = Node.objects.create(
+            study=self.other_study, type=Node.SOURCE, name="other"
+        )
+        self.delete_files_mock = mock.patch.object(
+            data_set_manager.utils.delete_files, "delay"
+        ).start()
+        self.remove_objects_mock = mock.patch.object(
+            NodeIndex, "remove_objects"
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _create_nodes(self, count):
+        protocol = Protocol.objects.create(study=self.study)
+        for index in range(count):
+            file_store_item = FileStoreItem.objects.create(
+                datafile=SimpleUploadedFile('test_file.txt', 'Coffee')
+            )
+            source = Node.objects.create(
+                study=self.study, type=Node.SOURCE, name="source"
+            )
+            data_file = Node.objects.create(
+                study=self.study, type=Node.RAW_DATA_FILE,
+                name="file", file_uuid=file_store_item.uuid
+            )
+            source.add_child(data_file)
+            Attribute.objects.create(
+                node=source, type=Attribute.CHARACTERISTICS,
+                subtype="organism", value="Mus musculus"
+            )
+            ProtocolReference.objects.create(node=data_file,
+                                             protocol=protocol)
+
+    def _delete_nodes(self):
+        return delete_nodes(
+            Node.objects.filter(study=self.study),
+            solr_query='study_uuid:("{}")'.format(self.study.uuid)
+        )
+
+    def test_delete_nodes_removes_related_objects(self):
+        self._create_nodes(2)
+        self.assertEqual(self._delete_nodes(), 4)
+        self.assertEqual(list(Node.objects.all()), [self.other_node])
+        self.assertEqual(Attribute.objects.count(), 0)
+        self.assertEqual(ProtocolReference.objects.count(), 0)
+        self.assertEqual(Node.children.through.objects.count(), 0)
+        self.assertEqual(Node.parents.through.objects.count(), 0)
+        self.assertEqual(FileStoreItem.objects.count(), 0)
+
+    def test_delete_nodes_schedules_file_removal(self):
+        self._create_nodes(2)
+        file_names = [item.datafile.name
+                      for item in FileStoreItem.objects.all()]
+        self._delete_nodes()
+        self.delete_files_mock.assert_called_once_with(ANY)
+        self.assertEqual(sorted(self.delete_files_mock.call_args[0][0]),
+                         sorted(file_names))
+
+    def test_delete_nodes_removes_documents_with_one_request(self):
+        self._create_nodes(10)
+        self._delete_nodes()
+        self.remove_objects_mock.assert_called_once_with(
+            'study_uuid:("{}")'.format(self.study.uuid),
+            using='data_set_manager'
+        )
+
+    def test_delete_nodes_query_count_does_not_depend_on_node_count(self):
+        query_counts = []
+        for count in (1, 20):
+            self._create_nodes(count)
+            with CaptureQueriesContext(connection) as queries:
+                self._delete_nodes()
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_delete_nodes_without_nodes(self):
+        self.assertEqual(self._delete_nodes(), 0)
+        self.assertFalse(self.remove_objects_mock.called)
+        self.assertFalse(self.delete_files_mock.called)
+
+
+class AttributeClosureTests(TestCase):
+    def _make_node(self, node_id, parents, attribute_ids):
+        return {
+            "id": node_id,
+            "parents": parents,
+            "attributes": [
+                (attribute_id, "Characteristics", "subtype", "value", None)
+                for attribute_id in attribute_ids
+            ]
+        }
+
+    def test_get_attribute_closures_diamond(self):
+        # source -> two samples -> shared extract -> file
+        nodes = {
+            1: self._make_node(1, [], [10]),
+            2: self._make_node(2, [1], [20]),
+            3: self._make_node(3, [1], [30]),
+            4: self._make_node(4, [2, 3], [40]),
+            5: self._make_node(5, [4], [])
+        }
+        closures = _get_attribute_closures(nodes)
+        self.assertEqual(
+            sorted(attr[0] for attr in closures[5]), [10, 20, 30, 40]
+        )
+        self.assertEqual(sorted(attr[0] for attr in closures[2]), [10, 20])
+        # nodes without own attributes share the set of their parent
+        self.assertIs(closures[5], closures[4])
+
+    def test_get_attribute_closures_ignores_unknown_parents(self):
+        nodes = {1: self._make_node(1, [99], [10])}
+        closures = _get_attribute_closures(nodes)
+        self.assertEqual([attr[0] for attr in closures[1]], [10])
+
+    def test_get_attribute_closures_long_chain(self):
+        # deeper than the default recursion limit
+        nodes = {1: self._make_node(1, [], [1])}
+        for node_id in range(2, 2000):
+            nodes[node_id] = self._make_node(node_id, [node_id - 1], [node_id])
+        closures = _get_attribute_closures(nodes)
+        self.assertEqual(len(closures[1999]), 1999)
+
+
+class FacetCardinalityTests(TestCase):
+    def setUp(self):
+        investigation = Investigation.objects.create()
+        self.study = Study.objects.create(investigation=investigation)
+        self.assay = Assay.objects.create(study=self.study)
+        invalidate_facet_cardinalities([self.assay.uuid])
+        self.attributes = ["organism_Characteristics_generic_s",
+                           "filename_Characteristics_generic_s"]
+        response = mock.Mock()
+        response.json.return_value = {
+            "response": {"numFound": 4, "docs": [{}]},
+            "facet_counts": {
+                "facet_fields": {
+                    "organism_Characteristics_generic_s": ["human", 3,
+                                                           "mouse", 1],
+                    "filename_Characteristics_generic_s": ["a", 1, "b", 1,
+                                                           "c", 1, "d", 1]
+                }
+            }
+        }
+        self.post_mock = mock.patch("requests.post",
+                                    return_value=response).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        invalidate_facet_cardinalities([self.assay.uuid])
+
+    def test_single_request_for_all_attributes(self):
+        cardinalities = _get_facet_cardinalities(self.attributes, 4,
+                                                 self.study, self.assay)
+        self.assertEqual(cardinalities, {
+            "organism_Characteristics_generic_s": 2,
+            "filename_Characteristics_generic_s": 4
+        })
+        self.assertEqual(self.post_mock.call_count, 1)
+        params = self.post_mock.call_args[1]["data"]
+        self.assertEqual(params["facet.field"], self.attributes)
+        self.assertEqual(params["facet.limit"], 4)
+
+    def test_cardinalities_are_cached_per_assay(self):
+        _get_facet_cardinalities(self.attributes, 4, self.study, self.assay)
+        _get_facet_cardinalities(self.attributes, 4, self.study, self.assay)
+        self.assertEqual(self.post_mock.call_count, 1)
+
+    def test_cache_is_not_used_for_different_item_count(self):
+        _get_facet_cardinalities(self.attributes, 4, self.study, self.assay)
+        _get_facet_cardinalities(self.attributes, 5, self.study, self.assay)
+        self.assertEqual(self.post_mock.call_count, 2)
+
+    def test_invalidated_cardinalities_are_requested_again(self):
+        _get_facet_cardinalities(self.attributes, 4, self.study, self.assay)
+        invalidate_facet_cardinalities([self.assay.uuid])
+        _get_facet_cardinalities(self.attributes, 4, self.study, self.assay)
+        self.assertEqual(self.post_mock.call_count, 2)
+
+    def test_is_facet_attribute(self):
+        self.assertTrue(_is_facet_attribute(2, 4))
+        self.assertFalse(_is_facet_attribute(4, 4))
+
+
 class NodeClassMethodTests(TestCase):
     def setUp(self):
         self.username = 'coffee_tester'
@@ -2107,6 +2574,56 @@ class NodeIndexTests(APITestCase):
                 expected_download_url=self.file_store_item.get_datafile_url()
             )
 
+    def _update_objects(self, nodes, batch_size=None):
+        backend = mock.Mock()
+        documents = []
+        backend.update.side_effect = lambda index, batch, commit: \
+            documents.append([index.prepare(node) for node in batch])
+        with mock.patch.object(NodeIndex, '_get_backend',
+                               return_value=backend):
+            count = NodeIndex().update_objects(nodes, batch_size=batch_size)
+        return backend, documents, count
+
+    def test_update_objects_prepares_same_documents_as_prepare(self):
+        with mock.patch.object(FileStoreItem, 'get_datafile_url',
+                               return_value='/media/file_store/test_file.txt'):
+            expected = NodeIndex().prepare(self.node)
+            backend, documents, count = self._update_objects(
+                Node.objects.filter(uuid=self.node_uuid)
+            )
+        self.assertEqual(count, 1)
+        self.assertEqual(documents, [[expected]])
+        backend.update.assert_called_once_with(ANY, ANY, commit=False)
+        backend.conn.commit.assert_called_once_with()
+
+    def test_update_objects_posts_in_batches_with_single_commit(self):
+        for i in range(4):
+            Node.objects.create(assay=self.node.assay, study=self.node.study,
+                                name='fake {}.txt'.format(i),
+                                type='Raw Data File')
+        backend, documents, count = self._update_objects(
+            Node.objects.filter(study=self.node.study), batch_size=2
+        )
+        self.assertEqual(count, 5)
+        self.assertEqual([len(batch) for batch in documents], [2, 2, 1])
+        backend.conn.commit.assert_called_once_with()
+
+    def test_update_objects_bumps_assay_index_version(self):
+        with mock.patch('core.utils.cache',
+                        LocMemCache('assay-index-version', {})):
+            version = get_assay_index_version(self.node.assay.uuid)
+            self._update_objects(Node.objects.filter(uuid=self.node_uuid))
+            self.assertNotEqual(
+                get_assay_index_version(self.node.assay.uuid), version
+            )
+
+    def test_update_objects_skips_non_exposed_output_nodes(self):
+        self._create_analysis_node_connection(OUTPUT_CONNECTION, False)
+        index = NodeIndex()
+        index._prefetch([self.node], {})
+        with self.assertRaises(SkipDocument):
+            index.prepare(self.node)
+
 
 @contextlib.contextmanager
 def temporary_directory(*args, **kwargs):
@@ -2125,7 +2642,7 @@ class IsaTabTestBase(TestCase):
 
         # no need to update Solr index in tests
         self.update_node_index_mock = mock.patch(
-            "data_set_manager.search_indexes.NodeIndex.update_object"
+            "data_set_manager.search_indexes.NodeIndex.update_objects"
         ).start()
 
         test_user = "test_user"
@@ -2148,16 +2665,88 @@ class IsaTabParserTests(IsaTabTestBase):
         self.assertEqual(FileStoreItem.objects.count(), 0)
         self.assertEqual(Investigation.objects.count(), 0)
 
-    def parse(self, dir_name):
+    def parse(self, dir_name, bulk=False):
         parent = os.path.dirname(os.path.abspath(__file__))
         file_source_translator = generate_file_source_translator(
             username=self.user.username
         )
         dir = os.path.join(parent, 'test-data', dir_name)
         return IsaTabParser(
-            file_source_translator=file_source_translator
+            file_source_translator=file_source_translator, bulk=bulk
         ).run(dir)
 
+    def get_node_graph(self, investigation):
+        """Returns a comparable representation of all nodes of an
+        investigation including links, attributes, protocol references and
+        file sources
+        """
+        def node_key(node):
+            return (node.study.file_name,
+                    node.assay.file_name if node.assay else None,
+                    node.type, node.name)
+
+        graph = []
+        for node in Node.objects.filter(study__investigation=investigation):
+            if node.file_uuid:
+                source = FileStoreItem.objects.get(uuid=node.file_uuid).source
+            else:
+                source = None
+            graph.append((
+                node_key(node),
+                sorted(node_key(parent) for parent in node.parents.all()),
+                sorted(node_key(child) for child in node.children.all()),
+                list(node.attribute_set.order_by("id").values_list(
+                    "type", "subtype", "value", "value_unit",
+                    "value_accession", "value_source"
+                )),
+                sorted(
+                    (reference.protocol.name, reference.performer,
+                     reference.date,
+                     list(reference.protocolreferenceparameter_set.values_list(
+                         "name", "value", "value_unit", "value_accession",
+                         "value_source"
+                     )))
+                    for reference in node.protocolreference_set.all()
+                ),
+                source
+            ))
+        return sorted(graph)
+
+    def test_bulk_parse_is_identical(self):
+        for dir_name in ['minimal', 'multiple-study', 'protocol-references']:
+            self.assertEqual(
+                self.get_node_graph(self.parse(dir_name)),
+                self.get_node_graph(self.parse(dir_name, bulk=True))
+            )
+
+    def test_bulk_parse_timings(self):
+        parser = IsaTabParser(
+            file_source_translator=generate_file_source_translator(
+                username=self.user.username
+            ),
+            bulk=True
+        )
+        parser.run(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'test-data', 'protocol-references'))
+        self.assertEqual(
+            parser.timings.keys(),
+            ['parse', 'file store items', 'nodes', 'node links', 'attributes',
+             'protocol references']
+        )
+
+    def test_protocol_references(self):
+        investigation = self.parse('protocol-references')
+        nodes = Node.objects.filter(study__investigation=investigation)
+        self.assertEqual(nodes.filter(type=Node.SOURCE).count(), 2)
+        self.assertEqual(nodes.filter(type=Node.SAMPLE).count(), 3)
+        extract = nodes.get(type=Node.EXTRACT, name="E1")
+        self.assertEqual(extract.parents.count(), 2)
+        self.assertEqual(
+            ProtocolReferenceParameter.objects.filter(
+                protocol_reference__node__study__investigation=investigation
+            ).count(), 4
+        )
+
     def test_empty(self):
         with temporary_directory() as tmp:
             with self.assertRaises(ParserException):
@@ -2226,9 +2815,10 @@ class IsaTabParserTests(IsaTabTestBase):
         self.failed_isatab_assertions()
 
 
+@override_settings(CELERY_ALWAYS_EAGER=True)
 class ProcessISATabViewTestBase(IsaTabTestBase):
     def post_isa_tab(self, isa_tab_url=None, isa_tab_file=None):
-        self.client.post(
+        return self.client.post(
             self.isa_tab_import_url,
             data={
                 "isa_tab_url": isa_tab_url,
@@ -2251,15 +2841,15 @@ class ProcessISATabViewTestBase(IsaTabTestBase):
 
 
 class ProcessISATabViewTests(ProcessISATabViewTestBase):
-    @mock.patch.object(data_set_manager.views.import_file, "delay")
+    @mock.patch.object(data_set_manager.tasks.import_file, "delay")
     def test_post_good_isa_tab_file(self, delay_mock):
         with open('data_set_manager/test-data/rfc-test.zip') as good_isa:
             self.post_isa_tab(isa_tab_file=good_isa)
         self.successful_import_assertions()
 
-    @mock.patch.object(data_set_manager.views.import_file, "delay")
-    def test_node_index_update_object_called_with_proper_args(self,
-                                                              delay_mock):
+    @mock.patch.object(data_set_manager.tasks.import_file, "delay")
+    def test_node_index_update_objects_called_with_proper_args(self,
+                                                               delay_mock):
         with open('data_set_manager/test-data/rfc-test.zip') as good_isa:
             self.post_isa_tab(isa_tab_file=good_isa)
         self.update_node_index_mock.assert_called_with(
@@ -2276,10 +2866,247 @@ class ProcessISATabViewTests(ProcessISATabViewTestBase):
         self.post_isa_tab(isa_tab_url="non-existant-file")
         self.unsuccessful_import_assertions()
 
+    @mock.patch.object(data_set_manager.tasks.import_file, "delay")
+    def test_post_isa_tab_file_returns_import_job(self, delay_mock):
+        with open('data_set_manager/test-data/rfc-test.zip') as good_isa:
+            response = self.post_isa_tab(isa_tab_file=good_isa)
+        self.assertEqual(response.status_code, 202)
+        job = ISATabImportJob.objects.get(
+            uuid=json.loads(response.content)['data']['import_job_uuid']
+        )
+        self.assertEqual(job.phase, ISATabImportJob.SUCCESS)
+        self.assertEqual(job.data_set_uuid, DataSet.objects.get().uuid)
+        self.assertEqual(len(job.checksum), 32)
+
+    def test_post_bad_isa_tab_file_fails_import_job(self):
+        with open('data_set_manager/test-data/HideLabBrokenA.zip') as bad_isa:
+            self.post_isa_tab(isa_tab_file=bad_isa)
+        job = ISATabImportJob.objects.get()
+        self.assertEqual(job.phase, ISATabImportJob.FAILURE)
+        self.assertNotEqual(job.message, '')
+
+    def test_post_isa_tab_file_rejects_duplicate_import_job(self):
+        path = 'data_set_manager/test-data/rfc-test.zip'
+        with open(path, 'rb') as good_isa:
+            checksum = calculate_checksum(good_isa)
+        running_job = ISATabImportJob.objects.create(
+            user=self.user, source='rfc-test.zip', path='/tmp/rfc-test.zip',
+            checksum=checksum, phase=ISATabImportJob.PARSE
+        )
+        with mock.patch.object(data_set_manager.views.import_isatab,
+                               "delay") as delay_mock:
+            with open(path) as good_isa:
+                response = self.post_isa_tab(isa_tab_file=good_isa)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            json.loads(response.content)['data']['import_job_uuid'],
+            running_job.uuid
+        )
+        delay_mock.assert_not_called()
+        self.assertEqual(ISATabImportJob.objects.count(), 1)
+
+    def test_post_isa_tab_file_queues_import_job(self):
+        with mock.patch.object(data_set_manager.views.import_isatab,
+                               "delay") as delay_mock:
+            with open('data_set_manager/test-data/rfc-test.zip') as good_isa:
+                self.post_isa_tab(isa_tab_file=good_isa)
+        job = ISATabImportJob.objects.get()
+        self.assertEqual(job.phase, ISATabImportJob.PENDING)
+        delay_mock.assert_called_once_with(job.uuid)
+        self.unsuccessful_import_assertions()
+
+    def test_post_isa_tab_files_with_same_name_get_own_paths(self):
+        with mock.patch.object(data_set_manager.views.import_isatab, "delay"):
+            for index in range(2):
+                with open('data_set_manager/test-data/rfc-test.zip') as isa:
+                    self.post_isa_tab(isa_tab_file=isa)
+        paths = ISATabImportJob.objects.values_list('path', flat=True)
+        self.assertEqual(len(set(paths)), 2)
+        for path in paths:
+            self.addCleanup(shutil.rmtree, os.path.dirname(path))
+            self.assertEqual(os.path.basename(path), 'rfc-test.zip')
+            self.assertTrue(os.path.exists(path))
+
+    def test_get_isa_tab_url_from_cookie_redirects_to_progress(self):
+        self.client.cookies['isa_tab_url'] = 'http://www.example.com/test.zip'
+        with mock.patch.object(data_set_manager.views.import_isatab,
+                               "delay") as delay_mock:
+            response = self.client.get(self.isa_tab_import_url)
+        job = ISATabImportJob.objects.get()
+        self.addCleanup(shutil.rmtree, os.path.dirname(job.path))
+        delay_mock.assert_called_once_with(job.uuid)
+        self.assertRedirects(
+            response,
+            "/data_set_manager/import/isa-tab-jobs/{}/progress/".format(
+                job.uuid
+            )
+        )
+
+    def test_take_ownership_starts_import_job(self):
+        data_set = create_dataset_with_necessary_models(is_isatab_based=True)
+        data_set.set_owner(self.user)
+        response = self.client.post(
+            "/data_set_manager/import/take_ownership/",
+            json.dumps({'data_set_uuid': data_set.uuid}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(
+            "/data_set_manager/import/isa-tab-form/ajax/"
+        ))
+        with mock.patch.object(data_set_manager.views.import_isatab,
+                               "delay") as delay_mock:
+            response = self.client.get(
+                "/data_set_manager/import/isa-tab-form/ajax/"
+            )
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.content)['data']
+        job = ISATabImportJob.objects.get(uuid=data['import_job_uuid'])
+        self.addCleanup(shutil.rmtree, os.path.dirname(job.path))
+        self.assertEqual(
+            data['import_job_url'],
+            "/data_set_manager/import/isa-tab-jobs/{}/".format(job.uuid)
+        )
+        self.assertEqual(job.source, 'http://www.example.com/test.zip')
+        delay_mock.assert_called_once_with(job.uuid)
+
+
+class ISATabImportJobTests(IsaTabTestBase):
+    def setUp(self):
+        super(ISATabImportJobTests, self).setUp()
+        self.job = ISATabImportJob.objects.create(
+            user=self.user, source='rfc-test.zip', path='/tmp/rfc-test.zip'
+        )
+        self.job_url = "/data_set_manager/import/isa-tab-jobs/{}/".format(
+            self.job.uuid
+        )
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_get_phase_published_before_commit(self):
+        self.job.set_phase(ISATabImportJob.ANNOTATE)
+        # simulate the update being part of the open import transaction
+        ISATabImportJob.objects.filter(pk=self.job.pk).update(
+            phase=ISATabImportJob.PENDING
+        )
+        job = ISATabImportJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.get_phase(), (ISATabImportJob.ANNOTATE, ''))
+
+    def test_get_phase_of_finished_job(self):
+        self.job.set_phase(ISATabImportJob.FAILURE, 'Bad archive')
+        job = ISATabImportJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.get_phase(), (ISATabImportJob.FAILURE,
+                                           'Bad archive'))
+
+    def test_get_duplicate_ignores_finished_jobs(self):
+        self.job.checksum = 'a' * 32
+        self.job.save()
+        new_job = ISATabImportJob(user=self.user, source='rfc-test.zip',
+                                  path='/tmp/rfc-test.zip', checksum='a' * 32)
+        self.assertEqual(new_job.get_duplicate(), self.job)
+        self.job.set_phase(ISATabImportJob.SUCCESS)
+        self.assertIsNone(new_job.get_duplicate())
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_get_duplicate_fails_stale_jobs(self):
+        ISATabImportJob.objects.filter(pk=self.job.pk).update(
+            checksum='a' * 32, phase=ISATabImportJob.PARSE,
+            modification_date=timezone.now() - timedelta(days=1)
+        )
+        new_job = ISATabImportJob(user=self.user, source='rfc-test.zip',
+                                  path='/tmp/rfc-test.zip', checksum='a' * 32)
+        self.assertIsNone(new_job.get_duplicate())
+        self.assertEqual(ISATabImportJob.objects.get(pk=self.job.pk).phase,
+                         ISATabImportJob.FAILURE)
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_phase_published_recently_is_not_stale(self):
+        self.job.set_phase(ISATabImportJob.ANNOTATE)
+        # simulate the update being part of the open import transaction
+        ISATabImportJob.objects.filter(pk=self.job.pk).update(
+            phase=ISATabImportJob.PARSE,
+            modification_date=timezone.now() - timedelta(days=1)
+        )
+        job = ISATabImportJob.objects.get(pk=self.job.pk)
+        self.assertFalse(job.fail_if_stale())
+        self.assertEqual(job.get_phase(), (ISATabImportJob.ANNOTATE, ''))
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_import_isatab_download_error(self):
+        ISATabImportJob.objects.filter(pk=self.job.pk).update(
+            source='http://www.example.com/rfc-test.zip'
+        )
+        with mock.patch('data_set_manager.tasks.download_file',
+                        side_effect=RuntimeError('Connection reset')):
+            data_set_manager.tasks.import_isatab(self.job.uuid)
+        job = ISATabImportJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.phase, ISATabImportJob.FAILURE)
+        self.assertEqual(job.message, "Problem downloading ISA-Tab file from: "
+                                      "http://www.example.com/rfc-test.zip")
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_import_isatab_parser_error(self):
+        with mock.patch('data_set_manager.tasks.parse_isatab',
+                        side_effect=ParserException('No study')):
+            data_set_manager.tasks.import_isatab(self.job.uuid)
+        self.assertEqual(ISATabImportJob.objects.get(pk=self.job.pk).message,
+                         "Improperly structured ISA-Tab file: No study")
+
+    @mock.patch('data_set_manager.models.cache',
+                LocMemCache('isa-tab-import', {}))
+    def test_import_isatab_runtime_error_is_not_a_download_error(self):
+        with mock.patch('data_set_manager.tasks.parse_isatab',
+                        side_effect=RuntimeError('No assay')):
+            data_set_manager.tasks.import_isatab(self.job.uuid)
+        self.assertEqual(ISATabImportJob.objects.get(pk=self.job.pk).message,
+                         "ISA-Tab import Failure: No assay")
+
+    def test_remove_archive(self):
+        self.job.path = ISATabImportJob.make_archive_path('rfc-test.zip')
+        open(self.job.path, 'w').close()
+        self.job.remove_archive()
+        self.assertFalse(os.path.exists(os.path.dirname(self.job.path)))
+
+    def test_get_import_job(self):
+        response = self.client.get(self.job_url)
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual(content['uuid'], self.job.uuid)
+        self.assertEqual(content['phase'], ISATabImportJob.PENDING)
+
+    def test_get_import_job_of_other_user(self):
+        other_user = User.objects.create_user("other_user")
+        ISATabImportJob.objects.filter(pk=self.job.pk).update(
+            user=other_user
+        )
+        response = self.client.get(self.job_url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_import_job_progress(self):
+        response = self.client.get(self.job_url + "progress/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response,
+                                'data_set_manager/isa-tab-import-job.html')
+        self.assertTrue(response.context['is_active'])
+
+    def test_get_import_job_progress_of_finished_job(self):
+        data_set = create_dataset_with_necessary_models()
+        self.job.data_set_uuid = data_set.uuid
+        self.job.set_phase(ISATabImportJob.SUCCESS)
+        response = self.client.get(self.job_url + "progress/")
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(
+            "/data_sets/{}/".format(data_set.uuid)
+        ))
+
 
 class ProcessISATabViewLiveServerTests(ProcessISATabViewTestBase,
                                        LiveServerTestCase):
-    @mock.patch.object(data_set_manager.views.import_file, "delay")
+    @mock.patch.object(data_set_manager.tasks.import_file, "delay")
     def test_post_good_isa_tab_url(self, delay_mock):
         media_root_path = os.path.join(
             settings.BASE_DIR,
@@ -2330,21 +3157,27 @@ class SingleFileColumnParserTests(TestCase):
 
     def test_reindex_triggered_for_nodes_missing_datafiles(self):
         with mock.patch(
-            "data_set_manager.search_indexes.NodeIndex.update_object"
-        ) as update_object_mock:
+            "data_set_manager.search_indexes.NodeIndex.update_objects"
+        ) as update_objects_mock:
             dataset = self.process_csv('two-line-local.csv')
 
         self.assert_expected_nodes(dataset, 2)
-        self.assertEqual(2, update_object_mock.call_count)
+        self.assertEqual(
+            2, sum(len(call[0][0])
+                   for call in update_objects_mock.call_args_list)
+        )
 
     def test_reindex_triggered_for_s3_nodes_missing_datafiles(self):
         with mock.patch(
-                "data_set_manager.search_indexes.NodeIndex.update_object"
-        ) as update_object_mock:
+                "data_set_manager.search_indexes.NodeIndex.update_objects"
+        ) as update_objects_mock:
             dataset = self.process_csv('two-line-s3.csv')
 
         self.assert_expected_nodes(dataset, 2)
-        self.assertEqual(2, update_object_mock.call_count)
+        self.assertEqual(
+            2, sum(len(call[0][0])
+                   for call in update_objects_mock.call_args_list)
+        )
 
 
 class UpdateMissingAttributeOrderTests(TestMigrations):
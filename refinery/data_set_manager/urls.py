@@ -12,9 +12,10 @@ from constants import UUID_RE
 from rest_framework.routers import DefaultRouter
 
 from .views import (
-    Assays, AssaysAttributes, AssaysFiles, CheckDataFilesView,
-    ChunkedFileUploadCompleteView, ChunkedFileUploadView, DataSetImportView,
-    ImportISATabView, ProcessISATabView, ProcessMetadataTableView,
+    Assays, AssaysAttributes, AssaysFiles, AssaysFilesCacheMetrics,
+    CheckDataFilesView, ChunkedFileUploadCompleteView, ChunkedFileUploadView,
+    DataSetImportView, ImportISATabView, ISATabImportJobProgressView,
+    ISATabImportJobView, ProcessISATabView, ProcessMetadataTableView,
     TakeOwnershipOfPublicDatasetView
 )
 
@@ -31,6 +32,12 @@ urlpatterns = patterns(
     url(r'^import/isa-tab-form/(?P<ajax>.+)/$',
         login_required(ProcessISATabView.as_view()),
         name='process_isa_tab'),
+    url(r'^import/isa-tab-jobs/(?P<uuid>' + UUID_RE + ')/$',
+        login_required(ISATabImportJobView.as_view()),
+        name='isa_tab_import_job'),
+    url(r'^import/isa-tab-jobs/(?P<uuid>' + UUID_RE + ')/progress/$',
+        login_required(ISATabImportJobProgressView.as_view()),
+        name='isa_tab_import_job_progress'),
     url(r'^import/metadata-table-form/$',
         login_required(ProcessMetadataTableView.as_view()),
         name='process_metadata_table'),
@@ -54,6 +61,7 @@ data_set_manager_router.urls.extend([
     url(r'^assays/$', Assays.as_view()),
     url(r'^assays/(?P<uuid>' + UUID_RE + ')/files/$',
         AssaysFiles.as_view()),
+    url(r'^assays/files/cache-metrics/$', AssaysFilesCacheMetrics.as_view()),
     url(r'^assays/(?P<uuid>' + UUID_RE + ')/attributes/$',
         AssaysAttributes.as_view()),
 ])
@@ -12,8 +12,11 @@ import shutil
 import tempfile
 import time
 import urlparse
+import uuid
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Q
 from django.utils.http import urlquote, urlunquote
 
@@ -21,21 +24,39 @@ import requests
 
 import constants
 import core
+from file_store.models import FileStoreItem, delete_file_store_items
+from file_store.tasks import delete_files
 
 from .models import (
     AnnotatedNode, AnnotatedNodeRegistry, Assay, Attribute, AttributeOrder,
-    Node, Study
+    Node, Study, get_assay_index_version, invalidate_assay_index_versions,
+    invalidate_facet_cardinalities
 )
 from .search_indexes import NodeIndex
 from .serializers import AttributeOrderSerializer
 
 logger = logging.getLogger(__name__)
 
+# formatted Solr responses of assay files are kept this long (seconds)
+ASSAY_FILES_CACHE_TIMEOUT = 10 * 60
+# identical requests wait this long for the response of the first one
+ASSAY_FILES_COALESCE_TIMEOUT = 10  # seconds
+ASSAY_FILES_COALESCE_INTERVAL = 0.05  # seconds
+_ASSAY_FILES_HITS_KEY = 'assay-files-cache-hits'
+_ASSAY_FILES_COALESCED_KEY = 'assay-files-cache-coalesced'
+_ASSAY_FILES_MISSES_KEY = 'assay-files-cache-misses'
+
 # number of AnnotatedNode objects that can be inserted with bulk insert
 # (limitation of sqlite)
 # https://docs.djangoproject.com/en/dev/ref/models/querysets/#django.db.models.query.QuerySet.bulk_create
 MAX_BULK_LIST_SIZE = 75
 
+# number of rows fetched per round trip when streaming query results
+STREAM_CHUNK_SIZE = 2000
+
+# number of terms per Solr query (below the default maxBooleanClauses)
+SOLR_TERMS_CHUNK_SIZE = 1000
+
 
 # make a list of values unique
 def uniquify(seq):
@@ -153,26 +174,63 @@ def _get_parent_attributes(nodes, node_id):
     return attributes
 
 
-def _get_unique_parent_attributes(nodes, node_id):
-    """Recursively collects attributes from the current node and each parent
-    node until no more parents are available and make sure that the final list
-    of attributes is unique.
-    """
-    attributes = {}
-
-    if len(nodes[node_id]["parents"]) == 0:
-        for attr in nodes[node_id]["attributes"]:
-            attributes[attr[0]] = attr
-
-        return attributes
+def _get_attribute_closures(nodes):
+    """Computes the set of attributes each node inherits from itself and all
+    of its ancestors, as used for AnnotatedNode creation.
 
-    for parent_id in nodes[node_id]["parents"]:
-        attributes.update(_get_unique_parent_attributes(nodes, parent_id))
+    Nodes are visited in topological order (parents before children) so the
+    set of every node is built exactly once from the already computed sets of
+    its parents instead of re-walking the ancestor chain for every node.
+    Identical sets are interned and shared between nodes, e.g. all file nodes
+    derived from the same sample without additional attributes.
 
-    for attr in nodes[node_id]["attributes"]:
-        attributes[attr[0]] = attr
+    :param nodes: nodes as returned by `_retrieve_nodes()`
+    :type nodes: dict
+    :returns: dict mapping node IDs to frozensets of attribute tuples
+    """
+    child_ids = {node_id: [] for node_id in nodes}
+    pending_parents = {}
+    for node_id, node in nodes.iteritems():
+        # parents outside of the retrieved nodes do not contribute attributes
+        parent_ids = [
+            parent_id for parent_id in node["parents"] if parent_id in nodes
+        ]
+        pending_parents[node_id] = len(parent_ids)
+        for parent_id in parent_ids:
+            child_ids[parent_id].append(node_id)
+
+    ready = [
+        node_id for node_id, count in pending_parents.iteritems()
+        if count == 0
+    ]
+    interned = {}
+    closures = {}
+    while ready:
+        node_id = ready.pop()
+        node = nodes[node_id]
+        parent_closures = [
+            closures[parent_id] for parent_id in node["parents"]
+            if parent_id in closures
+        ]
+        if len(parent_closures) == 1 and not node["attributes"]:
+            closure = parent_closures[0]
+        else:
+            closure = frozenset(node["attributes"]).union(*parent_closures)
+            closure = interned.setdefault(closure, closure)
+        closures[node_id] = closure
+
+        for child_id in child_ids[node_id]:
+            pending_parents[child_id] -= 1
+            if pending_parents[child_id] == 0:
+                ready.append(child_id)
+
+    if len(closures) < len(nodes):
+        logger.error(
+            "Cycle in node graph: attributes of %s nodes could not be "
+            "resolved", len(nodes) - len(closures)
+        )
 
-    return attributes
+    return closures
 
 
 def _get_assay_name(result, node):
@@ -185,6 +243,41 @@ def _get_assay_name(result, node):
     return None
 
 
+def _iterate_with_server_side_cursor(queryset, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the rows of a `values_list()` queryset without loading the whole
+    result set into memory.
+
+    On PostgreSQL the rows are fetched through a named (server-side) cursor
+    in chunks of `chunk_size`; on other backends this falls back to
+    `QuerySet.iterator()`.
+    """
+    if connection.vendor != 'postgresql':
+        for row in queryset.iterator():
+            yield row
+        return
+
+    sql, params = queryset.query.sql_with_params()
+    # named cursors have to live inside a transaction
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            name='retrieve_nodes_{}'.format(uuid.uuid4().hex)
+        )
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def _get_row_size(row):
+    """Approximate number of bytes a row returned by `values_list()` takes up
+    """
+    return sum(len(unicode(value)) for value in row if value is not None)
+
+
 def _retrieve_nodes(
         study_uuid,
         assay_uuid=None,
@@ -194,16 +287,12 @@ def _retrieve_nodes(
     assay.
 
     If `node_uuids` is `None` query nodes (both from assay and from study only)
+
+    Only the parent links and attributes of the retrieved nodes are loaded and
+    both are streamed from the database (see
+    `_iterate_with_server_side_cursor()`).
     """
-    node_fields = [
-        "id",
-        "uuid",
-        "file_uuid",
-        "type",
-        "name",
-        "parents",
-        "attribute"
-    ]
+    start = time.time()
 
     # Build filters
     filters = {}
@@ -219,13 +308,19 @@ def _retrieve_nodes(
             )
         q_filters.append(q_filters_1)
 
-    # Query for notes
+    node_query = Node.objects.filter(*q_filters, **filters)
+    # used as a sub-query to scope parent links and attributes
+    node_ids = node_query.values('id')
+
     node_list = (
-        Node.objects
-            .filter(*q_filters, **filters)
-            .prefetch_related("attribute_set")
-            .order_by("id", "attribute")
-            .values(*node_fields)
+        node_query
+        .order_by("id")
+        .values_list("id", "uuid", "file_uuid", "type", "name")
+    )
+    parent_list = (
+        Node.parents.through.objects
+        .filter(from_node_id__in=node_ids)
+        .values_list("from_node_id", "to_node_id")
     )
 
     if ontology_attribute_fields:
@@ -235,54 +330,45 @@ def _retrieve_nodes(
 
     attribute_list = (
         Attribute.objects
-                 .filter()
+                 .filter(node_id__in=node_ids)
                  .order_by("id")
                  .values_list(*attribute_fields)
     )
 
-    attributes = {}
-    current_id = None
-    current_node = None
     nodes = {}
+    attribute_count = 0
+    loaded_bytes = 0
+
+    for node in _iterate_with_server_side_cursor(node_list):
+        loaded_bytes += _get_row_size(node)
+        nodes[node[0]] = {
+            "id": node[0],
+            "uuid": node[1],
+            "attributes": [],
+            "parents": [],
+            "name": node[4],
+            "type": node[3],
+            "file_uuid": node[2]
+        }
+
+    for node_id, parent_id in _iterate_with_server_side_cursor(parent_list):
+        loaded_bytes += _get_row_size((node_id, parent_id))
+        nodes[node_id]["parents"].append(parent_id)
+
+    # the node ID is the last field of `Attribute.ALL_FIELDS` and
+    # `Attribute.NON_ONTOLOGY_FIELDS`
+    for attribute in _iterate_with_server_side_cursor(attribute_list):
+        attribute_count += 1
+        loaded_bytes += _get_row_size(attribute)
+        nodes[attribute[-1]]["attributes"].append(attribute)
+
+    for node in nodes.itervalues():
+        node["parents"] = uniquify(node["parents"])
 
-    for attribute in attribute_list:
-        attributes[attribute[0]] = attribute
-
-    for node in node_list:
-        if current_id is None or current_id != node["id"]:
-            # save current node
-            if current_node is not None:
-                current_node["parents"] = uniquify(current_node["parents"])
-                nodes[current_id] = current_node
-
-            # new node, start merging
-            current_id = node["id"]
-            current_node = {
-                "id": node["id"],
-                "uuid": node["uuid"],
-                "attributes": [],
-                "parents": [],
-                "name": node["name"],
-                "type": node["type"],
-                "file_uuid": node["file_uuid"]
-            }
-
-        # Fritz: Do the parents really differ or is this overhead?
-        if node["parents"] is not None:
-            current_node["parents"].append(node["parents"])
-
-        if node["attribute"] is not None:
-            try:
-                current_node["attributes"].append(
-                    attributes[node["attribute"]]
-                )
-            except:
-                pass
-
-    # save last node
-    if current_node is not None:
-        current_node["parents"] = uniquify(current_node["parents"])
-        nodes[current_id] = current_node
+    logger.info(
+        "Retrieved %s nodes and %s attributes (~%s bytes) in %s sec",
+        len(nodes), attribute_count, loaded_bytes, time.time() - start
+    )
 
     return nodes
 
@@ -354,28 +440,29 @@ def _create_annotated_node_objs(
         assay=None,
         attrs=None):
     """Helper method to bulk create annotated nodes.
+    `attrs` is an iterable of attribute tuples (see `Attribute.ALL_FIELDS`).
     """
     counter = 0
     if (node is not None and
             study is not None and
             assay is not None and
             attrs is not None):
-        for attr_key in attrs:
+        for attr in attrs:
             counter += 1
             bulk_list.append(
                 AnnotatedNode(
                     node_id=node["id"],
-                    attribute_id=attrs[attr_key][0],
+                    attribute_id=attr[0],
                     study=study,
                     assay=assay,
                     node_uuid=node["uuid"],
                     node_file_uuid=node["file_uuid"],
                     node_type=node["type"],
                     node_name=node["name"],
-                    attribute_type=attrs[attr_key][1],
-                    attribute_subtype=attrs[attr_key][2],
-                    attribute_value=attrs[attr_key][3],
-                    attribute_value_unit=attrs[attr_key][4]
+                    attribute_type=attr[1],
+                    attribute_subtype=attr[2],
+                    attribute_value=attr[3],
+                    attribute_value_unit=attr[4]
                 )
             )
 
@@ -437,6 +524,8 @@ def update_annotated_nodes(
     # Start timer
     start = time.time()
 
+    closures = _get_attribute_closures(nodes)
+
     # Holds AnnotatedNodes objects for bulk db entry creation
     bulk_list = []
 
@@ -457,9 +546,7 @@ def update_annotated_nodes(
         )
         if node["type"] == node_type:
             num_nodes_of_type += 1
-            attrs = _get_unique_parent_attributes(nodes, node_id)
-            u_len = len(attrs)
-            total_attrs += u_len
+            total_attrs += len(closures.get(node_id, ()))
     if total_attrs == total_unique_attrs * num_nodes_of_type \
             and len([
                 n for n in nodes.values() if n['type'] == 'Sample Name'
@@ -480,7 +567,7 @@ def update_annotated_nodes(
                 node,
                 study,
                 assay,
-                _get_unique_parent_attributes(nodes, node_id)
+                closures.get(node_id, ())
             )
 
     _create_annotated_node_objs(bulk_list)
@@ -547,6 +634,7 @@ def _add_annotated_nodes(
     # Insert node and attribute information
     start = time.time()
 
+    closures = _get_attribute_closures(nodes)
     counter = 0
     bulk_list = []
 
@@ -558,7 +646,7 @@ def _add_annotated_nodes(
                     node,
                     study,
                     assay,
-                    _get_unique_parent_attributes(nodes, node_id)
+                    closures.get(node_id, ())
                 )
                 counter += num_created
 
@@ -602,13 +690,74 @@ def _index_annotated_nodes(node_type, study_uuid, assay_uuid=None,
     logger.info("%s nodes for indexing", str(nodes.count()))
     # index nodes
     start = time.time()
-    node_index = NodeIndex()
-    counter = 0
-    for node in nodes:
-        node_index.update_object(node, using="data_set_manager")
-        counter += 1
+    counter = NodeIndex().update_objects(nodes, using="data_set_manager")
     end = time.time()
     logger.info("%s nodes indexed in %s", str(counter), str(end - start))
+    # facet statistics of re-indexed assays are stale
+    if assay_uuid is None:
+        invalidate_facet_cardinalities(
+            nodes.values_list("assay__uuid", flat=True).distinct()
+        )
+    else:
+        invalidate_facet_cardinalities([assay_uuid])
+
+
+def get_solr_terms_query(field, values):
+    """Return a Solr query matching documents with any of the given values"""
+    return '{}:({})'.format(
+        field, ' OR '.join('"{}"'.format(value) for value in values)
+    )
+
+
+def delete_nodes(nodes, solr_query=None):
+    """Delete Nodes along with their FileStoreItems and Solr documents
+    Set-based alternative to QuerySet.delete() which sends pre_delete for
+    every Node: referenced files are collected up front, database rows are
+    deleted with one query per table, Solr documents are removed with a
+    single delete-by-query request and data files are removed from disk by
+    a background task
+    :param nodes: Node queryset
+    :param solr_query: Solr query matching the documents of the Nodes (e.g.,
+    by study or analysis UUID), documents are looked up by Node ID otherwise
+    :returns: number of Nodes deleted
+    """
+    start = time.time()
+    node_ids = list(nodes.values_list('id', flat=True))
+    if not node_ids:
+        return 0
+    assay_uuids = list(nodes.filter(
+        assay__isnull=False
+    ).values_list('assay__uuid', flat=True).distinct())
+    with transaction.atomic():
+        file_names = delete_file_store_items(
+            FileStoreItem.objects.filter(uuid__in=nodes.exclude(
+                file_uuid__isnull=True
+            ).values('file_uuid'))
+        )
+        core.utils.bulk_delete(nodes)
+
+    if solr_query is None:
+        for index in range(0, len(node_ids), SOLR_TERMS_CHUNK_SIZE):
+            NodeIndex().remove_objects(
+                get_solr_terms_query(
+                    'django_id', node_ids[index:index + SOLR_TERMS_CHUNK_SIZE]
+                ),
+                using='data_set_manager'
+            )
+    else:
+        NodeIndex().remove_objects(solr_query, using='data_set_manager')
+    invalidate_assay_index_versions(assay_uuids)
+
+    if file_names:
+        try:
+            delete_files.delay(file_names)
+        except IOError as exc:  # message broker is not available
+            logger.error("Failed to schedule removal of %s data files: %s",
+                         len(file_names), exc)
+            delete_files(file_names)
+    logger.info("Deleted %s nodes and %s data files in %.1f sec",
+                len(node_ids), len(file_names), time.time() - start)
+    return len(node_ids)
 
 
 def generate_solr_params_for_assay(params, assay_uuid, exclude_facets=[]):
@@ -634,10 +783,13 @@ def generate_solr_params(
         params,
         assay_uuids,
         facets_from_config=False,
-        exclude_facets=[]):
+        exclude_facets=[],
+        terms_filter=False):
     """
     Either returns a solr url parameter string,
     or None if assay_uuids is empty.
+    If terms_filter is set, assays are filtered with a terms query, which
+    unlike a boolean query is not limited in its number of clauses.
     """
 
     is_annotation = params.get('is_annotation', 'false')
@@ -662,7 +814,12 @@ def generate_solr_params(
 
     if len(assay_uuids) == 0:
         return None
-    solr_params = 'fq=assay_uuid:({})'.format(' OR '.join(assay_uuids))
+    if terms_filter:
+        solr_params = 'fq={{!terms f=assay_uuid}}{}'.format(
+            ','.join(assay_uuids)
+        )
+    else:
+        solr_params = 'fq=assay_uuid:({})'.format(' OR '.join(assay_uuids))
 
     fq = params.get('fq')
     if fq is not None:
@@ -838,15 +995,26 @@ def generate_facet_fields_query(facet_fields):
     return query
 
 
-def search_solr(encoded_params, core):
+def search_solr(encoded_params, core, post=False):
     """Returns solr full_response content by making a solr request
     Parameters:
         encoded_params:  Expect the params to be url-ready (using urlquote)
         core: Specify which node
+        post: send the params in the request body instead of the URL, for
+        queries that might exceed the URL length limits
     """
     url_portion = '/'.join([core, "select"])
     url = urlparse.urljoin(settings.REFINERY_SOLR_BASE_URL, url_portion)
-    full_response = requests.get(url, params=encoded_params)
+    if post:
+        if isinstance(encoded_params, basestring):
+            # requests only requotes the spaces urlquote() leaves in URLs
+            encoded_params = encoded_params.replace(' ', '%20')
+        full_response = requests.post(
+            url, data=encoded_params,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+    else:
+        full_response = requests.get(url, params=encoded_params)
     if not full_response.ok:
         try:
             response_obj = json.loads(full_response.content)
@@ -869,6 +1037,77 @@ def search_solr(encoded_params, core):
     return response
 
 
+def _get_assay_files_cache_key(params, assay_uuid, exclude_facets):
+    # the parameters are normalized so that their order does not matter, the
+    # data set UUID is left out since it only selects the permission check
+    normalized_params = sorted(
+        (key, params.getlist(key) if hasattr(params, 'getlist') else value)
+        for key, value in params.items() if key != 'data_set_uuid'
+    )
+    digest = hashlib.sha1(
+        json.dumps([normalized_params, sorted(exclude_facets)])
+    ).hexdigest()
+    return 'assay-files-{}-{}-{}'.format(
+        assay_uuid, get_assay_index_version(assay_uuid), digest
+    )
+
+
+def get_assay_files_response(params, assay_uuid, exclude_facets=[]):
+    """Returns the formatted Solr response of the files of an assay (see
+    generate_solr_params_for_assay)
+    Responses are cached by request params and the index version of the
+    assay, so they are dropped when its Nodes are re-indexed or its attribute
+    order changes. Identical requests are coalesced: while one of them
+    queries Solr the others wait for its response instead of sending the
+    same query.
+    """
+    cache_key = _get_assay_files_cache_key(params, assay_uuid,
+                                           exclude_facets)
+    response = cache.get(cache_key)
+    if response is not None:
+        core.utils.incr_cache_counter(_ASSAY_FILES_HITS_KEY)
+        return response
+
+    lock_key = cache_key + '-lock'
+    is_locked = cache.add(lock_key, True, ASSAY_FILES_COALESCE_TIMEOUT)
+    if not is_locked:
+        deadline = time.time() + ASSAY_FILES_COALESCE_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(ASSAY_FILES_COALESCE_INTERVAL)
+            response = cache.get(cache_key)
+            if response is not None:
+                core.utils.incr_cache_counter(_ASSAY_FILES_COALESCED_KEY)
+                return response
+            if cache.get(lock_key) is None:
+                break  # the first request failed, query Solr instead
+
+    core.utils.incr_cache_counter(_ASSAY_FILES_MISSES_KEY)
+    try:
+        solr_params = generate_solr_params_for_assay(params, assay_uuid,
+                                                     exclude_facets)
+        response = format_solr_response(
+            search_solr(solr_params, 'data_set_manager')
+        )
+        cache.set(cache_key, response, ASSAY_FILES_CACHE_TIMEOUT)
+    finally:
+        if is_locked:
+            cache.delete(lock_key)
+    return response
+
+
+def get_assay_files_cache_metrics():
+    hits = cache.get(_ASSAY_FILES_HITS_KEY) or 0
+    coalesced = cache.get(_ASSAY_FILES_COALESCED_KEY) or 0
+    misses = cache.get(_ASSAY_FILES_MISSES_KEY) or 0
+    total = hits + coalesced + misses
+    return {
+        'hits': hits,
+        'coalesced': coalesced,
+        'misses': misses,
+        'hit_ratio': float(hits + coalesced) / total if total else None
+    }
+
+
 def get_owner_from_assay(uuid):
     # Returns the owner from an assay_uuid. Ownership is passed from dataset
 
@@ -1116,6 +1355,67 @@ def get_file_url_from_node_uuid(node_uuid, require_valid_url=False):
         return core.utils.get_absolute_url(url) if url else None
 
 
+def get_node_files(node_uuids, require_valid_urls=False):
+    """
+    Bulk version of get_file_url_from_node_uuid(): fetch the Nodes with the
+    given UUIDs and their FileStoreItems with one query each.
+    NOTE: Since this method is called within the context of a db transaction,
+    we are raising exceptions within to nullify said transaction.
+
+    :param node_uuids: iterable of Node UUIDs
+    :param require_valid_urls: boolean
+    :return: dict of Node UUID -> {"node": Node, "file_store_item":
+    FileStoreItem or None, "url": full url pointing to the datafile or None}
+    :raises: RuntimeError if a Node can't be fetched or if valid datafile
+    urls were explicitly required and one wasn't available
+    """
+    node_uuids = set(node_uuids)
+    nodes = {}
+    for node in Node.objects.filter(uuid__in=node_uuids):
+        if node.uuid in nodes:
+            raise RuntimeError(
+                "Couldn't fetch Node by UUID from: {}".format(node.uuid)
+            )
+        nodes[node.uuid] = node
+    if len(nodes) < len(node_uuids):
+        raise RuntimeError("Couldn't fetch Node by UUID from: {}".format(
+            ", ".join(sorted(node_uuids - set(nodes)))
+        ))
+
+    file_store_items = {}
+    for file_store_item in FileStoreItem.objects.filter(
+            uuid__in=set(node.file_uuid for node in nodes.itervalues()
+                         if node.file_uuid)):
+        # None marks UUIDs shared by several FileStoreItems
+        file_store_items[file_store_item.uuid] = (
+            None if file_store_item.uuid in file_store_items
+            else file_store_item
+        )
+
+    node_files = {}
+    for node_uuid, node in nodes.iteritems():
+        file_store_item = file_store_items.get(node.file_uuid)
+        if file_store_item is None:
+            if node.file_uuid:
+                logger.error("Couldn't fetch FileStoreItem by UUID from: %s",
+                             node.file_uuid)
+            url = None
+        else:
+            url = file_store_item.get_datafile_url()
+        if require_valid_urls and url is None:
+            raise RuntimeError(
+                "Node with uuid: {} has no associated file url".format(
+                    node_uuid
+                )
+            )
+        node_files[node_uuid] = {
+            "node": node,
+            "file_store_item": file_store_item,
+            "url": core.utils.get_absolute_url(url) if url else None
+        }
+    return node_files
+
+
 def fix_last_column(file):
     """If the header has empty columns in it, then it will delete this and
     corresponding columns in the rows; returns 0 or 1 based on whether it
@@ -1192,3 +1492,42 @@ def get_solr_response_json(node_uuids):
         'data_set_manager'
     )
     return format_solr_response(solr_response)
+
+
+def get_solr_node_pages(solr_filter, rows=constants.REFINERY_SOLR_DOC_LIMIT,
+                        sort=None, fields=None, post=False):
+    """
+    Yield the Solr documents of all Nodes matching a filter query one page
+    (list) at a time, following Solr's cursorMark so that result sets of any
+    size are retrieved without truncation or deep paging
+    :param solr_filter: Solr filter query, e.g. 'assay_uuid:("<uuid>")', or
+    list of filter queries
+    :param rows: number of documents per page
+    :param sort: Solr sort, e.g. 'name asc', the unique key is appended as
+    the tie-breaker cursors require
+    :param fields: list of fields to return, all fields by default
+    :param post: send the queries in the request body (see search_solr)
+    """
+    params = {
+        "q": "django_ct:data_set_manager.node",
+        "wt": "json",
+        "fq": solr_filter,
+        "rows": rows,
+        # cursors require sorting on the unique key
+        "sort": "{}, id asc".format(sort) if sort else "id asc"
+    }
+    if fields:
+        params["fl"] = ",".join(fields)
+    cursor_mark = "*"
+    while True:
+        solr_response = json.loads(search_solr(
+            dict(params, cursorMark=cursor_mark), 'data_set_manager', post
+        ))
+        docs = solr_response["response"]["docs"]
+        if docs:
+            yield docs
+        next_cursor_mark = solr_response.get("nextCursorMark")
+        if (len(docs) < rows or next_cursor_mark is None or
+                next_cursor_mark == cursor_mark):
+            return
+        cursor_mark = next_cursor_mark
@@ -27,34 +27,30 @@ from chunked_upload.models import ChunkedUpload
 from chunked_upload.views import ChunkedUploadCompleteView, ChunkedUploadView
 from guardian.shortcuts import get_perms
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from core.models import DataSet, ExtendedGroup, get_user_import_dir
 from core.utils import get_absolute_url
-from data_set_manager.isa_tab_parser import ParserException
-from file_store.models import (
-    generate_file_source_translator, get_temp_dir, parse_s3_url
-)
-from file_store.tasks import download_file, import_file
+from file_store.models import generate_file_source_translator, parse_s3_url
 
-from .models import Assay, AttributeOrder, Study
+from .models import (Assay, AttributeOrder, ISATabImportJob, Study,
+                     invalidate_assay_index_versions)
 from .serializers import AssaySerializer, AttributeOrderSerializer
 from .single_file_column_parser import process_metadata_table
-from .tasks import parse_isatab
+from .tasks import PARSER_UNEXPECTED_ERROR_MESSAGE, import_isatab
 from .utils import (
-    customize_attribute_response, format_solr_response,
-    generate_solr_params_for_assay, get_owner_from_assay,
-    initialize_attribute_order_ranks, is_field_in_hidden_list, search_solr,
-    update_attribute_order_ranks
+    calculate_checksum, customize_attribute_response,
+    get_assay_files_cache_metrics, get_assay_files_response,
+    get_owner_from_assay, initialize_attribute_order_ranks,
+    is_field_in_hidden_list, update_attribute_order_ranks
 )
 
 logger = logging.getLogger(__name__)
 
 
 # Data set import
-PARSER_ERROR_MESSAGE = "Improperly structured ISA-Tab file: "
-PARSER_UNEXPECTED_ERROR_MESSAGE = "ISA-Tab import Failure: "
 
 
 class DataSetImportView(View):
@@ -159,7 +155,10 @@ class ImportISATabFileForm(forms.Form):
 
 
 class ProcessISATabView(View):
-    """Process ISA archive"""
+    """Process ISA archive
+    Archives are parsed by an ISATabImportJob in a Celery worker, the
+    response identifies the job to poll for the progress of the import
+    """
     template_name = 'data_set_manager/isa-tab-import.html'
     success_view_name = 'data_set'
     isa_tab_cookie_name = 'isa_tab_url'
@@ -183,64 +182,12 @@ class ProcessISATabView(View):
                                           context_instance=context)
             response.delete_cookie(self.isa_tab_cookie_name)
             return response
-        u = urlparse.urlparse(url)
-        file_name = u.path.split('/')[-1]
-        temp_file_path = os.path.join(get_temp_dir(), file_name)
-        try:
-            # TODO: refactor download_file to take file handle instead of path
-            download_file(url, temp_file_path)
-        except RuntimeError as exc:
-            logger.error("Problem downloading ISA-Tab file. %s", exc)
-            error = "Problem downloading ISA-Tab file from: '{}'".format(url)
-            context = RequestContext(request, {'form': form, 'error': error})
-            response = render_to_response(self.template_name,
-                                          context_instance=context)
-            response.delete_cookie(self.isa_tab_cookie_name)
-            return response
-        logger.debug("Temp file name: '%s'", temp_file_path)
-        try:
-            dataset_uuid = parse_isatab(
-                request.user.username,
-                False,
-                temp_file_path
-            )
-        except ParserException as e:
-            error_message = "{} {}".format(
-                PARSER_ERROR_MESSAGE,
-                e.message
-            )
-            logger.error(error_message)
-            return HttpResponseBadRequest(error_message)
-        except Exception as e:
-            error_message = "{} {}".format(
-                PARSER_UNEXPECTED_ERROR_MESSAGE,
-                traceback.format_exc(e)
-            )
-            logger.error(error_message)
-            return HttpResponseBadRequest(
-                PARSER_UNEXPECTED_ERROR_MESSAGE +
-                e.message
-            )
-        try:
-            os.unlink(temp_file_path)
-        except OSError as exc:
-            logger.error("Couldn't unlink ISATab's `temp_file_path`: %s %s",
-                         temp_file_path, exc)
-        if dataset_uuid:
-            if 'ajax' in kwargs and kwargs['ajax']:
-                return JsonResponse({'new_data_set_uuid': dataset_uuid})
-            else:
-                response = HttpResponseRedirect(
-                    reverse(self.success_view_name, args=(dataset_uuid,)))
-                response.delete_cookie(self.isa_tab_cookie_name)
-                return response
-        else:
-            error = "Problem parsing ISA-Tab file"
-            context = RequestContext(request, {'form': form, 'error': error})
-            response = render_to_response(self.template_name,
-                                          context_instance=context)
-            response.delete_cookie(self.isa_tab_cookie_name)
-            return response
+        response = self.start_import(
+            request, form, url, self.get_archive_path(url),
+            ajax=kwargs.get('ajax')
+        )
+        response.delete_cookie(self.isa_tab_cookie_name)
+        return response
 
     def post(self, request, *args, **kwargs):
         form = ImportISATabFileForm(request.POST, request.FILES)
@@ -256,18 +203,6 @@ class ProcessISATabView(View):
             except KeyError:
                 url = None
 
-            if url:
-                response = self.import_by_url(url)
-            else:
-                try:
-                    response = self.import_by_file(f)
-                except Exception as e:
-                    logger.error(traceback.format_exc(e))
-                    return HttpResponseBadRequest(
-                       "{} {}".format(
-                        PARSER_UNEXPECTED_ERROR_MESSAGE, e)
-                    )
-
             # get AWS Cognito identity ID
             if settings.REFINERY_DEPLOYMENT_PLATFORM == 'aws':
                 try:
@@ -285,6 +220,22 @@ class ProcessISATabView(View):
             else:
                 identity_id = None
 
+            if url:
+                # downloaded by the import job
+                return self.start_import(
+                    request, form, url, self.get_archive_path(url),
+                    identity_id=identity_id, ajax=request.is_ajax()
+                )
+
+            try:
+                response = self.import_by_file(f)
+            except Exception as e:
+                logger.error(traceback.format_exc(e))
+                return HttpResponseBadRequest(
+                   "{} {}".format(
+                    PARSER_UNEXPECTED_ERROR_MESSAGE, e)
+                )
+
             if not response['success']:
                 if request.is_ajax():
                     return HttpResponseBadRequest(
@@ -305,76 +256,60 @@ class ProcessISATabView(View):
             logger.debug(
                 "Temp file name: '%s'", response['data']['temp_file_path']
             )
-
-            try:
-                parse_isatab_invocation = parse_isatab(
-                    request.user.username,
-                    False,
-                    response['data']['temp_file_path'],
-                    identity_id=identity_id
-                )
-            except ParserException as e:
-                error_message = "{} {}".format(
-                    PARSER_ERROR_MESSAGE,
-                    e.message
-                )
-                logger.error(error_message)
-                return HttpResponseBadRequest(error_message)
-            except Exception as e:
-                error_message = "{} {}".format(
-                    PARSER_UNEXPECTED_ERROR_MESSAGE,
-                    traceback.format_exc(e)
-                )
-                logger.error(error_message)
-                return HttpResponseBadRequest(
-                    "{} {}".format(PARSER_UNEXPECTED_ERROR_MESSAGE, e)
-                )
-            else:
-                dataset_uuid = parse_isatab_invocation
-
-            # import data files
-            if dataset_uuid:
-                try:
-                    dataset = DataSet.objects.get(uuid=dataset_uuid)
-                except (DataSet.DoesNotExist, DataSet.MultipleObjectsReturned):
-                    logger.error(
-                        "Cannot import data files for data set UUID '%s'",
-                        dataset_uuid
-                    )
-                else:
-                    # start importing uploaded data files
-                    for file_store_item in dataset.get_file_store_items():
-                        if file_store_item.source.startswith(
-                            (settings.REFINERY_DATA_IMPORT_DIR, 's3://')
-                        ):
-                            import_file.delay(file_store_item.uuid)
-
-                if request.is_ajax():
-                    return JsonResponse({
-                        'success': 'Data set imported',
-                        'data': {'new_data_set_uuid': dataset_uuid}
-                    })
-                return HttpResponseRedirect(
-                    reverse(self.success_view_name, args=[dataset_uuid])
-                )
-            else:
-                error = 'Problem parsing ISA-Tab file'
-                if request.is_ajax():
-                    return JsonResponse({'error': error})
-                context = RequestContext(request, {'form': form,
-                                                   'error': error})
-                return render_to_response(self.template_name,
-                                          context_instance=context)
+            return self.start_import(
+                request, form, f.name, response['data']['temp_file_path'],
+                checksum=response['data']['checksum'],
+                identity_id=identity_id, ajax=request.is_ajax()
+            )
         else:  # submitted form is not valid
             context = RequestContext(request, {'form': form})
             return render_to_response(self.template_name,
                                       context_instance=context)
 
+    def start_import(self, request, form, source, temp_file_path,
+                     checksum='', identity_id=None, ajax=False):
+        """Queue an ISATabImportJob unless the same archive is already being
+        imported by the user
+        """
+        job = ISATabImportJob(user=request.user, source=source,
+                              path=temp_file_path, checksum=checksum,
+                              identity_id=identity_id)
+        duplicate = job.get_duplicate()
+        if duplicate is not None:
+            error = "This ISA-Tab archive is already being imported"
+            job.remove_archive()
+            if ajax:
+                return JsonResponse(
+                    {'error': error,
+                     'data': {'import_job_uuid': duplicate.uuid}},
+                    status=409
+                )
+            return HttpResponseRedirect(
+                reverse('isa_tab_import_job_progress', args=[duplicate.uuid])
+            )
+
+        job.save()
+        import_isatab.delay(job.uuid)
+        if ajax:
+            return JsonResponse({
+                'success': 'ISA-Tab import started',
+                'data': {
+                    'import_job_uuid': job.uuid,
+                    'import_job_url': reverse('isa_tab_import_job',
+                                              args=[job.uuid])
+                }
+            }, status=202)
+        # e.g., imports started from external sites
+        return HttpResponseRedirect(
+            reverse('isa_tab_import_job_progress', args=[job.uuid])
+        )
+
     def import_by_file(self, file):
-        temp_file_path = os.path.join(get_temp_dir(), file.name)
+        temp_file_path = ISATabImportJob.make_archive_path(file.name)
         try:
             handle_uploaded_file(file, temp_file_path)
         except IOError as e:
+            shutil.rmtree(os.path.dirname(temp_file_path), ignore_errors=True)
             error_msg = "Error writing ISA-Tab file to disk"
             logger.error(
                 "%s. IOError: %s, file name: %s, error: %s.",
@@ -387,40 +322,67 @@ class ProcessISATabView(View):
                 "success": False,
                 "message": error_msg
             }
+        with open(temp_file_path, 'rb') as archive:
+            checksum = calculate_checksum(archive)
 
         return {
             "success": True,
             "message": "File imported.",
             "data": {
-                "temp_file_path": temp_file_path
+                "temp_file_path": temp_file_path,
+                "checksum": checksum
             }
         }
 
-    def import_by_url(self, url):
-        # TODO: replace with chain
-        # http://docs.celeryproject.org/en/latest/userguide/tasks.html#task-synchronous-subtasks
-        parsed_url = urlparse.urlparse(url)
-        file_name = parsed_url.path.split('/')[-1]
-        temp_file_path = os.path.join(get_temp_dir(), file_name)
-        try:
-            # TODO: refactor download_file to take file handle instead
-            # of path
-            download_file(url, temp_file_path)
-        except RuntimeError as exc:
-            error_msg = "Problem downloading ISA-Tab file from: " + url
-            logger.error("%s. %s", error_msg, exc)
-            return {
-                "success": False,
-                "message": error_msg
-            }
-
-        return {
-            "success": True,
-            "message": "File imported.",
-            "data": {
-                "temp_file_path": temp_file_path
-            }
-        }
+    @staticmethod
+    def get_archive_path(url):
+        file_name = urlparse.urlparse(url).path.split('/')[-1]
+        return ISATabImportJob.make_archive_path(file_name)
+
+
+class ISATabImportJobView(View):
+    """Progress of an ISA-Tab import started by the current user"""
+    def get(self, request, uuid, *args, **kwargs):
+        job = get_object_or_404(ISATabImportJob, uuid=uuid,
+                                user=request.user)
+        job.fail_if_stale()
+        phase, message = job.get_phase()
+        return JsonResponse({
+            'uuid': job.uuid,
+            'source': job.source,
+            'phase': phase,
+            'phase_description': dict(ISATabImportJob.PHASES)[phase],
+            'message': message,
+            'data_set_uuid': job.data_set_uuid,
+            'creation_date': job.creation_date,
+            'modification_date': job.modification_date
+        })
+
+
+class ISATabImportJobProgressView(View):
+    """Page following an ISA-Tab import started without AJAX, which reloads
+    itself until the import finished and then opens the new data set
+    """
+    template_name = 'data_set_manager/isa-tab-import-job.html'
+    success_view_name = 'data_set'
+    refresh_interval = 3  # seconds
+
+    def get(self, request, uuid, *args, **kwargs):
+        job = get_object_or_404(ISATabImportJob, uuid=uuid,
+                                user=request.user)
+        job.fail_if_stale()
+        phase, message = job.get_phase()
+        if phase == ISATabImportJob.SUCCESS:
+            return HttpResponseRedirect(
+                reverse(self.success_view_name, args=[job.data_set_uuid])
+            )
+        return render(request, self.template_name, {
+            'import_job': job,
+            'phase_description': dict(ISATabImportJob.PHASES)[phase],
+            'message': message,
+            'is_active': phase in ISATabImportJob.ACTIVE_PHASES,
+            'refresh_interval': self.refresh_interval
+        })
 
 
 def handle_uploaded_file(source_file, target_path):
@@ -814,22 +776,17 @@ class AssaysFiles(APIView):
 
             if request.user.has_perm('core.read_dataset', data_set) or \
                     'read_dataset' in get_perms(public_group, data_set):
-                solr_params = generate_solr_params_for_assay(params, uuid)
+                exclude_facets = []
             elif request.user.has_perm('core.read_meta_dataset', data_set) or \
                     'read_meta_dataset' in get_perms(public_group, data_set):
-                solr_params = generate_solr_params_for_assay(
-                    params,
-                    uuid,
-                    ['REFINERY_DOWNLOAD_URL', 'REFINERY_NAME']
-                )
+                exclude_facets = ['REFINERY_DOWNLOAD_URL', 'REFINERY_NAME']
             else:
                 message = 'User does not have read permissions.'
                 return Response(message, status=status.HTTP_401_UNAUTHORIZED)
 
-            solr_response = search_solr(solr_params, 'data_set_manager')
-            solr_response_json = format_solr_response(solr_response)
-
-            return Response(solr_response_json)
+            return Response(
+                get_assay_files_response(params, uuid, exclude_facets)
+            )
         else:
             return Response(
                 'Requires data set uuid.',
@@ -837,6 +794,17 @@ class AssaysFiles(APIView):
             )
 
 
+class AssaysFilesCacheMetrics(APIView):
+    """
+    Return the hit and miss counts of the cache of assay files responses.
+    Restricted to admins.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(get_assay_files_cache_metrics())
+
+
 class AssaysAttributes(APIView):
     """
     AttributeOrder Resource.
@@ -975,6 +943,7 @@ class AssaysAttributes(APIView):
                                                   partial=True)
             if serializer.is_valid():
                 serializer.save()
+                invalidate_assay_index_versions([uuid])
                 attributes = serializer.data
                 attributes['display_name'] = customize_attribute_response(
                     [attributes.get('solr_field')])[0].get(
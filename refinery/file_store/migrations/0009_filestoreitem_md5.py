@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_store', '0008_auto_20180226_1110'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestoreitem',
+            name='md5',
+            field=models.CharField(max_length=32, blank=True),
+        ),
+    ]
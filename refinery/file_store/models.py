@@ -9,12 +9,14 @@ FILE_STORE_DIR setting - main file store directory
 * must be writeable by the Django server
 """
 
+import hashlib
 import logging
 import os
 import re
 import urlparse
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.db import models
 from django.db.models.signals import post_delete
@@ -22,12 +24,17 @@ from django.dispatch import receiver
 
 import celery
 from django_extensions.db.fields import UUIDField
+from djcelery.backends.database import DatabaseBackend
+from djcelery.models import TaskMeta
 
 import constants
 import core
 
 logger = logging.getLogger(__name__)
 
+# expiration time of the state of a file import task in the progress store
+IMPORT_PROGRESS_CACHE_TIMEOUT = 60 * 60  # seconds
+
 
 def _mkdir(path):
     """Create directory given absolute file system path"""
@@ -121,6 +128,8 @@ class FileStoreItem(models.Model):
     filetype = models.ForeignKey(FileType, blank=True, null=True)
     # ID of Celery task used for importing the data file
     import_task_id = UUIDField(auto=False, blank=True)
+    # MD5 digest of the data file (computed during import)
+    md5 = models.CharField(blank=True, max_length=32)
     # Date created
     created = models.DateTimeField(auto_now_add=True)
     # Date updated
@@ -135,17 +144,31 @@ class FileStoreItem(models.Model):
             return str(self.uuid)  # UUID is available only after save()
 
     def save(self, *args, **kwargs):
+        self.prepare_for_save()
+        super(FileStoreItem, self).save(*args, **kwargs)
+
+    def prepare_for_save(self, filetypes=None):
+        """Map source, assign file type and symlink datafile if possible
+        Has to be called explicitly before bulk_create() which bypasses save()
+        filetypes: optional dict used to cache file types by extension
+        """
         self.source = _map_source(self.source)
 
         if not self.filetype:
             # set file type using file extension
-            try:
-                extension = self.get_file_extension()
-            except RuntimeError as exc:
-                logger.warn("Could not assign type to file '%s': %s",
-                            self, exc)
+            extension_name = self.get_extension()
+            if filetypes is not None and extension_name in filetypes:
+                self.filetype = filetypes[extension_name]
             else:
-                self.filetype = extension.filetype
+                try:
+                    extension = self.get_file_extension()
+                except RuntimeError as exc:
+                    logger.warn("Could not assign type to file '%s': %s",
+                                self, exc)
+                else:
+                    self.filetype = extension.filetype
+                if filetypes is not None:
+                    filetypes[extension_name] = self.filetype
 
         # symlink datafile if possible
         if (not self.datafile and os.path.isabs(self.source) and
@@ -153,8 +176,6 @@ class FileStoreItem(models.Model):
                 get_temp_dir() not in self.source):
             self._symlink_datafile()
 
-        super(FileStoreItem, self).save(*args, **kwargs)
-
     def get_absolute_path(self):
         """
         Construct the absolute path to the data file.
@@ -238,6 +259,7 @@ class FileStoreItem(models.Model):
         if self.datafile:
             file_name = self.datafile.name
             logger.debug("Deleting datafile '%s'", file_name)
+            self.md5 = ''
             try:
                 self.datafile.delete(save=save_instance)
             except OSError as exc:
@@ -292,6 +314,23 @@ class FileStoreItem(models.Model):
         else:
             logger.error("Symlinking failed: source is not a file")
 
+    def get_md5(self):
+        """Return the MD5 digest of the data file or an empty string if the
+        file is not available
+        Digest is computed during file import, files added by other means are
+        hashed once and the digest is stored for subsequent calls
+        """
+        if not self.md5 and self.is_local():
+            hasher = hashlib.md5()
+            chunk_size = 10 * 1024 * 1024  # 10MB
+            with open(self.get_absolute_path(), 'rb') as datafile:
+                for chunk in iter(lambda: datafile.read(chunk_size), ''):
+                    hasher.update(chunk)
+            self.md5 = hasher.hexdigest()
+            # avoid side effects of save()
+            FileStoreItem.objects.filter(pk=self.pk).update(md5=self.md5)
+        return self.md5
+
     def get_datafile_url(self):
         """Returns relative or absolute URL of the datafile depending on file
         availability and MEDIA_URL setting
@@ -310,6 +349,9 @@ class FileStoreItem(models.Model):
         """Return file import task state"""
         if not self.import_task_id:
             return constants.NOT_AVAILABLE
+        progress = get_import_progress(self.import_task_id)
+        if progress is not None:
+            return progress['state']
         return celery.result.AsyncResult(self.import_task_id).state
 
     def terminate_file_import_task(self):
@@ -318,6 +360,7 @@ class FileStoreItem(models.Model):
                         self.import_task_id, self)
             result = celery.result.AsyncResult(self.import_task_id)
             result.revoke(terminate=True)
+            clear_import_progress(self.import_task_id)
 
 
 def get_temp_dir():
@@ -325,6 +368,89 @@ def get_temp_dir():
     return settings.FILE_STORE_TEMP_DIR
 
 
+def _get_import_progress_key(task_id):
+    return 'file_import_progress_{}'.format(task_id)
+
+
+def get_import_progress(task_id):
+    """Return the latest state and progress published by a file import task
+    to the shared progress store or None if not available
+    Cheaper to read than the Celery result backend
+    """
+    return cache.get(_get_import_progress_key(task_id))
+
+
+def set_import_progress(task_id, state, **progress):
+    """Publish state and optional progress info of a file import task"""
+    progress['state'] = state
+    cache.set(_get_import_progress_key(task_id), progress,
+              IMPORT_PROGRESS_CACHE_TIMEOUT)
+
+
+def get_import_statuses(task_ids):
+    """Return states of many file import tasks keyed by task ID
+    States are read from the progress store with one lookup and the rest
+    from the result backend with one query (instead of an AsyncResult
+    lookup per task), completed states are added to the progress store
+    """
+    keys = dict((_get_import_progress_key(task_id), task_id)
+                for task_id in set(task_ids))
+    statuses = dict((keys[key], progress['state']) for key, progress in
+                    cache.get_many(keys.keys()).iteritems())
+    missing = [task_id for task_id in keys.itervalues()
+               if task_id not in statuses]
+    if not missing:
+        return statuses
+
+    if isinstance(celery.current_app.backend, DatabaseBackend):
+        stored = dict(TaskMeta.objects.filter(
+            task_id__in=missing
+        ).values_list('task_id', 'status'))
+        for task_id in missing:
+            # the backend has no record of tasks that did not start yet
+            statuses[task_id] = stored.get(task_id, celery.states.PENDING)
+    else:
+        for task_id in missing:
+            statuses[task_id] = celery.result.AsyncResult(task_id).state
+    cache.set_many(
+        dict((_get_import_progress_key(task_id), {'state': statuses[task_id]})
+             for task_id in missing
+             if statuses[task_id] in celery.states.READY_STATES),
+        IMPORT_PROGRESS_CACHE_TIMEOUT
+    )
+    return statuses
+
+
+def clear_import_progress(task_id):
+    """Make readers fall back to the Celery result backend"""
+    cache.delete(_get_import_progress_key(task_id))
+
+
+def delete_file_store_items(file_store_items):
+    """Delete FileStoreItems with set-based queries
+    Bulk alternative to QuerySet.delete() which sends post_delete for every
+    item: file import tasks are revoked with one broadcast and data files
+    are left on disk for the caller to remove (e.g., with a background task)
+    :param file_store_items: FileStoreItem queryset
+    :returns: list of data file names relative to the file store
+    """
+    file_names = []
+    task_ids = []
+    for file_name, task_id in file_store_items.values_list(
+            'datafile', 'import_task_id').iterator():
+        if file_name:
+            file_names.append(file_name)
+        if task_id:
+            task_ids.append(task_id)
+    if task_ids:
+        logger.info("Terminating %s file import tasks", len(task_ids))
+        celery.current_app.control.revoke(task_ids, terminate=True)
+        cache.delete_many([_get_import_progress_key(task_id)
+                           for task_id in task_ids])
+    core.utils.bulk_delete(file_store_items)
+    return file_names
+
+
 # post_delete is safer than pre_delete
 @receiver(post_delete, sender=FileStoreItem)
 def _delete_datafile(sender, instance, **kwargs):
@@ -1,6 +1,7 @@
+import hashlib
 import os
 import stat
-from tempfile import NamedTemporaryFile
+import time
 import urlparse
 
 from django.conf import settings
@@ -19,12 +20,84 @@ from requests.exceptions import (ConnectionError, ContentDecodingError,
 from data_set_manager.models import Node
 from data_set_manager.search_indexes import NodeIndex
 
-from .models import FileStoreItem, _mkdir, get_temp_dir, parse_s3_url
+from .models import (FileStoreItem, _mkdir, clear_import_progress,
+                     get_temp_dir, parse_s3_url, set_import_progress)
+from .utils import HTTPDownload, S3Download, TransferError
 
 logger = celery.utils.log.get_task_logger(__name__)
 logger.setLevel(celery.utils.LOG_LEVELS['DEBUG'])
 
 
+class TransferProgress(object):
+    """Progress reporter for file transfers made by a task
+    Progress is published to the shared progress store at most every
+    REFINERY_FILE_IMPORT_PROGRESS_INTERVAL seconds and to the Celery result
+    backend only after advancing by REFINERY_FILE_IMPORT_PROGRESS_STEP percent
+    instead of once per block transferred
+    """
+    def __init__(self, task):
+        self.task = task
+        self.task_id = task.request.id
+        self.started = None
+        self.initial = 0  # bytes transferred by previous attempts
+        self.current = 0
+        self.total = 0
+        self.published = 0  # time of last update of the progress store
+        self.published_percent = None  # last percentage sent to the backend
+
+    def __call__(self, current, total):
+        now = time.time()
+        if self.started is None:
+            self.started = now
+            self.initial = current
+        self.current = current
+        self.total = total
+        # check if we have a sane value for file size
+        if total > 0:
+            percent_done = current * 100. / total
+        else:
+            percent_done = 0
+        update_backend = (
+            self.published_percent is None or
+            percent_done - self.published_percent >=
+            settings.REFINERY_FILE_IMPORT_PROGRESS_STEP
+        )
+        if (update_backend or now - self.published >=
+                settings.REFINERY_FILE_IMPORT_PROGRESS_INTERVAL):
+            self._publish(now, percent_done, update_backend)
+
+    def _publish(self, now, percent_done, update_backend):
+        if not self.task_id:  # not called as a task
+            return
+        meta = {
+            "percent_done": "{:.0f}".format(percent_done),
+            "current": self.current,
+            "total": self.total,
+            "throughput": round(self.get_throughput(), 2)
+        }
+        set_import_progress(self.task_id, "PROGRESS", **meta)
+        self.published = now
+        if update_backend:
+            self.task.update_state(state="PROGRESS", meta=meta)
+            self.published_percent = percent_done
+
+    def get_throughput(self):
+        """Return average transfer rate in MB/s (excluding data transferred
+        by previous attempts)
+        """
+        if self.started is None:
+            return 0.
+        elapsed = time.time() - self.started
+        if elapsed <= 0:
+            return 0.
+        return (self.current - self.initial) / elapsed / 2 ** 20
+
+    def finish(self, source):
+        logger.info("Transferred %d bytes from '%s' at %.2f MB/s",
+                    self.current - self.initial, source,
+                    self.get_throughput())
+
+
 @task(track_started=True)
 def import_file(uuid, refresh=False, file_size=0):
     """Download or copy file specified by UUID
@@ -67,6 +140,7 @@ def import_file(uuid, refresh=False, file_size=0):
         if refresh:
             logger.info("Data file replacement requested: deleting data file")
             item.datafile.delete(save=False)
+            item.md5 = ''
         else:
             logger.info("File already exists: '%s'", item.get_absolute_path())
             return
@@ -111,11 +185,13 @@ def import_file(uuid, refresh=False, file_size=0):
             logger.debug("Copying external file '%s' into file store",
                          item.source)
             chunk_size = 10 * 1024 * 1024  # 10MB
+            hasher = hashlib.md5()
             try:
                 with open(item.source, 'rb') as external, \
                         open(file_store_path, 'wb') as local:
                     for chunk in iter(lambda: external.read(chunk_size), ''):
                         local.write(chunk)
+                        hasher.update(chunk)
             except IOError as exc:
                 logger.error(
                     "Error copying external file '%s' into file store: %s",
@@ -131,37 +207,53 @@ def import_file(uuid, refresh=False, file_size=0):
                 # http://stackoverflow.com/a/33143545
                 raise celery.exceptions.Ignore()
             else:
+                item.md5 = hasher.hexdigest()
                 logger.info("Copied external file '%s' into file store",
                             item.source)
 
     elif item.source.startswith('s3://'):
         bucket_name, key = parse_s3_url(item.source)
-        s3 = boto3.resource('s3')
-        uploaded_object = s3.Object(bucket_name, key)
-        with NamedTemporaryFile(dir=get_temp_dir()) as download:
-            logger.debug("Downloading file from '%s'", item.source)
-            try:
-                uploaded_object.download_fileobj(download)
-            except botocore.exceptions.ClientError as exc:
-                logger.error("Failed to download '%s': %s", item.source, exc)
-                import_file.update_state(state=celery.states.FAILURE,
-                                         meta='Failed to import uploaded file')
-                # http://stackoverflow.com/a/33143545
-                raise celery.exceptions.Ignore()
-            logger.debug("Saving downloaded file '%s'", download.name)
-            item.datafile.save(os.path.basename(key), File(download),
+        progress = TransferProgress(import_file)
+        download = S3Download(
+            bucket_name, key, _get_partial_path(item),
+            parallel=settings.REFINERY_FILE_IMPORT_PARALLEL_RANGES,
+            progress=progress
+        )
+        logger.debug("Downloading file from '%s'", item.source)
+        try:
+            item.md5 = download.run()
+        except (botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError, IOError,
+                TransferError) as exc:
+            # partial file is kept to resume the download on the next attempt
+            logger.error("Failed to download '%s': %s", item.source, exc)
+            import_file.update_state(state=celery.states.FAILURE,
+                                     meta='Failed to import uploaded file')
+            # http://stackoverflow.com/a/33143545
+            raise celery.exceptions.Ignore()
+        progress.finish(item.source)
+        logger.debug("Saving downloaded file '%s'", download.path)
+        with open(download.path, 'rb') as downloaded:
+            item.datafile.save(os.path.basename(key), File(downloaded),
                                save=False)  # item is saved below
-            logger.info("Saved downloaded file to '%s'", item.datafile.name)
+        download.discard()
+        logger.info("Saved downloaded file to '%s'", item.datafile.name)
+        s3 = boto3.resource('s3')
         try:
             s3.Object(bucket_name, key).delete()
         except botocore.exceptions.ClientError as exc:
             logger.error("Failed to delete '%s': %s", item.source, exc)
 
     else:  # assume that source is a regular URL
+        progress = TransferProgress(import_file)
+        download = HTTPDownload(
+            item.source, _get_partial_path(item), file_size=file_size,
+            parallel=settings.REFINERY_FILE_IMPORT_PARALLEL_RANGES,
+            progress=progress
+        )
         # check if source file can be downloaded
         try:
-            response = requests.get(item.source, stream=True)
-            response.raise_for_status()
+            download.start()
         except HTTPError as exc:
             logger.error("Could not open URL '%s': '%s'", item.source, exc)
             import_file.update_state(state=celery.states.FAILURE,
@@ -174,60 +266,29 @@ def import_file(uuid, refresh=False, file_size=0):
             logger.error("Could not open URL '%s': '%s'", item.source, exc)
             return None
 
-        with NamedTemporaryFile(dir=get_temp_dir(), delete=False) as tmpfile:
-            # provide a default value in case Content-Length is missing
-            remote_file_size = int(
-                response.headers.get('Content-Length', file_size)
-            )
-            logger.debug("Downloading from '%s'", item.source)
-            # download and save the file
-            import_failure = False
-            local_file_size = 0
-            block_size = 10 * 1024 * 1024  # bytes
-            try:
-                for buf in response.iter_content(block_size):
-                    local_file_size += len(buf)
-
-                    try:
-                        tmpfile.write(buf)
-                    except IOError as exc:
-                        # e.g., [Errno 28] No space left on device
-                        logger.error("Error downloading from '%s': %s",
-                                     item.source, exc)
-                        import_failure = True
-                        break
-
-                    # check if we have a sane value for file size
-                    if remote_file_size > 0:
-                        percent_done = \
-                            local_file_size * 100. / remote_file_size
-                    else:
-                        percent_done = 0
-
-                    import_file.update_state(
-                        state="PROGRESS",
-                        meta={
-                            "percent_done": "{:.0f}".format(percent_done),
-                            "current": local_file_size,
-                            "total": remote_file_size
-                        }
-                    )
-            except ContentDecodingError as e:
-                logger.error("Error while decoding response content:%s" % e)
-                import_failure = True
-
-            if import_failure:
-                # delete temp. file if download failed
-                logger.error(
-                    "File import task has failed. Deleting temporary file..."
-                )
-                tmpfile.delete = True
-                import_file.update_state(state=celery.states.FAILURE,
-                                         meta='Failed to import file from URL')
-                # http://stackoverflow.com/a/33143545
-                raise celery.exceptions.Ignore()
+        logger.debug("Downloading from '%s'", item.source)
+        import_failure = False
+        try:
+            item.md5 = download.run()
+        except ContentDecodingError as e:
+            logger.error("Error while decoding response content:%s" % e)
+            import_failure = True
+            # downloaded data can not be trusted
+            download.discard()
+        except (IOError, TransferError) as exc:
+            # e.g., [Errno 28] No space left on device or a dropped connection
+            # partial file is kept to resume the download on the next attempt
+            logger.error("Error downloading from '%s': %s", item.source, exc)
+            import_failure = True
+
+        if import_failure:
+            logger.error("File import task has failed")
+            import_file.update_state(state=celery.states.FAILURE,
+                                     meta='Failed to import file from URL')
+            # http://stackoverflow.com/a/33143545
+            raise celery.exceptions.Ignore()
 
-        logger.debug("Finished downloading from '%s'", item.source)
+        progress.finish(item.source)
 
         # get the file name from URL (remove query string)
         source_path = urlparse.urlparse(item.source).path
@@ -238,14 +299,15 @@ def import_file(uuid, refresh=False, file_size=0):
         try:
             if not os.path.exists(os.path.dirname(abs_dst_path)):
                 os.makedirs(os.path.dirname(abs_dst_path))
-            os.rename(tmpfile.name, abs_dst_path)
+            os.rename(download.path, abs_dst_path)
         except OSError as exc:
             logger.error("Error moving temp file '%s' into the file store: %s",
-                         tmpfile.name, exc)
+                         download.path, exc)
             import_file.update_state(state=celery.states.FAILURE,
                                      meta='Failed to import file from URL')
             # http://stackoverflow.com/a/33143545
             raise celery.exceptions.Ignore()
+        download.discard()  # remove what is left of the partial file
         # temp file is only accessible by the owner by default which prevents
         # access by the web server if it is running as it's own user
         try:
@@ -264,6 +326,13 @@ def import_file(uuid, refresh=False, file_size=0):
     return item.uuid
 
 
+def _get_partial_path(item):
+    """Return the path of the temp file that keeps the data downloaded for a
+    FileStoreItem between import attempts
+    """
+    return os.path.join(get_temp_dir(), '{}.part'.format(item.uuid))
+
+
 @task_postrun.connect(sender=import_file)
 def update_solr_index(**kwargs):
     """Updates Solr with file import state"""
@@ -274,6 +343,11 @@ def update_solr_index(**kwargs):
         file_store_item_uuid = kwargs['args'][0]
     logger.debug("File import state for FileStoreItem UUID '%s': '%s'",
                  file_store_item_uuid, kwargs['state'])
+    # make the final state available to readers of the progress store
+    if kwargs['state'] in celery.states.READY_STATES:
+        set_import_progress(kwargs['task_id'], kwargs['state'])
+    else:  # e.g., IGNORED after the task has set its own state
+        clear_import_progress(kwargs['task_id'])
     try:
         node = Node.objects.get(file_uuid=file_store_item_uuid)
     except (Node.DoesNotExist, Node.MultipleObjectsReturned) as exc:
@@ -336,29 +410,47 @@ def download_file(url, target_path, file_size=1):
         raise RuntimeError(exc)
     else:
         # download and save the file
+        progress = TransferProgress(download_file)
         localfilesize = 0
         blocksize = 8 * 2 ** 10    # 8 Kbytes
         for buf in iter(lambda: response.raw.read(blocksize), ''):
             localfilesize += len(buf)
             destination.write(buf)
-            # check if we have a sane value for file size
-            if remotefilesize > 0:
-                percent_done = localfilesize * 100. / remotefilesize
-            else:
-                percent_done = 0
-                # TODO Remove this entirely, no associated import_file task?
-                import_file.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "percent_done": "%3.2f%%" % percent_done,
-                        "current": localfilesize,
-                        "total": remotefilesize
-                    }
-                )
+            progress(localfilesize, remotefilesize)
         # cleanup
         # TODO: delete temp file if download failed
         destination.flush()
         destination.close()
 
     response.close()
-    logger.debug("Finished downloading")
+    progress.finish(url)
+
+
+@task()
+def delete_files(file_names):
+    """Remove data files of deleted FileStoreItems from the file store
+    Progress is reported to the result backend every
+    REFINERY_FILE_IMPORT_PROGRESS_STEP percent of files removed
+
+    :param file_names: data file names relative to the file store
+    :type file_names: list
+    """
+    total = len(file_names)
+    published_percent = None
+    for current, file_name in enumerate(file_names, 1):
+        try:
+            default_storage.delete(file_name)
+        except OSError as exc:
+            logger.error("Error deleting file '%s': %s", file_name, exc)
+        percent_done = current * 100. / total
+        if (published_percent is None or current == total or
+                percent_done - published_percent >=
+                settings.REFINERY_FILE_IMPORT_PROGRESS_STEP):
+            if delete_files.request.id:
+                delete_files.update_state(
+                    state="PROGRESS",
+                    meta={"percent_done": "{:.0f}".format(percent_done),
+                          "current": current, "total": total}
+                )
+            published_percent = percent_done
+    logger.info("Deleted %s data files", total)
@@ -1,19 +1,25 @@
+import hashlib
 import os
+import tempfile
 from urlparse import urljoin
 import uuid
 
 from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.files.base import ContentFile
 from django.db.models.fields.files import FieldFile
 from django.test import TestCase, override_settings
 
+from djcelery.backends.database import DatabaseBackend
+from djcelery.models import TaskMeta
 import mock
 from override_storage import override_storage
 
 from .models import (FileExtension, FileStoreItem, FileType,
                      _get_extension_from_string, _map_source,
-                     generate_file_source_translator, get_temp_dir,
-                     parse_s3_url)
+                     generate_file_source_translator, get_import_progress,
+                     get_import_statuses, get_temp_dir, parse_s3_url,
+                     set_import_progress)
 
 
 class FileStoreModuleTest(TestCase):
@@ -157,6 +163,93 @@ class FileStoreItemTest(TestCase):
         item = FileStoreItem.objects.create(source=self.path_source)
         self.assertEqual(item.source, self.path_source)
 
+    def test_get_md5(self):
+        item = FileStoreItem.objects.create(source=self.url_source)
+        with tempfile.NamedTemporaryFile() as datafile:
+            datafile.write('test data')
+            datafile.flush()
+            with mock.patch.object(FileStoreItem, 'is_local',
+                                   return_value=True), \
+                    mock.patch.object(FileStoreItem, 'get_absolute_path',
+                                      return_value=datafile.name):
+                md5 = item.get_md5()
+        self.assertEqual(md5, hashlib.md5('test data').hexdigest())
+        self.assertEqual(FileStoreItem.objects.get(pk=item.pk).md5, md5)
+
+    def test_get_stored_md5(self):
+        item = FileStoreItem.objects.create(source=self.url_source,
+                                            md5='a' * 32)
+        with mock.patch.object(FileStoreItem, 'is_local',
+                               return_value=True), \
+                mock.patch.object(FileStoreItem,
+                                  'get_absolute_path') as mock_get_path:
+            self.assertEqual(item.get_md5(), 'a' * 32)
+            mock_get_path.assert_not_called()
+
+    def test_get_md5_with_no_datafile(self):
+        item = FileStoreItem.objects.create(source=self.url_source)
+        self.assertEqual(item.get_md5(), '')
+
+    @mock.patch('file_store.models.cache', LocMemCache('file-store', {}))
+    def test_get_import_status_from_progress_store(self):
+        item = FileStoreItem(source=self.url_source,
+                             import_task_id=str(uuid.uuid4()))
+        set_import_progress(item.import_task_id, 'PROGRESS')
+        with mock.patch('celery.result.AsyncResult') as mock_result:
+            self.assertEqual(item.get_import_status(), 'PROGRESS')
+            mock_result.assert_not_called()
+
+    @mock.patch('file_store.models.cache', LocMemCache('file-store', {}))
+    def test_get_import_status_from_result_backend(self):
+        item = FileStoreItem(source=self.url_source,
+                             import_task_id=str(uuid.uuid4()))
+        with mock.patch('celery.result.AsyncResult') as mock_result:
+            mock_result.return_value.state = 'STARTED'
+            self.assertEqual(item.get_import_status(), 'STARTED')
+
+
+@mock.patch('file_store.models.cache', LocMemCache('file-store', {}))
+class ImportStatusesTest(TestCase):
+
+    def setUp(self):
+        self.task_ids = [str(uuid.uuid4()) for _ in range(3)]
+        backend_patcher = mock.patch('file_store.models.celery.current_app')
+        self.mock_app = backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+        self.mock_app.backend = mock.Mock(spec=DatabaseBackend)
+
+    def test_get_import_statuses_from_progress_store(self):
+        for task_id in self.task_ids:
+            set_import_progress(task_id, 'PROGRESS')
+        with self.assertNumQueries(0):
+            statuses = get_import_statuses(self.task_ids)
+        self.assertEqual(statuses, dict.fromkeys(self.task_ids, 'PROGRESS'))
+
+    def test_get_import_statuses_from_result_backend(self):
+        TaskMeta.objects.create(task_id=self.task_ids[0], status='SUCCESS')
+        TaskMeta.objects.create(task_id=self.task_ids[1], status='STARTED')
+        with self.assertNumQueries(1):
+            statuses = get_import_statuses(self.task_ids)
+        self.assertEqual(statuses, {self.task_ids[0]: 'SUCCESS',
+                                    self.task_ids[1]: 'STARTED',
+                                    self.task_ids[2]: 'PENDING'})
+
+    def test_get_import_statuses_caches_completed_states(self):
+        TaskMeta.objects.create(task_id=self.task_ids[0], status='SUCCESS')
+        TaskMeta.objects.create(task_id=self.task_ids[1], status='STARTED')
+        get_import_statuses(self.task_ids)
+        self.assertEqual(get_import_progress(self.task_ids[0]),
+                         {'state': 'SUCCESS'})
+        self.assertIsNone(get_import_progress(self.task_ids[1]))
+        self.assertIsNone(get_import_progress(self.task_ids[2]))
+
+    def test_get_import_statuses_with_other_result_backend(self):
+        self.mock_app.backend = mock.Mock()
+        with mock.patch('celery.result.AsyncResult') as mock_result:
+            mock_result.return_value.state = 'STARTED'
+            statuses = get_import_statuses(self.task_ids)
+        self.assertEqual(statuses, dict.fromkeys(self.task_ids, 'STARTED'))
+
 
 @override_storage()
 class FileStoreItemLocalFileTest(TestCase):
@@ -202,6 +295,12 @@ class FileStoreItemLocalFileTest(TestCase):
         saved_item = FileStoreItem.objects.get(pk=self.item.pk)
         self.assertEqual(saved_item.get_file_extension(), self.file_extension)
 
+    def test_delete_local_file_clears_md5(self):
+        self.item.md5 = 'a' * 32
+        self.item.datafile.save(self.file_name, ContentFile(''))
+        self.item.delete_datafile()
+        self.assertEqual(FileStoreItem.objects.get(pk=self.item.pk).md5, '')
+
     def test_delete_local_file_on_instance_delete(self):
         self.item.datafile.save(self.file_name, ContentFile(''))
         with mock.patch.object(FieldFile, 'path'):
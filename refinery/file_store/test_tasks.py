@@ -0,0 +1,95 @@
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, override_settings
+
+import mock
+
+from .models import get_import_progress
+from .tasks import TransferProgress, delete_files
+
+
+@override_settings(REFINERY_FILE_IMPORT_PROGRESS_INTERVAL=5,
+                   REFINERY_FILE_IMPORT_PROGRESS_STEP=10)
+class TransferProgressTest(SimpleTestCase):
+
+    def setUp(self):
+        self.task = mock.Mock()
+        self.task.request.id = 'test-task-id'
+        cache_patcher = mock.patch('file_store.models.cache',
+                                   LocMemCache('file-store-progress', {}))
+        self.cache = cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        time_patcher = mock.patch('file_store.tasks.time.time',
+                                  return_value=1000.)
+        self.mock_time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.progress = TransferProgress(self.task)
+
+    def test_backend_updates_are_limited_by_step(self):
+        for current in range(0, 1001):
+            self.progress(current, 1000)
+        # first call and every 10 percent
+        self.assertEqual(self.task.update_state.call_count, 11)
+
+    def test_progress_store_updates_are_limited_by_interval(self):
+        with mock.patch('file_store.tasks.set_import_progress') as mock_set:
+            for second in range(0, 20):
+                self.mock_time.return_value = 1000. + second
+                self.progress(0, 0)
+        # file size is unknown so updates are driven only by time
+        self.assertEqual(mock_set.call_count, 4)
+        self.assertEqual(self.task.update_state.call_count, 1)
+
+    def test_progress_store(self):
+        self.progress(0, 1000)
+        self.mock_time.return_value = 1010.
+        self.progress(500, 1000)
+        progress = get_import_progress('test-task-id')
+        self.assertEqual(progress['state'], 'PROGRESS')
+        self.assertEqual(progress['percent_done'], '50')
+        self.assertEqual(progress['current'], 500)
+
+    def test_throughput_excludes_previous_attempts(self):
+        self.progress(100 * 2 ** 20, 500 * 2 ** 20)
+        self.mock_time.return_value = 1010.
+        self.progress(300 * 2 ** 20, 500 * 2 ** 20)
+        self.assertEqual(self.progress.get_throughput(), 20.)
+        self.assertEqual(get_import_progress('test-task-id')['throughput'],
+                         20.)
+
+    def test_no_updates_if_not_called_as_task(self):
+        self.task.request.id = None
+        progress = TransferProgress(self.task)
+        progress(500, 1000)
+        self.task.update_state.assert_not_called()
+
+
+@override_settings(REFINERY_FILE_IMPORT_PROGRESS_STEP=10)
+class DeleteFilesTest(SimpleTestCase):
+
+    def setUp(self):
+        storage_patcher = mock.patch('file_store.tasks.default_storage')
+        self.storage = storage_patcher.start()
+        self.addCleanup(storage_patcher.stop)
+        self.file_names = ['file{}.txt'.format(index)
+                           for index in range(100)]
+
+    def test_all_files_are_deleted(self):
+        delete_files(self.file_names)
+        self.assertEqual(
+            [call[0][0] for call in self.storage.delete.call_args_list],
+            self.file_names
+        )
+
+    def test_errors_do_not_stop_deletion(self):
+        self.storage.delete.side_effect = OSError
+        delete_files(self.file_names)
+        self.assertEqual(self.storage.delete.call_count, 100)
+
+    def test_progress_updates_are_limited_by_step(self):
+        delete_files.push_request(id='test-task-id')
+        self.addCleanup(delete_files.pop_request)
+        with mock.patch.object(delete_files, 'update_state') as mock_update:
+            delete_files(self.file_names)
+        # first file and every 10 percent
+        self.assertEqual(mock_update.call_count, 11)
+        self.assertEqual(mock_update.call_args[1]['meta']['current'], 100)
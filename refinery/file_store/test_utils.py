@@ -1,4 +1,7 @@
+import hashlib
 import os
+import shutil
+import tempfile
 from urlparse import urljoin
 
 from django.conf import settings
@@ -6,7 +9,9 @@ from django.test import SimpleTestCase
 
 import mock
 
-from .utils import S3MediaStorage, SymlinkedFileSystemStorage
+from .utils import (HTTPDownload, RangedDownload, S3Download,
+                    S3MediaStorage, SymlinkedFileSystemStorage, TransferError,
+                    _split_range)
 
 
 class S3MediaStorageTest(SimpleTestCase):
@@ -67,3 +72,273 @@ class SymlinkedFileSystemStorageTest(SimpleTestCase):
         name = ''.join('a' for _ in range(256))
         self.storage.get_available_name(name)
         mock_get_available_name.assert_called_with('80/4c/' + name[-255:])
+
+
+class FakeRangedDownload(RangedDownload):
+    """Serves ranges of an in-memory file"""
+    def __init__(self, data, path, accepts_ranges=True, **kwargs):
+        super(FakeRangedDownload, self).__init__(path, **kwargs)
+        self.data = data
+        self.accepts_ranges = accepts_ranges
+        self.requested_ranges = []
+
+    def open_range(self, start, end=None):
+        self.requested_ranges.append((start, end))
+        if not self.accepts_ranges:
+            start, end = 0, None
+        end = len(self.data) - 1 if end is None else end
+        chunks = (self.data[offset:min(offset + self.chunk_size, end + 1)]
+                  for offset in range(start, end + 1, self.chunk_size))
+        return start, len(self.data), chunks
+
+
+class RangedDownloadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'test.part')
+        self.data = ''.join(chr(i % 256) for i in range(1000))
+        self.md5 = hashlib.md5(self.data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _read_partial_file(self):
+        with open(self.path, 'rb') as partial:
+            return partial.read()
+
+    def test_download(self):
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(self._read_partial_file(), self.data)
+
+    def test_resume_from_partial_file(self):
+        with open(self.path, 'wb') as partial:
+            partial.write(self.data[:300])
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(download.requested_ranges, [(300, None)])
+        self.assertEqual(self._read_partial_file(), self.data)
+
+    def test_restart_if_range_is_ignored(self):
+        with open(self.path, 'wb') as partial:
+            partial.write('x' * 300)
+        download = FakeRangedDownload(self.data, self.path,
+                                      accepts_ranges=False, chunk_size=64)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(self._read_partial_file(), self.data)
+
+    def test_progress(self):
+        progress = mock.Mock()
+        FakeRangedDownload(self.data, self.path, chunk_size=500,
+                           progress=progress).run()
+        self.assertEqual(progress.mock_calls, [mock.call(0, 1000),
+                                               mock.call(500, 1000),
+                                               mock.call(1000, 1000)])
+
+    def test_truncated_download(self):
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64)
+        chunks = (chunk for chunk in [self.data[:500]])
+        with mock.patch.object(download, 'open_range',
+                               return_value=(0, 1000, chunks)):
+            self.assertRaises(TransferError, download.run)
+
+    def test_parallel_download(self):
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64,
+                                      parallel=4)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(
+            sorted(download.requested_ranges[1:]),
+            [(0, 249), (250, 499), (500, 749), (750, 999)]
+        )
+        self.assertEqual(self._read_partial_file(), self.data)
+        self.assertEqual(os.listdir(self.temp_dir), ['test.part'])
+
+    def test_resume_parallel_download(self):
+        with open(self.path + '.250-499', 'wb') as segment:
+            segment.write(self.data[250:400])
+        with open(self.path + '.500-749', 'wb') as segment:
+            segment.write(self.data[500:750])
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64,
+                                      parallel=4)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(sorted(download.requested_ranges[1:]),
+                         [(0, 249), (400, 499), (750, 999)])
+
+    def test_sequential_download_if_ranges_are_not_supported(self):
+        download = FakeRangedDownload(self.data, self.path, chunk_size=64,
+                                      parallel=4, accepts_ranges=False)
+        self.assertEqual(download.run(), self.md5)
+        self.assertEqual(download.requested_ranges, [(0, None)])
+
+    def test_discard(self):
+        for path in [self.path, self.path + '.0-499']:
+            open(path, 'wb').close()
+        FakeRangedDownload(self.data, self.path).discard()
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_split_range(self):
+        self.assertEqual(_split_range(10, 3), [(0, 2), (3, 5), (6, 9)])
+
+
+class HTTPDownloadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.url = 'http://example.org/test.fastq'
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'test.part')
+        self.download = HTTPDownload(self.url, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_range_request(self, mock_get):
+        mock_get.return_value.status_code = 206
+        mock_get.return_value.headers = {'Content-Length': '700',
+                                         'Content-Range': 'bytes 300-999/1000'}
+        first, total, _ = self.download.open_range(300)
+        mock_get.assert_called_once_with(
+            self.url, stream=True,
+            headers={'Range': 'bytes=300-', 'Accept-Encoding': 'identity'}
+        )
+        self.assertEqual((first, total), (300, 1000))
+        self.assertTrue(self.download.accepts_ranges)
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_resume_if_file_is_unchanged(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Length': '1000',
+                                         'ETag': '"v1"'}
+        self.download.open_range(0)
+        mock_get.return_value.status_code = 206
+        mock_get.return_value.headers = {'Content-Length': '700',
+                                         'Content-Range': 'bytes 300-999/1000',
+                                         'ETag': '"v1"'}
+        first, total, _ = HTTPDownload(self.url, self.path).open_range(300)
+        self.assertEqual(mock_get.call_args[1]['headers']['If-Range'], '"v1"')
+        self.assertEqual((first, total), (300, 1000))
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_restart_if_file_has_changed(self, mock_get):
+        with open(self.download.validator_path, 'w') as validator_file:
+            validator_file.write('Mon, 01 Jan 2018 00:00:00 GMT')
+        # If-Range does not match so the server sends the whole file
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {
+            'Content-Length': '1000',
+            'Last-Modified': 'Tue, 02 Jan 2018 00:00:00 GMT'
+        }
+        first, total, _ = self.download.open_range(300)
+        self.assertEqual(mock_get.call_args[1]['headers']['If-Range'],
+                         'Mon, 01 Jan 2018 00:00:00 GMT')
+        self.assertEqual((first, total), (0, 1000))
+        with open(self.download.validator_path) as validator_file:
+            self.assertEqual(validator_file.read(),
+                             'Tue, 02 Jan 2018 00:00:00 GMT')
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_restart_if_if_range_is_not_supported(self, mock_get):
+        with open(self.download.validator_path, 'w') as validator_file:
+            validator_file.write('"v1"')
+        changed = mock.Mock(status_code=206, headers={
+            'Content-Length': '700', 'Content-Range': 'bytes 300-999/1000',
+            'ETag': '"v2"'
+        })
+        complete = mock.Mock(status_code=200, headers={
+            'Content-Length': '1000', 'ETag': '"v2"'
+        })
+        mock_get.side_effect = [changed, complete]
+        first, total, _ = self.download.open_range(300)
+        self.assertEqual((first, total), (0, 1000))
+        self.assertNotIn('Range', mock_get.call_args[1]['headers'])
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_encoded_content_length_is_not_validated(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Length': '300',
+                                         'Content-Encoding': 'gzip'}
+        self.assertEqual(self.download.open_range(0)[1], 0)
+
+    def test_discard_removes_validator(self):
+        open(self.download.validator_path, 'w').close()
+        self.download.discard()
+        self.assertFalse(os.path.exists(self.download.validator_path))
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_range_ignored(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Length': '1000'}
+        first, total, _ = self.download.open_range(300)
+        self.assertEqual((first, total), (0, 1000))
+        self.assertFalse(self.download.accepts_ranges)
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_unknown_size(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
+        mock_get.return_value.iter_content.return_value = ['x' * 40]
+        progress = mock.Mock()
+        download = HTTPDownload(self.url, self.path, file_size=42,
+                                progress=progress)
+        # size hint is used for progress only
+        self.assertEqual(download.open_range(0)[1], 0)
+        download.run()
+        self.assertEqual(progress.mock_calls, [mock.call(0, 42),
+                                               mock.call(40, 42)])
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_range_not_satisfiable(self, mock_get):
+        not_satisfiable = mock.Mock(status_code=416, headers={})
+        complete = mock.Mock(status_code=200, headers={
+            'Content-Length': '1000', 'Accept-Ranges': 'bytes'
+        })
+        mock_get.side_effect = [not_satisfiable, complete]
+        first, total, _ = self.download.open_range(1000)
+        self.assertEqual((first, total), (0, 1000))
+        self.assertEqual(mock_get.call_args[1]['headers'],
+                         {'Accept-Encoding': 'identity'})
+        self.assertTrue(self.download.accepts_ranges)
+
+    @mock.patch('file_store.utils.requests.get')
+    def test_empty_file(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Length': '0'}
+        mock_get.return_value.iter_content.return_value = []
+        self.assertEqual(self.download.run(), hashlib.md5().hexdigest())
+        self.assertNotIn('Range', mock_get.call_args[1]['headers'])
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+
+class S3DownloadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'test.part')
+        with mock.patch('file_store.utils.boto3.client'):
+            self.download = S3Download('test-bucket', 'test.fastq',
+                                       self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_range_request(self):
+        self.download.client.get_object.return_value = {
+            'ContentLength': 700, 'ContentRange': 'bytes 300-999/1000',
+            'Body': mock.Mock()
+        }
+        first, total, _ = self.download.open_range(300)
+        self.download.client.get_object.assert_called_once_with(
+            Bucket='test-bucket', Key='test.fastq', Range='bytes=300-'
+        )
+        self.assertEqual((first, total), (300, 1000))
+
+    def test_empty_object(self):
+        self.download.client.get_object.return_value = {
+            'ContentLength': 0, 'Body': mock.Mock(**{'read.return_value': b''})
+        }
+        self.assertEqual(self.download.run(), hashlib.md5().hexdigest())
+        self.download.client.get_object.assert_called_once_with(
+            Bucket='test-bucket', Key='test.fastq'
+        )
+        self.assertEqual(os.path.getsize(self.path), 0)
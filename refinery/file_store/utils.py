@@ -1,4 +1,8 @@
+import glob
+import hashlib
+from multiprocessing.pool import ThreadPool
 import os
+import re
 
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
@@ -6,8 +10,15 @@ from django.utils.crypto import get_random_string
 from django.utils.deconstruct import deconstructible
 from django.utils.text import get_valid_filename
 
+import boto3
+import botocore
+import requests
 from storages.backends.s3boto3 import S3Boto3Storage
 
+TRANSFER_CHUNK_SIZE = 10 * 1024 * 1024  # bytes
+# e.g., "bytes 0-1023/4096" or "bytes 0-1023/*" if the total size is unknown
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
 
 class S3MediaStorage(S3Boto3Storage):
     """Django media (user data) files storage"""
@@ -60,3 +71,346 @@ class SymlinkedFileSystemStorage(FileSystemStorage):
 
     def get_name(self, name):
         return self.get_available_name(get_valid_filename(name))
+
+
+class TransferError(RuntimeError):
+    """Remote file could not be transferred completely"""
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _format_range(start, end=None):
+    """Return the value of a Range header for an inclusive byte range"""
+    return "bytes={}-{}".format(start, "" if end is None else end)
+
+
+def _parse_content_range(content_range, start, length):
+    """Return the first byte and the total size (or 0 if unknown) of a
+    partial response
+    """
+    match = CONTENT_RANGE_PATTERN.match(content_range or '')
+    if match is None:
+        return start, start + length
+    total = match.group(3)
+    return int(match.group(1)), 0 if total == '*' else int(total)
+
+
+def _split_range(size, parts):
+    """Split size bytes into inclusive (start, end) ranges of similar size"""
+    part_size = size // parts
+    ranges = []
+    for index in range(parts):
+        start = index * part_size
+        end = size - 1 if index == parts - 1 else start + part_size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def _get_validator(response):
+    """Return the strong ETag or else the Last-Modified date of a response
+    for use in If-Range requests
+    """
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+class RangedDownload(object):
+    """Resumable download of a remote file into a local partial file
+    Transfer starts from the end of the partial file left by an interrupted
+    attempt (if any) and the MD5 digest of the file is computed while the data
+    is being written. If parallel > 1 and the source supports byte ranges, the
+    file is split into as many segments that are fetched concurrently and
+    hashed as they are joined.
+    Subclasses implement open_range() for a specific type of source.
+    """
+    def __init__(self, path, parallel=1, chunk_size=TRANSFER_CHUNK_SIZE,
+                 progress=None):
+        """
+        :param path: absolute path of the partial file
+        :param parallel: max number of concurrent ranged requests
+        :param progress: optional callable that is passed the number of bytes
+        transferred and the total size of the file (or 0 if unknown)
+        """
+        self.path = path
+        self.parallel = max(1, parallel)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.accepts_ranges = False
+        self._first_range = None
+
+    def open_range(self, start, end=None):
+        """Request bytes start through end (or the end of the file)
+        :returns: tuple of the first byte actually returned (0 if the range
+        was ignored), total size of the file (0 if unknown) and an iterator
+        over the data chunks that releases the connection when exhausted or
+        closed
+        """
+        raise NotImplementedError
+
+    def start(self):
+        """Open the connection to the source
+        Separate from run() so that callers can tell errors accessing the
+        source from errors that occur during the transfer
+        """
+        if self._first_range is None:
+            self._first_range = self.open_range(_get_size(self.path))
+        return self._first_range
+
+    def run(self):
+        """Transfer the file
+        :returns: hex MD5 digest of the file
+        """
+        start, total, chunks = self.start()
+        self._first_range = None
+        if (self.parallel > 1 and start == 0 and self.accepts_ranges and
+                total >= self.parallel * self.chunk_size):
+            chunks.close()
+            return self._run_parallel(total)
+        return self._run_sequential(start, total, chunks)
+
+    def discard(self):
+        """Remove partial files so that the next attempt starts over"""
+        for path in [self.path] + glob.glob(self.path + '.*-*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _report(self, current, total):
+        if self.progress is not None:
+            self.progress(current, total)
+
+    def _hash_file(self, path, hasher, size):
+        """Update hasher with the first size bytes of a file"""
+        with open(path, 'rb') as existing:
+            while size > 0:
+                chunk = existing.read(min(size, self.chunk_size))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size -= len(chunk)
+
+    def _run_sequential(self, start, total, chunks):
+        hasher = hashlib.md5()
+        if start:
+            # data from previous attempts was not hashed in this process
+            self._hash_file(self.path, hasher, start)
+            partial = open(self.path, 'r+b')
+            partial.seek(start)
+            partial.truncate()
+        else:
+            partial = open(self.path, 'wb')
+        current = start
+        self._report(current, total)
+        try:
+            for chunk in chunks:
+                partial.write(chunk)
+                hasher.update(chunk)
+                current += len(chunk)
+                self._report(current, total)
+        finally:
+            chunks.close()
+            partial.close()
+        if total and current != total:
+            raise TransferError(
+                "Received {} of {} bytes".format(current, total)
+            )
+        return hasher.hexdigest()
+
+    def _fetch_segment(self, segment):
+        start, end, path = segment
+        offset = _get_size(path)
+        if offset > end - start + 1:
+            offset = 0
+        elif offset == end - start + 1:
+            return  # fetched by a previous attempt
+        first, _, chunks = self.open_range(start + offset, end)
+        if first != start + offset:
+            chunks.close()
+            raise TransferError(
+                "Range request for bytes {}-{} was not honored".format(
+                    start + offset, end
+                )
+            )
+        with open(path, 'ab' if offset else 'wb') as partial:
+            try:
+                for chunk in chunks:
+                    partial.write(chunk)
+            finally:
+                chunks.close()
+        if _get_size(path) != end - start + 1:
+            raise TransferError(
+                "Received {} of {} bytes of range {}-{}".format(
+                    _get_size(path), end - start + 1, start, end
+                )
+            )
+
+    def _run_parallel(self, total):
+        segments = [(start, end, "{}.{}-{}".format(self.path, start, end))
+                    for start, end in _split_range(total, self.parallel)]
+        # remove segments of attempts made with a different number of parts
+        segment_paths = [path for _, _, path in segments]
+        for path in glob.glob(self.path + '.*-*'):
+            if path not in segment_paths:
+                os.remove(path)
+
+        self._report(sum(_get_size(path) for path in segment_paths), total)
+        pool = ThreadPool(len(segments))
+        try:
+            for _ in pool.imap_unordered(self._fetch_segment, segments):
+                self._report(sum(_get_size(path) for path in segment_paths),
+                             total)
+        except Exception:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        # join segments in order to compute the digest of the whole file
+        hasher = hashlib.md5()
+        with open(self.path, 'wb') as partial:
+            for path in segment_paths:
+                with open(path, 'rb') as segment:
+                    for chunk in iter(
+                            lambda: segment.read(self.chunk_size), b''
+                    ):
+                        hasher.update(chunk)
+                        partial.write(chunk)
+                os.remove(path)
+        return hasher.hexdigest()
+
+
+class HTTPDownload(RangedDownload):
+    """Download a file from a URL using HTTP Range requests
+    The ETag or Last-Modified date of the file is kept next to the partial
+    file so that a download is only resumed if the remote file has not
+    changed since the previous attempt (using If-Range).
+    """
+    def __init__(self, url, path, file_size=0, **kwargs):
+        """file_size: size of the remote file if the server does not report
+        it, only used to report progress
+        """
+        super(HTTPDownload, self).__init__(path, **kwargs)
+        self.url = url
+        self.file_size = file_size
+        self.validator_path = path + '.validator'
+
+    def open_range(self, start, end=None):
+        # length of the response must match the size of the file on disk
+        headers = {'Accept-Encoding': 'identity'}
+        validator = None
+        if start or end is not None:
+            # no range for the whole file: an empty file can not satisfy any
+            headers['Range'] = _format_range(start, end)
+            validator = self._load_validator() if start else None
+            if validator:
+                headers['If-Range'] = validator
+        response = requests.get(self.url, stream=True, headers=headers)
+        if (response.status_code == requests.codes.range_not_satisfiable and
+                start and end is None):
+            # partial file is not shorter than the remote file
+            response.close()
+            return self.open_range(0)
+        response.raise_for_status()
+        if (validator and response.status_code ==
+                requests.codes.partial_content and
+                _get_validator(response) not in (None, validator)):
+            # the server did not evaluate If-Range but the file has changed
+            response.close()
+            return self.open_range(0, end)
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            # Content-Length is the size of the encoded data
+            length = 0
+        else:
+            length = int(response.headers.get('Content-Length', 0))
+        if response.status_code == requests.codes.partial_content:
+            self.accepts_ranges = True
+            first, total = _parse_content_range(
+                response.headers.get('Content-Range'), start, length
+            )
+        else:  # whole file, the range was ignored or the file has changed
+            if response.headers.get('Accept-Ranges') == 'bytes':
+                self.accepts_ranges = True
+            first, total = 0, length
+        if first == 0:
+            self._save_validator(_get_validator(response))
+        return first, total, self._iter_content(response)
+
+    def discard(self):
+        super(HTTPDownload, self).discard()
+        try:
+            os.remove(self.validator_path)
+        except OSError:
+            pass
+
+    def _report(self, current, total):
+        super(HTTPDownload, self)._report(current, total or self.file_size)
+
+    def _load_validator(self):
+        try:
+            with open(self.validator_path) as validator_file:
+                return validator_file.read() or None
+        except IOError:
+            return None
+
+    def _save_validator(self, validator):
+        if validator is None:
+            try:
+                os.remove(self.validator_path)
+            except OSError:
+                pass
+        else:
+            with open(self.validator_path, 'w') as validator_file:
+                validator_file.write(validator)
+
+    def _iter_content(self, response):
+        try:
+            for chunk in response.iter_content(self.chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+
+class S3Download(RangedDownload):
+    """Download an object from S3 using ranged GETs"""
+    def __init__(self, bucket_name, key, path, **kwargs):
+        super(S3Download, self).__init__(path, **kwargs)
+        self.bucket_name = bucket_name
+        self.key = key
+        self.accepts_ranges = True
+        # unlike resources, clients can be shared between threads
+        self.client = boto3.client('s3')
+
+    def open_range(self, start, end=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': self.key}
+        if start or end is not None:
+            # no range for the whole object: an empty one can not satisfy any
+            kwargs['Range'] = _format_range(start, end)
+        try:
+            response = self.client.get_object(**kwargs)
+        except botocore.exceptions.ClientError as exc:
+            if (exc.response.get('Error', {}).get('Code') == 'InvalidRange' and
+                    start and end is None):
+                # partial file is not shorter than the object
+                return self.open_range(0)
+            raise
+        first, total = _parse_content_range(
+            response.get('ContentRange'), start, response['ContentLength']
+        )
+        return first, total, self._iter_body(response['Body'])
+
+    def _iter_body(self, body):
+        try:
+            for chunk in iter(lambda: body.read(self.chunk_size), b''):
+                yield chunk
+        finally:
+            body.close()
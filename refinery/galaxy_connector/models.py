@@ -4,6 +4,8 @@ from django.db import models
 
 from bioblend import galaxy
 
+from .utils import GalaxyConnection, GalaxyRequestPool
+
 logger = logging.getLogger(__name__)
 
 error_msg = "Error deleting Galaxy %s for analysis '%s': %s"
@@ -22,29 +24,36 @@ class Instance(models.Model):
         return self.description + " (" + self.api_key + ")"
 
     def galaxy_connection(self):
-        return galaxy.GalaxyInstance(url=self.base_url, key=self.api_key)
+        return GalaxyConnection(url=self.base_url, key=self.api_key)
 
-    def get_history_file_list(self, history_id):
+    def get_history_file_list(self, history_id, request_pool=None):
         """Returns a list of dictionaries that contain the name, type, state
         and download URL of all _files_ in a history.
+        Dataset details are requested in parallel through request_pool (a new
+        GalaxyRequestPool if not provided).
         """
         files = []
-        connection = self.galaxy_connection()
+        if request_pool is None:
+            request_pool = GalaxyRequestPool(self.galaxy_connection())
         history_content_keys = ["state", "file_size", "visible",
                                 "file_name", "genome_build", "misc_info",
                                 "misc_blurb"]
-        history_contents = connection.histories.show_history(history_id,
-                                                             contents=True)
-
-        for history_content_entry in history_contents:
-            if ("type" not in history_content_entry or
-                    history_content_entry["type"] != "file"):
-                continue
-
-            history_content = connection.histories.show_dataset(
-                history_id, history_content_entry["id"]
-            )
-
+        history_contents = request_pool.connection.histories.show_history(
+            history_id, contents=True
+        )
+        history_content_entries = [
+            history_content_entry for history_content_entry
+            in history_contents
+            if history_content_entry.get("type") == "file"
+        ]
+        history_content_list = request_pool.map(
+            "histories", "show_dataset",
+            [(history_id, history_content_entry["id"])
+             for history_content_entry in history_content_entries]
+        )
+
+        for history_content_entry, history_content in zip(
+                history_content_entries, history_content_list):
             file_info = {
                 "name": history_content_entry["name"],
                 "url": history_content_entry["url"],
@@ -1,13 +1,20 @@
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
 import uuid
 
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from bioblend import galaxy
 import mock
 
 from factory_boy.django_model_factories import GalaxyInstanceFactory
 from galaxy_connector.models import Instance
+from galaxy_connector.utils import GalaxyRequestPool
 
 
 class GalaxyInstanceTests(TestCase):
@@ -104,6 +111,117 @@ class GalaxyInstanceTests(TestCase):
         self.assertEqual(len(history_file_list), 0)
 
 
+class FakeGalaxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves history contents and dataset details like the Galaxy API,
+    taking server.delay seconds to answer each request
+    """
+    protocol_version = "HTTP/1.1"  # keep connections alive
+
+    def do_GET(self):
+        self.server.clients.append(self.client_address)
+        time.sleep(self.server.delay)
+        # /api/histories/<history_id>/contents[/<dataset_id>]
+        path = urlparse.urlparse(self.path).path.rstrip("/").split("/")
+        if path[-1] == "contents":
+            response = [
+                {"id": "dataset{}".format(index), "type": "file",
+                 "name": "File {}".format(index),
+                 "url": "/api/histories/{}/contents/dataset{}".format(
+                     path[-2], index)}
+                for index in range(self.server.dataset_count)
+            ]
+        else:
+            response = {"id": path[-1], "file_ext": "txt", "state": "ok"}
+        content = json.dumps(response)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGalaxyServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    dataset_count = 40
+    delay = 0.05
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           FakeGalaxyRequestHandler)
+        self.clients = []  # client address of each request
+
+
+@override_settings(REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS=8)
+class GalaxyRequestPoolTests(TestCase):
+    def setUp(self):
+        self.server = FakeGalaxyServer()
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.galaxy_instance = GalaxyInstanceFactory(
+            base_url="http://127.0.0.1:{}/".format(
+                self.server.server_address[1]
+            ),
+            api_key=str(uuid.uuid4())
+        )
+        self.history_id = str(uuid.uuid4())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _time_history_file_list(self, max_requests):
+        request_pool = GalaxyRequestPool(
+            self.galaxy_instance.galaxy_connection(), max_requests
+        )
+        start = time.time()
+        history_file_list = self.galaxy_instance.get_history_file_list(
+            self.history_id, request_pool=request_pool
+        )
+        elapsed = time.time() - start
+        self.assertEqual(
+            [history_file["dataset_id"] for history_file in history_file_list],
+            ["dataset{}".format(index)
+             for index in range(self.server.dataset_count)]
+        )
+        return elapsed
+
+    def test_get_history_file_list_requests_datasets_in_parallel(self):
+        serial_time = self._time_history_file_list(max_requests=1)
+        parallel_time = self._time_history_file_list(max_requests=8)
+        self.assertGreaterEqual(
+            serial_time, self.server.dataset_count * self.server.delay
+        )
+        self.assertLess(parallel_time, serial_time / 3)
+
+    def test_get_history_file_list_reuses_connections(self):
+        self.galaxy_instance.get_history_file_list(self.history_id)
+        self.assertEqual(len(self.server.clients),
+                         self.server.dataset_count + 1)
+        self.assertLessEqual(len(set(self.server.clients)), 8)
+
+    def test_request_pool_caches_responses(self):
+        request_pool = GalaxyRequestPool(
+            self.galaxy_instance.galaxy_connection()
+        )
+        args_list = [(self.history_id, "dataset{}".format(index))
+                     for index in range(5)]
+        responses = request_pool.map("histories", "show_dataset", args_list)
+        self.assertEqual(
+            request_pool.map("histories", "show_dataset", args_list[::-1]),
+            responses[::-1]
+        )
+        self.assertEqual(
+            request_pool.get("histories", "show_dataset", *args_list[0]),
+            responses[0]
+        )
+        self.assertEqual(len(self.server.clients), 5)
+
+
 class TestManagementCommands(TestCase):
     def test_create_galaxy_instance(self):
         fake_api_key = str(uuid.uuid4())
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+from django.conf import settings
+
+from bioblend import galaxy
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# HTTP sessions keyed by Galaxy base URL, shared by all connections so that
+# TCP (and TLS) connections to a Galaxy instance are kept alive and reused
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_galaxy_session(base_url):
+    """Return the keep-alive HTTP session for a Galaxy instance"""
+    with _sessions_lock:
+        if base_url not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_maxsize=settings.REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[base_url] = session
+        return _sessions[base_url]
+
+
+class GalaxyConnection(galaxy.GalaxyInstance):
+    """GalaxyInstance that sends GET requests over persistent connections
+    instead of opening a new connection for every API call
+    """
+    def make_get_request(self, url, **kwargs):
+        # same as bioblend's implementation apart from the session
+        params = kwargs.get("params")
+        if params is not None and params.get("key", False) is False:
+            params["key"] = self.key
+        else:
+            params = self.default_params
+        kwargs["params"] = params
+        kwargs.setdefault("verify", self.verify)
+        return get_galaxy_session(self.base_url).get(url, **kwargs)
+
+
+class GalaxyRequestPool(object):
+    """Run read-only bioblend calls against a Galaxy instance on a bounded
+    number of threads and cache the responses, so that metadata needed
+    several times while handling an analysis is only requested once
+    """
+    def __init__(self, connection, max_requests=None):
+        """
+        :param connection: GalaxyInstance to send the requests with
+        :param max_requests: maximum number of requests in flight, defaults
+        to REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS
+        """
+        if max_requests is None:
+            max_requests = settings.REFINERY_GALAXY_MAX_CONCURRENT_REQUESTS
+        self.connection = connection
+        self.max_requests = max(1, max_requests)
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def _request(self, key):
+        client_name, method_name, args = key
+        client = getattr(self.connection, client_name)
+        return getattr(client, method_name)(*args)
+
+    def get(self, client_name, method_name, *args):
+        """Call a bioblend client method, e.g.
+        get("jobs", "show_job", job_id) for connection.jobs.show_job(job_id)
+        """
+        return self.map(client_name, method_name, [args])[0]
+
+    def map(self, client_name, method_name, args_list):
+        """Call a bioblend client method once for each tuple of positional
+        arguments in args_list, sending the requests that are not cached yet
+        in parallel
+        :returns: list of responses in the order of args_list
+        """
+        keys = [(client_name, method_name, tuple(args)) for args in args_list]
+        with self._lock:
+            missing_keys = [key for key in OrderedDict.fromkeys(keys)
+                            if key not in self._responses]
+        if len(missing_keys) > 1 and self.max_requests > 1:
+            logger.debug("Requesting %s %s.%s() responses from Galaxy",
+                         len(missing_keys), client_name, method_name)
+            pool = ThreadPool(min(self.max_requests, len(missing_keys)))
+            try:
+                responses = pool.map(self._request, missing_keys)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            responses = [self._request(key) for key in missing_keys]
+        with self._lock:
+            self._responses.update(zip(missing_keys, responses))
+            return [self._responses[key] for key in keys]
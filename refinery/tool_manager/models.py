@@ -1,4 +1,3 @@
-import ast
 import json
 import logging
 import re
@@ -9,6 +8,7 @@ from django.conf import settings
 from django.db import models
 from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils.functional import cached_property
 
 import bioblend
 from bioblend.galaxy.dataset_collections import (CollectionDescription,
@@ -34,15 +34,85 @@ from core.models import (INPUT_CONNECTION, OUTPUT_CONNECTION, Analysis,
 
 from core.utils import get_absolute_url
 from data_set_manager.models import Node
-from data_set_manager.utils import (
-    get_file_url_from_node_uuid, get_solr_response_json
-)
+from data_set_manager.utils import (get_node_files, get_solr_node_pages,
+                                    get_solr_terms_query)
 from file_store.models import FileType
+from galaxy_connector.utils import GalaxyRequestPool
 
 from .tasks import start_container
 
 logger = logging.getLogger(__name__)
 
+_json_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+
+def _encode_strings(value):
+    """Encode unicode as UTF-8 str like ast.literal_eval() does"""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, dict):
+        return {_encode_strings(key): _encode_strings(item)
+                for key, item in value.iteritems()}
+    if isinstance(value, list):
+        return [_encode_strings(item) for item in value]
+    return value
+
+
+def _parse_file_relationships_value(text, index):
+    char = text[index:index + 1]
+    if char in ("[", "("):
+        closing = "]" if char == "[" else ")"
+        items = []
+        trailing_comma = False
+        index = _whitespace.match(text, index + 1).end()
+        while text[index:index + 1] != closing:
+            item, index = _parse_file_relationships_value(text, index)
+            items.append(item)
+            index = _whitespace.match(text, index).end()
+            trailing_comma = text[index:index + 1] == ","
+            if trailing_comma:
+                index = _whitespace.match(text, index + 1).end()
+            elif text[index:index + 1] != closing:
+                raise ValueError("Expected ',' or '{}' at position {}".format(
+                    closing, index
+                ))
+        index += 1
+        if char == "[":
+            return items, index
+        # like in Python, parentheses without a comma are not a tuple
+        if len(items) == 1 and not trailing_comma:
+            return items[0], index
+        return tuple(items), index
+    if char in ("{", '"'):
+        value, index = _json_decoder.raw_decode(text, index)
+        return _encode_strings(value), index
+    if char == "'":
+        end = text.find("'", index + 1)
+        if end == -1:
+            raise ValueError(
+                "Unterminated string at position {}".format(index)
+            )
+        return _encode_strings(text[index + 1:end]), end + 1
+    raise ValueError("Unexpected '{}' at position {}".format(char, index))
+
+
+def parse_file_relationships(file_relationships):
+    """Parse a file relationships string with quoted URLs or JSON objects,
+    e.g. "[('<url>', '<url>')]", into nested lists (LIST) and tuples (PAIR)
+    Accepts the subset of Python literal syntax that ast.literal_eval() was
+    used for, in a single pass over the string
+    :raises: ValueError if the string is malformed
+    """
+    index = _whitespace.match(file_relationships).end()
+    value, index = _parse_file_relationships_value(file_relationships, index)
+    index = _whitespace.match(file_relationships, index).end()
+    if index != len(file_relationships):
+        raise ValueError(
+            "Unexpected data at position {}".format(index)
+        )
+    return value
+
 
 class Parameter(models.Model):
     """
@@ -349,14 +419,17 @@ class Tool(OwnableResource):
         return self.get_tool_launch_config()[self.FILE_RELATIONSHIPS]
 
     def get_file_relationships_urls(self):
-        return ast.literal_eval(
-            self.get_tool_launch_config()[self.FILE_RELATIONSHIPS_URLS]
+        return self._get_parsed_launch_config_value(
+            self.get_tool_launch_config()[self.FILE_RELATIONSHIPS_URLS],
+            parse_file_relationships
         )
 
     def get_input_node_uuids(self):
-        node_uuids = re.findall(constants.UUID_RE,
-                                self.get_file_relationships())
-        return node_uuids
+        return self._get_parsed_launch_config_value(
+            self.get_file_relationships(),
+            lambda file_relationships: re.findall(constants.UUID_RE,
+                                                  file_relationships)
+        )
 
     def _get_input_nodes(self):
         """
@@ -366,15 +439,51 @@ class Tool(OwnableResource):
         NOTE: There is no exception handling here since this method is
         within the scope of an atomic transaction.
         """
-        return [
-            Node.objects.get(uuid=uuid) for uuid in self.get_input_node_uuids()
-        ]
+        node_uuids = self.get_input_node_uuids()
+        nodes = {node.uuid: node
+                 for node in Node.objects.filter(uuid__in=node_uuids)}
+        try:
+            return [nodes[node_uuid] for node_uuid in node_uuids]
+        except KeyError as e:
+            raise Node.DoesNotExist(
+                "Couldn't fetch Node by UUID from: {}".format(e.args[0])
+            )
 
     def _get_launch_parameters(self):
         return self.get_tool_launch_config()[ToolDefinition.PARAMETERS]
 
     def get_tool_launch_config(self):
-        return json.loads(self.tool_launch_configuration)
+        """Return the parsed tool launch configuration
+        It is parsed once and cached until the configuration is replaced, so
+        changes to the returned dict must be saved with
+        set_tool_launch_config()
+        """
+        return self._get_launch_config_cache()["config"]
+
+    def _get_launch_config_cache(self):
+        cache = self.__dict__.get("_launch_config_cache")
+        # identity check also catches direct assignments and refreshes of
+        # the tool_launch_configuration field
+        if (cache is None or
+                cache["source"] is not self.tool_launch_configuration):
+            cache = {
+                "source": self.tool_launch_configuration,
+                "config": json.loads(self.tool_launch_configuration),
+                "parsed": {}
+            }
+            self._launch_config_cache = cache
+        return cache
+
+    def _get_parsed_launch_config_value(self, value, parse):
+        """Return parse(value), cached along with the launch configuration
+        :param value: string from the tool launch configuration, e.g. the
+        file relationships
+        """
+        parsed = self._get_launch_config_cache()["parsed"]
+        key = (id(value), parse.__name__)
+        if key not in parsed or parsed[key][0] is not value:
+            parsed[key] = (value, parse(value))
+        return parsed[key][1]
 
     def get_tool_name(self):
         return self.tool_definition.name
@@ -403,6 +512,7 @@ class Tool(OwnableResource):
 
     def set_tool_launch_config(self, tool_launch_config):
         self.tool_launch_configuration = json.dumps(tool_launch_config)
+        self._launch_config_cache = None
         self.save()
 
     def update_file_relationships_with_urls(self):
@@ -416,29 +526,20 @@ class Tool(OwnableResource):
 
         tool_launch_config = self.get_tool_launch_config()
         node_uuids = self.get_input_node_uuids()
+        node_files = get_node_files(node_uuids, require_valid_urls=True)
 
         # Add list of FileStoreItem UUIDs to our ToolLaunchConfig for later use
-        tool_launch_config[self.FILE_UUID_LIST] = []
+        tool_launch_config[self.FILE_UUID_LIST] = [
+            node_files[node_uuid]["node"].file_uuid for node_uuid in node_uuids
+        ]
 
         # Copy `file_relationships` contents into `file_relationships_urls`
-        tool_launch_config[self.FILE_RELATIONSHIPS_URLS] = (
+        # replacing all Node UUIDs in one pass
+        tool_launch_config[self.FILE_RELATIONSHIPS_URLS] = re.sub(
+            constants.UUID_RE,
+            lambda match: "'{}'".format(node_files[match.group(0)]["url"]),
             self.get_file_relationships()
         )
-        for node_uuid in node_uuids:
-            node = Node.objects.get(uuid=node_uuid)
-
-            # Append file_uuid to list of FileStoreItem UUIDs
-            tool_launch_config[self.FILE_UUID_LIST].append(node.file_uuid)
-
-            file_url = get_file_url_from_node_uuid(
-                node_uuid,
-                require_valid_url=True
-            )
-            tool_launch_config[self.FILE_RELATIONSHIPS_URLS] = (
-                tool_launch_config[self.FILE_RELATIONSHIPS_URLS].replace(
-                    node_uuid, "'{}'".format(file_url)
-                )
-            )
         self.set_tool_launch_config(tool_launch_config)
 
     def is_running(self):
@@ -495,6 +596,55 @@ class VisualizationTool(Tool):
         Create a dictionary containing information that Dockerized
         Visualizations will have access to
         """
+        container_input_dict = self._get_container_input_base_dict()
+        container_input_dict[self.ALL_NODE_INFORMATION] = {}
+        for detailed_nodes in self._get_all_detailed_node_pages():
+            container_input_dict[self.ALL_NODE_INFORMATION].update(
+                detailed_nodes
+            )
+        return container_input_dict
+
+    def get_container_input_json(self):
+        """
+        Return an iterator over the JSON representation of
+        get_container_input_dict() that serializes the information about all
+        of the DataSet's Nodes one Solr page at a time, so that large
+        DataSets can be streamed to containers without loading them at once
+        """
+        # evaluated right away so that errors (e.g., input Nodes without
+        # valid urls or Solr being unavailable) are raised before the
+        # response is started
+        container_input_json = json.dumps(
+            self._get_container_input_base_dict()
+        )
+        pages = self._get_all_detailed_node_pages()
+        first_page = next(pages, {})
+
+        def stream():
+            yield "{}, {}: {{".format(container_input_json[:-1],
+                                      json.dumps(self.ALL_NODE_INFORMATION))
+            separator = ""
+            detailed_nodes = first_page
+            while detailed_nodes:
+                yield separator + ", ".join(
+                    "{}: {}".format(json.dumps(node_uuid),
+                                    json.dumps(detailed_node))
+                    for node_uuid, detailed_node in detailed_nodes.iteritems()
+                )
+                separator = ", "
+                try:
+                    detailed_nodes = next(pages, {})
+                except Exception as exc:
+                    # the response has been started: end it without closing
+                    # the JSON object so that it can not be parsed
+                    logger.error("Failed to stream the Nodes of the "
+                                 "container input of VisualizationTool "
+                                 "'%s': %s", self.uuid, exc)
+                    return
+            yield "}}"
+        return stream()
+
+    def _get_container_input_base_dict(self):
         return {
             self.API_PREFIX: self.get_relative_container_url() + "/",
             self.FILE_RELATIONSHIPS: self.get_file_relationships_urls(),
@@ -503,15 +653,19 @@ class VisualizationTool(Tool):
                 self.get_input_node_uuids(),
                 require_valid_urls=True  # Tool input nodes need valid urls
             ),
-            # TODO: adding all of a DataSet's Node info seems excessive. Would
-            #  be great if we had a VisualizationTool using all of this info
-            self.ALL_NODE_INFORMATION: self._get_detailed_nodes_dict(
-                self.dataset.get_node_uuids()
-            ),
             ToolDefinition.EXTRA_DIRECTORIES:
                 self.tool_definition.get_extra_directories()
         }
 
+    def _get_all_detailed_node_pages(self):
+        # TODO: adding all of a DataSet's Node info seems excessive. Would
+        #  be great if we had a VisualizationTool using all of this info
+        return self._get_detailed_node_pages(
+            get_solr_terms_query(
+                "assay_uuid", [self.dataset.get_latest_assay().uuid]
+            )
+        )
+
     def _check_input_node_limit(self):
         if len(self.get_input_node_uuids()) > \
                 constants.REFINERY_SOLR_DOC_LIMIT:
@@ -544,19 +698,34 @@ class VisualizationTool(Tool):
             - Whatever we have in our Solr index for a given Node
             - A full url pointing to our Node's FileStoreItem's datafile
         """
-        solr_response_json = get_solr_response_json(node_uuid_list)
-        node_info = {
-            node["uuid"]: {
-                self.NODE_SOLR_INFO: node,
-                self.FILE_URL: get_file_url_from_node_uuid(
-                    node["uuid"],
-                    require_valid_url=require_valid_urls
-                )
-            }
-            for node in solr_response_json["nodes"]
-        }
+        node_uuid_list = list(node_uuid_list)
+        node_info = {}
+        if node_uuid_list:
+            for detailed_nodes in self._get_detailed_node_pages(
+                    get_solr_terms_query("uuid", node_uuid_list),
+                    require_valid_urls=require_valid_urls):
+                node_info.update(detailed_nodes)
         return node_info
 
+    def _get_detailed_node_pages(self, solr_filter, require_valid_urls=False):
+        """
+        Yield dicts with detailed information about the Nodes matching
+        `solr_filter`, one page of Solr results at a time, with the file urls
+        of each page resolved in bulk
+        """
+        for solr_nodes in get_solr_node_pages(solr_filter):
+            node_files = get_node_files(
+                [node["uuid"] for node in solr_nodes],
+                require_valid_urls=require_valid_urls
+            )
+            yield {
+                node["uuid"]: {
+                    self.NODE_SOLR_INFO: node,
+                    self.FILE_URL: node_files[node["uuid"]]["url"]
+                }
+                for node in solr_nodes
+            }
+
     def _get_visualization_parameters(self):
         tool_parameters = []
 
@@ -660,6 +829,13 @@ class WorkflowTool(Tool):
     def galaxy_instance(self):
         return self.analysis.workflow.workflow_engine.instance
 
+    @cached_property
+    def galaxy_request_pool(self):
+        """Parallel requests and response cache for the Galaxy metadata
+        (Jobs, Datasets, invocation and Workflow) of this analysis
+        """
+        return GalaxyRequestPool(self.galaxy_connection)
+
     @property
     def galaxy_collection_type(self, nesting_string=""):
         """
@@ -1010,7 +1186,7 @@ class WorkflowTool(Tool):
         ]
 
         history_file_list = self.galaxy_instance.get_history_file_list(
-            self.analysis.history_id
+            self.analysis.history_id, request_pool=self.galaxy_request_pool
         )
         retained_download_list = [
             galaxy_dataset for galaxy_dataset in history_file_list
@@ -1020,10 +1196,22 @@ class WorkflowTool(Tool):
             "There should be at least one dataset to download from Galaxy."
         return retained_download_list
 
+    @handle_bioblend_exceptions
+    def _fetch_galaxy_dataset_jobs(self, galaxy_datasets):
+        """Fetch the creating Jobs of Galaxy Datasets at once instead of one
+        after another (see _get_galaxy_dataset_job)
+        """
+        self.galaxy_request_pool.map(
+            "jobs", "show_job",
+            [(galaxy_dataset[self.CREATING_JOB],)
+             for galaxy_dataset in galaxy_datasets]
+        )
+        return True
+
     @handle_bioblend_exceptions
     def _get_galaxy_dataset_job(self, galaxy_dataset_dict):
-        return self.galaxy_connection.jobs.show_job(
-            galaxy_dataset_dict[self.CREATING_JOB]
+        return self.galaxy_request_pool.get(
+            "jobs", "show_job", galaxy_dataset_dict[self.CREATING_JOB]
         )
 
     @staticmethod
@@ -1037,9 +1225,9 @@ class WorkflowTool(Tool):
         return self.get_galaxy_dict()[self.GALAXY_TO_REFINERY_MAPPING_LIST]
 
     def get_galaxy_file_relationships(self):
-        return ast.literal_eval(
-            self.get_tool_launch_config(
-            )[self.GALAXY_DATA][self.FILE_RELATIONSHIPS_GALAXY]
+        return self._get_parsed_launch_config_value(
+            self.get_galaxy_dict()[self.FILE_RELATIONSHIPS_GALAXY],
+            parse_file_relationships
         )
 
     @handle_bioblend_exceptions
@@ -1075,7 +1263,10 @@ class WorkflowTool(Tool):
         explicitly exposed
         """
         exposed_galaxy_datasets = []
-        for galaxy_dataset in self._get_galaxy_history_dataset_list():
+        galaxy_datasets = self._get_galaxy_history_dataset_list()
+        if not self._fetch_galaxy_dataset_jobs(galaxy_datasets):
+            return exposed_galaxy_datasets  # the analysis was cancelled
+        for galaxy_dataset in galaxy_datasets:
             creating_job = self._get_galaxy_dataset_job(galaxy_dataset)
 
             # `tool_id` corresponds to the descriptive name of a galaxy
@@ -1131,7 +1322,8 @@ class WorkflowTool(Tool):
         """
         Fetch our Galaxy Workflow's invocation data.
         """
-        return self.galaxy_connection.workflows.show_invocation(
+        return self.galaxy_request_pool.get(
+            "workflows", "show_invocation",
             self.galaxy_workflow_history_id,
             self.get_galaxy_dict()[self.GALAXY_WORKFLOW_INVOCATION_DATA]["id"]
         )
@@ -1215,7 +1407,8 @@ class WorkflowTool(Tool):
 
     @handle_bioblend_exceptions
     def _get_workflow_dict(self):
-        return self.galaxy_connection.workflows.export_workflow_dict(
+        return self.galaxy_request_pool.get(
+            "workflows", "export_workflow_dict",
             self.get_workflow_internal_id()
         )
 
@@ -9,8 +9,10 @@ import uuid
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.management import CommandError, call_command
+from django.db import connection
 from django.http import HttpResponseBadRequest
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 import bioblend
 from bioblend.galaxy.dataset_collections import (CollectionElement,
@@ -43,7 +45,7 @@ from test_data.galaxy_mocks import (galaxy_dataset_provenance_0,
                                     library_dataset_dict, library_dict)
 
 from analysis_manager.models import AnalysisStatus
-from analysis_manager.tasks import (_galaxy_file_import,
+from analysis_manager.tasks import (AnalysisPending, _galaxy_file_import,
                                     _get_galaxy_download_task_ids,
                                     _get_workflow_tool,
                                     _invoke_galaxy_workflow,
@@ -69,7 +71,8 @@ from tool_manager.tasks import django_docker_cleanup
 
 from .models import (FileRelationship, GalaxyParameter, InputFile, Parameter,
                      Tool, ToolDefinition, VisualizationTool,
-                     VisualizationToolError, WorkflowTool)
+                     VisualizationToolError, WorkflowTool,
+                     parse_file_relationships)
 from .utils import (FileTypeValidationError, create_tool,
                     create_tool_definition, get_workflows,
                     user_has_access_to_tool, validate_tool_annotation,
@@ -372,7 +375,8 @@ class ToolManagerTestBase(ToolManagerMocks):
         )
 
         if tool_type == ToolDefinition.VISUALIZATION:
-            with mock.patch("tool_manager.models.get_solr_response_json"):
+            with mock.patch("tool_manager.models.get_solr_node_pages",
+                            return_value=[]):
                 if not start_vis_container:
                     run_container_mock.start()
 
@@ -1512,6 +1516,60 @@ class ToolTests(ToolManagerTestBase):
             ['http://www.example.com/test_file.txt']
         )
 
+    def test_input_nodes_are_fetched_in_bulk(self):
+        self.create_tool(ToolDefinition.VISUALIZATION,
+                         file_relationships=self.LIST)
+        with self.assertNumQueries(1):
+            tool_nodes = self.tool._get_input_nodes()
+        self.assertEqual([node.uuid for node in tool_nodes],
+                         self.tool.get_input_node_uuids())
+
+    def test_update_file_relationships_with_urls_query_count(self):
+        self.create_tool(ToolDefinition.VISUALIZATION,
+                         file_relationships=self.LIST)
+        with CaptureQueriesContext(connection) as list_queries:
+            self.tool.update_file_relationships_with_urls()
+        self.create_tool(
+            ToolDefinition.VISUALIZATION,
+            create_unique_name=True,
+            file_relationships="[{}]".format(
+                ", ".join(self.make_node() for i in range(20))
+            )
+        )
+        with CaptureQueriesContext(connection) as long_list_queries:
+            self.tool.update_file_relationships_with_urls()
+        self.assertEqual(len(long_list_queries), len(list_queries))
+        self.assertEqual(len(self.tool.get_file_relationships_urls()), 20)
+        self.assertEqual(len(self.tool.get_input_file_uuid_list()), 20)
+
+    def test_tool_launch_config_is_parsed_once(self):
+        self.create_tool(ToolDefinition.WORKFLOW)
+        tool = WorkflowTool.objects.get(uuid=self.tool.uuid)
+        with mock.patch("tool_manager.models.json.loads",
+                        wraps=json.loads) as json_loads_mock:
+            for i in range(3):
+                tool.get_input_file_uuid_list()
+                tool.get_input_node_uuids()
+                tool.get_file_relationships_urls()
+                tool.get_galaxy_file_relationships()
+                tool.get_galaxy_import_tasks()
+        self.assertEqual(json_loads_mock.call_count, 1)
+
+    def test_set_tool_launch_config_replaces_parsed_config(self):
+        self.create_tool(ToolDefinition.WORKFLOW)
+        tool_launch_config = self.tool.get_tool_launch_config()
+        self.assertEqual(self.tool.get_file_relationships_urls(),
+                         ['http://www.example.com/test_file.txt'])
+        tool_launch_config[Tool.FILE_RELATIONSHIPS_URLS] = (
+            "[('http://www.example.com/a.txt', "
+            "'http://www.example.com/b.txt')]"
+        )
+        self.tool.set_tool_launch_config(tool_launch_config)
+        self.assertEqual(
+            self.tool.get_file_relationships_urls(),
+            [('http://www.example.com/a.txt', 'http://www.example.com/b.txt')]
+        )
+
     def test_update_galaxy_data(self):
         self.create_tool(ToolDefinition.WORKFLOW)
         self.tool.update_galaxy_data("test", "data")
@@ -1754,8 +1812,21 @@ class WorkflowToolTests(ToolManagerTestBase):
             galaxy_dataset_provenance_0, galaxy_dataset_provenance_0,
             galaxy_dataset_provenance_1, galaxy_dataset_provenance_1
         ]
-        self.show_job_side_effect = [galaxy_job_a, galaxy_job_a,
-                                     galaxy_job_b, galaxy_job_b]
+        # Galaxy Jobs and Datasets are requested in parallel (and only
+        # once), so their mocks respond by ID rather than by call order
+        galaxy_jobs = {job["id"]: job for job in [galaxy_job_a, galaxy_job_b]}
+        self.show_job_side_effect = lambda job_id: galaxy_jobs[job_id]
+
+    @staticmethod
+    def _show_dataset_side_effect(history_contents, galaxy_datasets):
+        galaxy_datasets_by_id = {
+            history_content_entry["id"]: galaxy_dataset
+            for history_content_entry, galaxy_dataset
+            in zip(history_contents, galaxy_datasets)
+        }
+        return lambda history_id, dataset_id: galaxy_datasets_by_id[
+            dataset_id
+        ]
 
     def _assert_analysis_node_connection_outputs_validity(self):
         input_connection = AnalysisNodeConnection.objects.filter(
@@ -2089,6 +2160,17 @@ class WorkflowToolTests(ToolManagerTestBase):
         )
         self.assertTrue(galaxy_datasets_list_mock.called)
 
+    def test__get_exposed_galaxy_datasets_cancels_analysis_on_job_error(
+            self):
+        self.galaxy_datasets_list_mock.start()
+        self.show_job_mock.side_effect = bioblend.ConnectionError(
+            "Bad connection"
+        )
+        self.create_tool(ToolDefinition.WORKFLOW)
+        with mock.patch.object(self.tool.analysis, "cancel") as cancel_mock:
+            self.assertEqual(self.tool._get_exposed_galaxy_datasets(), [])
+        cancel_mock.assert_called_once_with()
+
     def test__get_workflow_step(self):
         galaxy_datasets_list_mock = self.galaxy_datasets_list_mock.start()
         self.create_tool(ToolDefinition.WORKFLOW)
@@ -2117,7 +2199,7 @@ class WorkflowToolTests(ToolManagerTestBase):
         self.show_dataset_provenance_mock.side_effect = (
             self.show_dataset_provenance_side_effect * 3
         )
-        self.show_job_mock.side_effect = self.show_job_side_effect * 3
+        self.show_job_mock.side_effect = self.show_job_side_effect
         self.create_tool(ToolDefinition.WORKFLOW,
                          file_relationships=self.LIST_BASIC)
         self.tool.create_analysis_output_node_connections()
@@ -2443,20 +2525,24 @@ class WorkflowToolTests(ToolManagerTestBase):
             self.assertFalse(analysis_node_connections[index].is_refinery_file)
 
     def _create_analysis_node_connections_wrapper(self):
-        self.show_job_mock.side_effect = self.show_job_side_effect * 3
+        self.show_job_mock.side_effect = self.show_job_side_effect
         self.tool.create_analysis_output_node_connections()
 
     def _get_galaxy_download_list_wrapper(self,
                                           datasets_have_same_names=False):
-        self.show_job_mock.side_effect = [galaxy_job_a, galaxy_job_a,
-                                          galaxy_job_b, galaxy_job_b,
-                                          galaxy_job_a, galaxy_job_a]
+        self.show_job_mock.side_effect = self.show_job_side_effect
         if datasets_have_same_names:
             self.show_dataset_mock.side_effect = (
-                galaxy_datasets_list_same_output_names
+                self._show_dataset_side_effect(
+                    galaxy_history_contents_same_names,
+                    galaxy_datasets_list_same_output_names
+                )
             )
         else:
-            self.show_dataset_mock.side_effect = galaxy_datasets_list
+            self.show_dataset_mock.side_effect = (
+                self._show_dataset_side_effect(galaxy_history_contents,
+                                               galaxy_datasets_list)
+            )
 
         return self.tool.get_galaxy_dataset_download_list()
 
@@ -2609,10 +2695,10 @@ class WorkflowToolTests(ToolManagerTestBase):
 
     def test_get_galaxy_dataset_download_list(self):
         self.galaxy_datasets_list_mock.start()
-        self.show_job_mock.side_effect = [galaxy_job_a, galaxy_job_a,
-                                          galaxy_job_b, galaxy_job_b,
-                                          galaxy_job_a, galaxy_job_a]
-        self.show_dataset_mock.side_effect = galaxy_datasets_list
+        self.show_job_mock.side_effect = self.show_job_side_effect
+        self.show_dataset_mock.side_effect = self._show_dataset_side_effect(
+            galaxy_history_contents, galaxy_datasets_list
+        )
 
         self.create_tool(ToolDefinition.WORKFLOW)
         self.assertEqual(
@@ -2621,7 +2707,7 @@ class WorkflowToolTests(ToolManagerTestBase):
         )
 
     def test__get_creating_job_output_name(self):
-        self.show_job_mock.side_effect = [galaxy_job_a, galaxy_job_b]
+        self.show_job_mock.side_effect = self.show_job_side_effect
         self.create_tool(ToolDefinition.WORKFLOW)
 
         creating_job_output_name_a = self.tool._get_creating_job_output_name(
@@ -2640,7 +2726,7 @@ class WorkflowToolTests(ToolManagerTestBase):
         )
 
     def test__get_creating_job_output_name_reliance(self):
-        self.show_job_mock.side_effect = [galaxy_job_a]
+        self.show_job_mock.return_value = galaxy_job_a
         self.create_tool(ToolDefinition.WORKFLOW)
 
         with self.assertRaises(AssertionError) as context:
@@ -2841,7 +2927,8 @@ class ToolAPITests(APITestCase, ToolManagerTestBase):
         # Relaunch Tool
         get_request = self.factory.get(self.tool.relaunch_url)
         force_authenticate(get_request, self.user)
-        with mock.patch("tool_manager.models.get_solr_response_json"):
+        with mock.patch("tool_manager.models.get_solr_node_pages",
+                        return_value=[]):
             get_response = self.tool_relaunch_view(
                 get_request,
                 uuid=self.tool.uuid
@@ -3030,16 +3117,56 @@ class ToolAPITests(APITestCase, ToolManagerTestBase):
     def test_get_container_input_data_detail_route(self):
         self.create_tool(ToolDefinition.VISUALIZATION)
         get_request = self.factory.get(self.tool.container_input_json_url)
-        with mock.patch("tool_manager.models.get_solr_response_json"):
+        with mock.patch(
+            "data_set_manager.utils.search_solr",
+            return_value=self.create_solr_mock_response(
+                self.tool.dataset.get_nodes()
+            )
+        ):
             get_response = self.tool_container_input_data_view(
                 get_request,
                 uuid=self.tool.uuid
             )
             self.assertEqual(
-                json.loads(get_response.content),
+                json.loads("".join(get_response.streaming_content)),
                 self.tool.get_container_input_dict()
             )
 
+    def test_get_container_input_data_detail_route_solr_error(self):
+        self.create_tool(ToolDefinition.VISUALIZATION)
+        get_request = self.factory.get(self.tool.container_input_json_url)
+        with mock.patch("tool_manager.models.get_solr_node_pages",
+                        side_effect=RuntimeError("Solr is unavailable")):
+            get_response = self.tool_container_input_data_view(
+                get_request,
+                uuid=self.tool.uuid
+            )
+        self.assertEqual(get_response.status_code, 500)
+
+    def test_get_container_input_data_detail_route_later_page_error(self):
+        self.create_tool(ToolDefinition.VISUALIZATION)
+
+        def detailed_node_pages():
+            yield {"node-uuid": {"file_url": None}}
+            raise RuntimeError("Solr is unavailable")
+
+        get_request = self.factory.get(self.tool.container_input_json_url)
+        with mock.patch.object(
+            VisualizationTool, "_get_container_input_base_dict",
+            return_value={"api_prefix": "/"}
+        ), mock.patch.object(
+            VisualizationTool, "_get_all_detailed_node_pages",
+            side_effect=detailed_node_pages
+        ):
+            get_response = self.tool_container_input_data_view(
+                get_request,
+                uuid=self.tool.uuid
+            )
+            self.assertEqual(get_response.status_code, 200)
+            content = "".join(get_response.streaming_content)
+        self.assertIn("node-uuid", content)
+        self.assertRaises(ValueError, json.loads, content)
+
     def test_get_container_input_data_detail_route_bad_uuid(self):
         self.create_tool(ToolDefinition.VISUALIZATION)
         get_request = self.factory.get(self.tool.container_input_json_url)
@@ -3097,18 +3224,19 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
                        return_value=True)
     @mock.patch.object(celery.result.TaskSetResult, "ready",
                        return_value=True)
-    @mock.patch.object(run_analysis, "retry", side_effect=None)
     def test_get_input_file_uuid_list_gets_called_in_refinery_import(
-            self, retry_mock, ready_mock, successful_mock
+            self, ready_mock, successful_mock
     ):
         self.create_tool(ToolDefinition.WORKFLOW)
 
         with mock.patch(
             "tool_manager.models.Tool.get_input_file_uuid_list"
         ) as get_uuid_list_mock:
-            _refinery_file_import(self.tool.analysis.uuid)
+            with self.assertRaises(AnalysisPending):
+                _refinery_file_import(self.tool.analysis.uuid)
             self.assertTrue(get_uuid_list_mock.called)
-        self.assertTrue(retry_mock.called)
+        # import tasks have been started, so the next run checks on them
+        _refinery_file_import(self.tool.analysis.uuid)
         self.assertTrue(ready_mock.called)
         self.assertTrue(successful_mock.called)
 
@@ -3202,15 +3330,10 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
         )
 
     @mock.patch("celery.task.sets.TaskSet.apply_async")
-    @mock.patch.object(celery.result.TaskSetResult, "ready",
-                       return_value=False)
     @mock.patch.object(AnalysisStatus, "set_galaxy_import_task_group_id")
-    @mock.patch.object(run_analysis, "retry")
     def test__run_galaxy_file_import_no_galaxy_import_task_group_id(
         self,
-        retry_mock,
         set_galaxy_import_task_group_id_mock,
-        ready_mock,
         apply_async_mock
     ):
         self.create_tool(ToolDefinition.WORKFLOW)
@@ -3219,7 +3342,8 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
         self.tool.update_galaxy_data(self.tool.GALAXY_LIBRARY_DICT,
                                      library_dict)
 
-        _run_galaxy_file_import(self.tool.analysis.uuid)
+        with self.assertRaises(AnalysisPending):
+            _run_galaxy_file_import(self.tool.analysis.uuid)
 
         self.assertEqual(len(self.tool.get_galaxy_import_tasks()), 1)
 
@@ -3240,11 +3364,7 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
         )
 
         self.assertTrue(apply_async_mock.called)
-        self.assertTrue(ready_mock.called)
-        self.assertTrue(self.analysis_manager_taskset_result_mock.called)
         self.assertTrue(set_galaxy_import_task_group_id_mock.called)
-        self.assertTrue(retry_mock.called)
-        self.assertEqual(retry_mock.call_count, 2)
 
     @mock.patch.object(celery.result.TaskSetResult, "ready",
                        return_value=True)
@@ -3319,15 +3439,10 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
         )
 
     @mock.patch("celery.task.sets.TaskSet.apply_async")
-    @mock.patch.object(celery.result.TaskSetResult, "ready",
-                       return_value=False)
     @mock.patch.object(AnalysisStatus, "set_galaxy_workflow_task_group_id")
-    @mock.patch.object(run_analysis, "retry")
     def test__run_galaxy_workflow_no_galaxy_workflow_task_group_id(
         self,
-        retry_mock,
         set_galaxy_workflow_task_group_id_mock,
-        ready_mock,
         apply_async_mock
     ):
         self.create_tool(ToolDefinition.WORKFLOW)
@@ -3335,7 +3450,8 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
             "tool_manager.models.WorkflowTool."
             "update_file_relationships_with_galaxy_history_data",
         ) as update_file_relationships_with_galaxy_history_data_mock:
-            _run_galaxy_workflow(self.tool.analysis.uuid)
+            with self.assertRaises(AnalysisPending):
+                _run_galaxy_workflow(self.tool.analysis.uuid)
 
         self.assertTrue(
             update_file_relationships_with_galaxy_history_data_mock.called
@@ -3346,11 +3462,7 @@ class WorkflowToolLaunchTests(ToolManagerTestBase):
         self.assertEqual(analysis_status.galaxy_history_state,
                          AnalysisStatus.PROGRESS)
         self.assertTrue(apply_async_mock.called)
-        self.assertTrue(ready_mock.called)
-        self.assertTrue(self.analysis_manager_taskset_result_mock.called)
         self.assertTrue(set_galaxy_workflow_task_group_id_mock.called)
-        self.assertTrue(retry_mock.called)
-        self.assertEqual(retry_mock.call_count, 2)
 
     @mock.patch.object(celery.result.TaskSetResult, "ready",
                        return_value=True)
@@ -3904,6 +4016,38 @@ class ToolManagerUtilitiesTests(ToolManagerTestBase):
         self.assertFalse(user_has_access_to_tool(self.user2, self.tool))
 
 
+class ParseFileRelationshipsTests(TestCase):
+    def test_parse_file_relationships_matches_literal_eval(self):
+        for file_relationships in [
+            "['a']",
+            "['a', 'b', 'c']",
+            "[['a', 'b'], ['c', 'd']]",
+            "[('a', 'b'), ('c', 'd')]",
+            "(['a', 'b'], ['c', 'd'])",
+            "[[('a', 'b'), ('c', 'd')]]",
+            "[ ( 'a' ,'b' , ) ] ",
+            "('a')",
+            "('a',)",
+            "[]",
+            '[{"refinery_file_uuid": "a", "analysis_group": 0}, '
+            '{"refinery_file_uuid": "b", "analysis_group": 1}]'
+        ]:
+            self.assertEqual(parse_file_relationships(file_relationships),
+                             ast.literal_eval(file_relationships))
+
+    def test_parse_file_relationships_returns_str(self):
+        self.assertEqual(
+            [type(url) for url in parse_file_relationships(u"['a', 'b']")],
+            [str, str]
+        )
+
+    def test_parse_file_relationships_with_invalid_input(self):
+        for file_relationships in ["", "[a, b]", "['a', 'b'", "['a' 'b']",
+                                   "['a'] ['b']", "['a)", "[('a', 'b']"]:
+            with self.assertRaises(ValueError):
+                parse_file_relationships(file_relationships)
+
+
 class ParameterTests(TestCase):
     def test_cast_param_value_to_proper_type_bool(self):
         test_bools = [True, False]
@@ -3,7 +3,8 @@ import urllib2
 
 from django.conf import settings
 from django.db import transaction
-from django.http import (HttpResponseBadRequest, JsonResponse)
+from django.http import (HttpResponseBadRequest, HttpResponseServerError,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render
 
 from django_docker_engine.proxy import Proxy
@@ -202,7 +203,14 @@ class ToolsViewSet(ToolManagerViewSetBase):
     def container_input_data(self, request, *args, **kwargs):
         tool_uuid = kwargs.get("uuid")
         tool = get_object_or_404(VisualizationTool, uuid=tool_uuid)
-        return JsonResponse(tool.get_container_input_dict())
+        try:
+            container_input_json = tool.get_container_input_json()
+        except Exception as exc:
+            logger.error("Failed to get the container input of "
+                         "VisualizationTool '%s': %s", tool_uuid, exc)
+            return HttpResponseServerError(exc)
+        return StreamingHttpResponse(container_input_json,
+                                     content_type="application/json")
 
 
 class AutoRelaunchProxy(Proxy, object):
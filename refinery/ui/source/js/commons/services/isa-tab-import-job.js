@@ -0,0 +1,49 @@
+'use strict';
+
+function IsaTabImportJobFactory ($http, $q, $timeout) {
+  var POLL_INTERVAL = 2000;  // ms
+
+  /**
+   * Poll an ISA-Tab import job until the data set is imported or the import
+   * failed.
+   *
+   * @param   {String}    importJobUrl  `import_job_url` of the response that
+   *   started the import.
+   * @param   {Function}  onPhase       Optional, called with the job every
+   *   time it was polled.
+   * @return  {Object}                  Promise resolved with the job once
+   *   it succeeded, rejected with `{ data: <message> }` if it failed.
+   */
+  function wait (importJobUrl, onPhase) {
+    return $http
+      .get(importJobUrl)
+      .then(function (response) {
+        var importJob = response.data;
+        if (onPhase) {
+          onPhase(importJob);
+        }
+        if (importJob.phase === 'SUCCESS') {
+          return importJob;
+        }
+        if (importJob.phase === 'FAILURE') {
+          return $q.reject({ data: importJob.message });
+        }
+        return $timeout(function () {
+          return wait(importJobUrl, onPhase);
+        }, POLL_INTERVAL);
+      });
+  }
+
+  return {
+    wait: wait
+  };
+}
+
+angular
+  .module('refineryApp')
+  .factory('isaTabImportJobService', [
+    '$http',
+    '$q',
+    '$timeout',
+    IsaTabImportJobFactory
+  ]);
@@ -0,0 +1,64 @@
+'use strict';
+
+describe('Common.service.isaTabImportJobService: unit tests', function () {
+  var $httpBackend;
+  var $timeout;
+  var service;
+  var jobUrl = '/data_set_manager/import/isa-tab-jobs/x508x83x/';
+
+  beforeEach(function () {
+    module('refineryApp');
+
+    inject(function ($injector) {
+      $httpBackend = $injector.get('$httpBackend');
+      $timeout = $injector.get('$timeout');
+      service = $injector.get('isaTabImportJobService');
+    });
+  });
+
+  afterEach(function () {
+    $httpBackend.verifyNoOutstandingExpectation();
+    $httpBackend.verifyNoOutstandingRequest();
+  });
+
+  it('should be available', function () {
+    expect(!!service).toEqual(true);
+  });
+
+  it('should poll the job until it succeeded', function () {
+    var importJob;
+    var phases = [];
+
+    $httpBackend.expectGET(jobUrl).respond(200, { phase: 'PARSE' });
+    service
+      .wait(jobUrl, function (job) {
+        phases.push(job.phase);
+      })
+      .then(function (job) {
+        importJob = job;
+      });
+    $httpBackend.flush();
+    expect(importJob).toBeUndefined();
+
+    $httpBackend.expectGET(jobUrl).respond(
+      200, { phase: 'SUCCESS', data_set_uuid: 'x9xx' }
+    );
+    $timeout.flush();
+    $httpBackend.flush();
+    expect(importJob.data_set_uuid).toEqual('x9xx');
+    expect(phases).toEqual(['PARSE', 'SUCCESS']);
+  });
+
+  it('should reject with the message of a failed job', function () {
+    var error;
+
+    $httpBackend.expectGET(jobUrl).respond(
+      200, { phase: 'FAILURE', message: 'Bad archive' }
+    );
+    service.wait(jobUrl).catch(function (response) {
+      error = response.data;
+    });
+    $httpBackend.flush();
+    expect(error).toEqual('Bad archive');
+  });
+});
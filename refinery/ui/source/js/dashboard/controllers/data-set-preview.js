@@ -20,6 +20,7 @@ function DataSetPreviewCtrl (
   dashboardExpandablePanelService,
   dataSetPermsService,
   dataSetTakeOwnershipService,
+  isaTabImportJobService,
   dashboardDataSetsReloadService,
   filesize,
   DashboardIntrosDataSetSummary,
@@ -43,6 +44,7 @@ function DataSetPreviewCtrl (
   this.dashboardExpandablePanelService = dashboardExpandablePanelService;
   this.dataSetPermsService = dataSetPermsService;
   this.dataSetTakeOwnershipService = dataSetTakeOwnershipService;
+  this.isaTabImportJobService = isaTabImportJobService;
   this.dashboardDataSetsReloadService = dashboardDataSetsReloadService;
   this.permissionService = permissionService;
   this.filesize = filesize;
@@ -267,13 +269,17 @@ DataSetPreviewCtrl.prototype.importDataSet = function () {
         data_set_uuid: dataSetUuid
       })
       .$promise
-      .then(function (data) {
+      .then(function (response) {
+        // the data set is imported by an import job in the background
+        return self.isaTabImportJobService.wait(response.data.import_job_url);
+      })
+      .then(function (importJob) {
         self.importStatus[dataSetUuid] = { isDataSetReImportSuccess: true };
         self.dashboardDataSetsReloadService.reload(true);
-        self.dashboardDataSetPreviewService.preview(data.new_data_set_uuid);
+        self.dashboardDataSetPreviewService.preview(importJob.data_set_uuid);
       })
       .catch(function (error) {
-        self.importStatus[this.dataSetDetails.uuid] = { isDataSetReImportFail: true };
+        self.importStatus[dataSetUuid] = { isDataSetReImportFail: true };
         self.$log.error(error);
       })
       .finally(function () {
@@ -452,6 +458,7 @@ angular
     'dashboardExpandablePanelService',
     'dataSetPermsService',
     'dataSetTakeOwnershipService',
+    'isaTabImportJobService',
     'dashboardDataSetsReloadService',
     'filesize',
     'DashboardIntrosDataSetSummary',
@@ -8,7 +8,8 @@ function AboutDetailsCtrl (
   dataSetAboutFactory,
   dataSetPermsService,
   dataSetTakeOwnershipService,
-  fileRelationshipService
+  fileRelationshipService,
+  isaTabImportJobService
   ) {
   var vm = this;
   vm.loggedIn = typeof $window.djangoApp !== 'undefined' &&
@@ -37,7 +38,10 @@ function AboutDetailsCtrl (
     vm.dataSetImportStatus = 'RUNNING';
     dataSetTakeOwnershipService.save({
       data_set_uuid: dataSetUuid
-    }).$promise.then(function () {
+    }).$promise.then(function (response) {
+      // the data set is imported by an import job in the background
+      return isaTabImportJobService.wait(response.data.import_job_url);
+    }).then(function () {
       vm.dataSetImportStatus = 'SUCCESS';
     }, function (error) {
       $log.error(error);
@@ -138,5 +142,6 @@ angular
     'dataSetPermsService',
     'dataSetTakeOwnershipService',
     'fileRelationshipService',
+    'isaTabImportJobService',
     AboutDetailsCtrl
   ]);
@@ -134,4 +134,45 @@ describe('Controller: DetailsCtrl', function () {
       expect(mockUpdate).toEqual(true);
     });
   });
+
+  describe('importDataSet', function () {
+    var $q;
+    var $rootScope;
+    var importJobService;
+    var takeOwnershipService;
+
+    beforeEach(inject(function (
+      _$q_, _$rootScope_, isaTabImportJobService, dataSetTakeOwnershipService
+    ) {
+      $q = _$q_;
+      $rootScope = _$rootScope_;
+      importJobService = isaTabImportJobService;
+      takeOwnershipService = dataSetTakeOwnershipService;
+      spyOn(takeOwnershipService, 'save').and.returnValue({
+        $promise: $q.resolve({
+          data: { import_job_url: '/data_set_manager/import/isa-tab-jobs/x/' }
+        })
+      });
+    }));
+
+    it('waits for the import job to finish', function () {
+      spyOn(importJobService, 'wait').and.returnValue($q.resolve({}));
+      ctrl.importDataSet('fakeUuid');
+      expect(ctrl.dataSetImportStatus).toEqual('RUNNING');
+      $rootScope.$apply();
+      expect(importJobService.wait).toHaveBeenCalledWith(
+        '/data_set_manager/import/isa-tab-jobs/x/'
+      );
+      expect(ctrl.dataSetImportStatus).toEqual('SUCCESS');
+    });
+
+    it('reports a failed import job', function () {
+      spyOn(importJobService, 'wait').and.returnValue(
+        $q.reject({ data: 'Bad archive' })
+      );
+      ctrl.importDataSet('fakeUuid');
+      $rootScope.$apply();
+      expect(ctrl.dataSetImportStatus).toEqual('FAIL');
+    });
+  });
 });
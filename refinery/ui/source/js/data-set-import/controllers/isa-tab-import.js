@@ -6,15 +6,25 @@
     .controller('IsaTabImportCtrl', IsaTabImportCtrl);
 
   IsaTabImportCtrl.$inject = [
-    '$log', '$rootScope', '$timeout', '$window', 'isaTabImportApi', 'settings'
+    '$log',
+    '$rootScope',
+    '$timeout',
+    '$window',
+    'isaTabImportApi',
+    'isaTabImportJobService',
+    'settings'
   ];
 
-  function IsaTabImportCtrl ($log, $rootScope, $timeout, $window, isaTabImportApi, settings) {
+  function IsaTabImportCtrl (
+    $log, $rootScope, $timeout, $window, isaTabImportApi,
+    isaTabImportJobService, settings
+  ) {
     this.$log = $log;
     this.$rootScope = $rootScope;
     this.$timeout = $timeout;
     this.$window = $window;
     this.isaTabImportApi = isaTabImportApi;
+    this.isaTabImportJobService = isaTabImportJobService;
     this.settings = settings;
     this.showFileUpload = false;
 
@@ -86,7 +96,15 @@
       .create({}, formData)
       .$promise
       .then(function (response) {
-        self.importedDataSetUuid = response.data.new_data_set_uuid;
+        return self.isaTabImportJobService.wait(
+          response.data.import_job_url,
+          function (importJob) {
+            self.importPhase = importJob.phase_description;
+          }
+        );
+      })
+      .then(function (importJob) {
+        self.importedDataSetUuid = importJob.data_set_uuid;
         self.isSuccessfullyImported = true;
         self.$timeout(function () {
           self.$window.location.href = '/data_sets/' + self.importedDataSetUuid;
@@ -99,6 +117,7 @@
       })
       .finally(function () {
         self.isImporting = false;
+        self.importPhase = undefined;
       });
   };
 })();
@@ -88,6 +88,23 @@
       return $q.all([analysisPromise, filesPromise]);
     }
 
+    // Follows the next links of the paginated node API and calls back with
+    // all nodes of the study
+    function getNodes (url, nodes, callback) {
+      d3.json(url, function (error, data) {
+        if (error) {
+          callback(data);
+          return;
+        }
+        var allNodes = nodes.concat(data.objects);
+        if (data.meta.next) {
+          getNodes(data.meta.next, allNodes, callback);
+        } else {
+          callback({ meta: data.meta, objects: allNodes });
+        }
+      });
+    }
+
     function launchProvvis () {
       getData().then(function (response) {
         analysesList = response[0].objects;
@@ -114,7 +131,7 @@
         });
 
         /* Parse json. */
-        d3.json(url, function (error, data) {
+        getNodes(url, [], function (data) {
           /* Declare d3 specific properties. */
           var zoom = Object.create(null);
           var canvas = Object.create(null);
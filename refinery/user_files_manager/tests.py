@@ -1,12 +1,15 @@
-import json
 import logging
 from urlparse import urljoin
+import zlib
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
 from django.http import QueryDict
 from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from guardian.utils import get_anonymous_user
 import mock
@@ -15,11 +18,13 @@ from rest_framework.test import (APIRequestFactory, APITestCase,
                                  force_authenticate)
 
 import constants
-from data_set_manager.models import Assay
+from core.models import ExtendedGroup
+from data_set_manager.models import Assay, Study
 from data_set_manager.search_indexes import NodeIndex
 from factory_boy.utils import create_dataset_with_necessary_models
 
-from .utils import generate_solr_params_for_user
+from .utils import (generate_solr_params_for_user, get_readable_assay_uuids,
+                    get_solr_filters_for_user)
 from .views import UserFiles, user_files_csv
 
 logger = logging.getLogger(__name__)
@@ -76,13 +81,10 @@ class UserFilesUITests(StaticLiveServerTestCase):
 
 
 class UserFilesViewTests(TestCase):
-
-    @mock.patch('django.conf.settings.USER_FILES_COLUMNS', 'filename,fake')
-    def test_user_files_csv(self):
-        request = RequestFactory().get('/fake-url')
-        request.user = User.objects.create_user(
+    def setUp(self):
+        self.user = User.objects.create_user(
             'testuser', 'test@example.com', 'password')
-        mock_doc = {
+        self.mock_doc = {
             NodeIndex.DOWNLOAD_URL:
                 'fake-url',
             'filename_Characteristics' + NodeIndex.GENERIC_SUFFIX:
@@ -92,23 +94,89 @@ class UserFilesViewTests(TestCase):
             # Just want to exercise "_Characteristics" and "_Factor_Value":
             # Doesn't matter if the names are backwards.
         }
-        with mock.patch(
-            'user_files_manager.views._get_solr',
-            return_value=json.dumps({
-                'response': {
-                    'docs': [mock_doc]
-                }
-            })
-        ):
+        filters_patcher = mock.patch(
+            'user_files_manager.views.get_solr_filters_for_user',
+            return_value=['fake-filter']
+        )
+        self.get_filters_mock = filters_patcher.start()
+        self.addCleanup(filters_patcher.stop)
+
+    def _get_content(self, query_params={}, pages=None):
+        request = RequestFactory().get('/fake-url', query_params)
+        request.user = self.user
+        if pages is None:
+            pages = [[self.mock_doc]]
+        with mock.patch('user_files_manager.views.get_solr_node_pages',
+                        return_value=iter(pages)) as get_pages_mock:
             response = user_files_csv(request)
-            self.assertEqual(
-                response.content,
-                'url,filename,fake\r\n'
-                'fake-url,fake-filename,\r\n'
-            )
+            content = ''.join(response.streaming_content)
+        self.get_pages_mock = get_pages_mock
+        return response, content
+
+    @mock.patch('django.conf.settings.USER_FILES_COLUMNS', 'filename,fake')
+    def test_user_files_csv(self):
+        response, content = self._get_content()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            content,
+            'url,filename,fake\r\n'
+            'fake-url,fake-filename,\r\n'
+        )
+
+    @mock.patch('django.conf.settings.USER_FILES_COLUMNS', 'organism')
+    def test_user_files_csv_pages(self):
+        other_doc = {NodeIndex.DOWNLOAD_URL: 'other-url'}
+        response, content = self._get_content(
+            {'sort': 'name asc'},
+            pages=[[self.mock_doc, other_doc], [other_doc]]
+        )
+        self.assertEqual(
+            content,
+            'url,organism\r\n'
+            'fake-url,handles-unicode\r\n'
+            'other-url,\r\n'
+            'other-url,\r\n'
+        )
+        self.assertEqual(self.get_pages_mock.call_args[1]['sort'],
+                         'name asc')
+        self.assertIn('organism',
+                      self.get_pages_mock.call_args[1]['fields'])
+
+    @mock.patch('django.conf.settings.USER_FILES_COLUMNS', 'filename')
+    def test_user_files_tsv_gzip(self):
+        response, content = self._get_content(
+            {'format': 'tsv', 'gzip': 'true'}
+        )
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('user-files.tsv.gz', response['Content-Disposition'])
+        self.assertEqual(
+            zlib.decompress(content, 16 + zlib.MAX_WBITS),
+            'url\tfilename\r\n'
+            'fake-url\tfake-filename\r\n'
+        )
+
+    def test_user_files_csv_unknown_format(self):
+        request = RequestFactory().get('/fake-url', {'format': 'xlsx'})
+        request.user = self.user
+        self.assertEqual(user_files_csv(request).status_code, 400)
+
+    @mock.patch('django.conf.settings.USER_FILES_COLUMNS', 'filename')
+    def test_user_files_csv_without_readable_assays(self):
+        self.get_filters_mock.return_value = None
+        response, content = self._get_content()
+        self.assertEqual(content, 'url,filename\r\n')
+        self.assertFalse(self.get_pages_mock.called)
 
 
 class UserFilesUtilsTests(TestCase):
+    def setUp(self):
+        self.cache = LocMemCache('user-files', {})
+        for module in ('core.utils', 'user_files_manager.utils'):
+            cache_patcher = mock.patch(module + '.cache', self.cache)
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
+        self.user = User.objects.create_user(
+            'readable-assays-user', 'test@example.com', 'password')
 
     @override_settings(USER_FILES_FACETS="filetype,organism,technology,"
                                          "genotype,cell_type,antibody,"
@@ -122,7 +190,7 @@ class UserFilesUtilsTests(TestCase):
 
         query = generate_solr_params_for_user(QueryDict({}), user.id)
         self.assertItemsEqual(str(query).split('&'), [
-                         'fq=assay_uuid%3A%28{}%29'.format(assay_uuid),
+                         'fq=%7B!terms f=assay_uuid%7D{}'.format(assay_uuid),
                          'fl=%2A_generic_s'
                          '%2Cname'
                          '%2C%2A_uuid'
@@ -150,3 +218,69 @@ class UserFilesUtilsTests(TestCase):
                          'wt=json',
                          'facet=true',
                          'facet.limit=-1'])
+
+    def test_get_readable_assay_uuids(self):
+        dataset = create_dataset_with_necessary_models()
+        dataset.set_owner(self.user)
+        create_dataset_with_necessary_models()  # not readable
+        self.assertEqual(
+            get_readable_assay_uuids(self.user),
+            [Assay.objects.get(study=dataset.get_latest_study()).uuid]
+        )
+
+    def test_get_readable_assay_uuids_of_latest_version_only(self):
+        dataset = create_dataset_with_necessary_models(latest_version=2)
+        dataset.set_owner(self.user)
+        latest_study = dataset.get_latest_study()
+        Assay.objects.create(
+            study=Study.objects.exclude(id=latest_study.id).get(
+                investigation__investigationlink__data_set=dataset
+            )
+        )
+        self.assertEqual(get_readable_assay_uuids(self.user),
+                         [Assay.objects.get(study=latest_study).uuid])
+
+    def _count_queries(self):
+        self.cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            get_readable_assay_uuids(self.user)
+        return len(context.captured_queries)
+
+    def test_get_readable_assay_uuids_query_count(self):
+        create_dataset_with_necessary_models().set_owner(self.user)
+        query_count = self._count_queries()
+        for index in range(3):
+            create_dataset_with_necessary_models().set_owner(self.user)
+        self.assertEqual(self._count_queries(), query_count)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_readable_assay_uuids(self.user)), 4)
+
+    def test_get_readable_assay_uuids_after_share_and_unshare(self):
+        dataset = create_dataset_with_necessary_models()
+        group = ExtendedGroup.objects.create(name='Readable assays group')
+        group.user_set.add(self.user)
+        self.assertEqual(get_readable_assay_uuids(self.user), [])
+        dataset.share(group)
+        self.assertEqual(len(get_readable_assay_uuids(self.user)), 1)
+        dataset.unshare(group)
+        self.assertEqual(get_readable_assay_uuids(self.user), [])
+
+    def test_get_readable_assay_uuids_after_group_membership_change(self):
+        group = ExtendedGroup.objects.create(name='Readable assays group')
+        create_dataset_with_necessary_models().share(group)
+        self.assertEqual(get_readable_assay_uuids(self.user), [])
+        group.user_set.add(self.user)
+        self.assertEqual(len(get_readable_assay_uuids(self.user)), 1)
+
+    def test_get_solr_filters_for_user(self):
+        dataset = create_dataset_with_necessary_models()
+        dataset.set_owner(self.user)
+        assay_uuid = Assay.objects.get(study=dataset.get_latest_study()).uuid
+        self.assertEqual(
+            get_solr_filters_for_user({'fq': 'name:"a"'}, self.user.id),
+            ['{!terms f=assay_uuid}' + assay_uuid, 'is_annotation:false',
+             'name:"a"']
+        )
+
+    def test_get_solr_filters_for_user_without_assays(self):
+        self.assertIsNone(get_solr_filters_for_user({}, self.user.id))
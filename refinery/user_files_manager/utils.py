@@ -1,12 +1,66 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 from guardian.shortcuts import get_objects_for_user
 
-from core.utils import accept_global_perms
-from data_set_manager.models import Assay, Study
+from core.models import InvestigationLink
+from core.utils import accept_global_perms, get_resource_list_cache_key
 from data_set_manager.utils import generate_solr_params
 
 
+def _get_user(user_id):
+    try:
+        return User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return User.get_anonymous()
+
+
+def get_readable_assay_uuids(user):
+    """Returns the UUIDs of the assays of the latest versions of all DataSets
+    the user can read
+    Resolved with a single query and cached per user: the cache key is
+    namespaced by the DataSet generation counter, so it is dropped whenever a
+    DataSet is saved, deleted, shared or unshared or group memberships change
+    """
+    cache_key = '{}-assay-uuids'.format(
+        get_resource_list_cache_key(user.id, 'DataSet')
+    )
+    assay_uuids = cache.get(cache_key)
+    if assay_uuids is not None:
+        return assay_uuids
+
+    # will update to allow users to view read_meta datasets then we can
+    # update to use get_resources_for_user method in core/utils
+    datasets = get_objects_for_user(user,
+                                    'core.read_dataset',
+                                    accept_global_perms=accept_global_perms(
+                                        'dataset'
+                                    ))
+    links = InvestigationLink.objects.filter(
+        data_set__in=datasets
+    ).values_list(
+        'data_set_id', 'date', 'id', 'investigation__study__assay__uuid'
+    )
+
+    latest_links = {}  # DataSet ID -> (date, ID) of its latest link
+    link_assay_uuids = {}  # InvestigationLink ID -> assay UUIDs
+    for data_set_id, date, link_id, assay_uuid in links:
+        if (data_set_id not in latest_links or
+                latest_links[data_set_id] < (date, link_id)):
+            latest_links[data_set_id] = (date, link_id)
+        assay_uuid_list = link_assay_uuids.setdefault(link_id, [])
+        if assay_uuid is not None:
+            assay_uuid_list.append(assay_uuid)
+
+    assay_uuids = sorted(
+        assay_uuid
+        for date, link_id in latest_links.itervalues()
+        for assay_uuid in link_assay_uuids[link_id]
+    )
+    cache.set(cache_key, assay_uuids)
+    return assay_uuids
+
+
 def generate_solr_params_for_user(params, user_id):
     """Creates the encoded solr params limiting results to one user.
     Keyword Argument
@@ -24,36 +78,30 @@ def generate_solr_params_for_user(params, user_id):
         fq - filter query
      """
 
-    try:
-        user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        user = User.get_anonymous()
-
-    # will update to allow users to view read_meta datasets then we can
-    # update to use get_resources_for_user method in core/utils
-    datasets = get_objects_for_user(user,
-                                    'core.read_dataset',
-                                    accept_global_perms=accept_global_perms(
-                                        'dataset'
-                                    ))
-
-    assay_uuids = []
-    for dataset in datasets:
-        investigation_link = dataset.get_latest_investigation_link()
-        if investigation_link is None:
-            continue
-            # It's not an error not to have data,
-            # but there's nothing more to do here.
-        investigation = investigation_link.investigation
-
-        study_ids = Study.objects.filter(
-            investigation=investigation
-        ).values_list('id', flat=True)
+    return generate_solr_params(params,
+                                assay_uuids=get_readable_assay_uuids(
+                                    _get_user(user_id)
+                                ),
+                                facets_from_config=True,
+                                terms_filter=True)
 
-        assay_uuids += Assay.objects.filter(
-            study_id__in=study_ids
-        ).values_list('uuid', flat=True)
 
-    return generate_solr_params(params,
-                                assay_uuids=assay_uuids,
-                                facets_from_config=True)
+def get_solr_filters_for_user(params, user_id):
+    """Returns the Solr filter queries limiting Nodes to the files of one
+    user, like generate_solr_params_for_user but as a list for paging with
+    get_solr_node_pages, or None if the user can't read any assays
+    Params
+        is_annotation - metadata
+        fq - filter query
+    """
+    assay_uuids = get_readable_assay_uuids(_get_user(user_id))
+    if not assay_uuids:
+        return None
+    solr_filters = [
+        '{!terms f=assay_uuid}' + ','.join(assay_uuids),
+        'is_annotation:' + params.get('is_annotation', 'false')
+    ]
+    fq = params.get('fq')
+    if fq:
+        solr_filters.append(fq)
+    return solr_filters
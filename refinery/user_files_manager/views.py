@@ -1,9 +1,10 @@
 import csv
-from json import dumps, loads
+from json import dumps
 import logging
+import zlib
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
@@ -12,12 +13,19 @@ from rest_framework.views import APIView
 from unidecode import unidecode
 
 from data_set_manager.search_indexes import NodeIndex
-from data_set_manager.utils import format_solr_response, search_solr
+from data_set_manager.utils import (format_solr_response,
+                                    get_solr_node_pages, search_solr)
 
-from .utils import generate_solr_params_for_user
+from .utils import generate_solr_params_for_user, get_solr_filters_for_user
 
 logger = logging.getLogger(__name__)
 
+# delimiter and content type of the formats user_files_csv can export
+EXPORT_FORMATS = {
+    'csv': (',', 'text/csv'),
+    'tsv': ('\t', 'text/tab-separated-values')
+}
+
 
 def user_files(request):
     return render_to_response('core/user_files.html', {},
@@ -25,31 +33,83 @@ def user_files(request):
 
 
 def user_files_csv(request):
-    solr_response = _get_solr(request.GET, request.user.id)
+    """Streams a table of all files the user can read, paging through Solr
+    so that neither the number of rows nor the memory used is limited by
+    the size of the result
+    Params
+        fq - filter query
+        sort - Ordering include field name, whitespace, & asc or desc.
+        format - csv (default) or tsv
+        gzip - compress the table, true/false
+    """
+    export_format = request.GET.get('format', 'csv')
+    try:
+        delimiter, content_type = EXPORT_FORMATS[export_format]
+    except KeyError:
+        return HttpResponseBadRequest(
+            'Unknown format: {}'.format(export_format)
+        )
+    filename = 'user-files.' + export_format
+
+    content = _generate_user_files_table(request.GET, request.user.id,
+                                         delimiter)
+    if request.GET.get('gzip', 'false') == 'true':
+        content = _gzip(content)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment; filename="{}"'.format(filename)
+    return response
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="user-files.csv"'
 
-    cols = settings.USER_FILES_COLUMNS.split(',')
+class _Echo(object):
+    """File-like object handing back what csv.writer writes to it"""
+    def write(self, value):
+        return value
 
-    writer = csv.writer(response)
-    writer.writerow(['url'] + cols)
-    # DOWNLOAD_URL's internal solr name not good for end-user.
 
-    docs = loads(solr_response)['response']['docs']
-    for doc in docs:
-        row = [doc.get(NodeIndex.DOWNLOAD_URL) or '']
-        for col in cols:
-            possibly_unicode = (
-                doc.get(col + '_Characteristics_generic_s') or
-                doc.get(col + '_Factor_Value_generic_s') or
-                doc.get(col) or
-                ''
-            )
-            row.append(unidecode(possibly_unicode))
-        writer.writerow(row)
+def _generate_user_files_table(params, user_id, delimiter):
+    """Yields the table one chunk of rows per page of Solr documents"""
+    cols = settings.USER_FILES_COLUMNS.split(',')
 
-    return response
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+    # DOWNLOAD_URL's internal solr name not good for end-user.
+    yield writer.writerow(['url'] + cols)
+
+    solr_filters = get_solr_filters_for_user(params, user_id)
+    if solr_filters is None:
+        return
+    node_pages = get_solr_node_pages(
+        solr_filters, sort=params.get('sort'),
+        fields=[NodeIndex.DOWNLOAD_URL, '*' + NodeIndex.GENERIC_SUFFIX] + cols,
+        post=True
+    )
+    for docs in node_pages:
+        rows = []
+        for doc in docs:
+            row = [doc.get(NodeIndex.DOWNLOAD_URL) or '']
+            for col in cols:
+                possibly_unicode = (
+                    doc.get(col + '_Characteristics_generic_s') or
+                    doc.get(col + '_Factor_Value_generic_s') or
+                    doc.get(col) or
+                    ''
+                )
+                row.append(unidecode(possibly_unicode))
+            rows.append(writer.writerow(row))
+        yield ''.join(rows)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
 
 
 class UserFiles(APIView):
@@ -72,4 +132,5 @@ def _get_solr(params, user_id):
             }
         })
 
-    return search_solr(solr_params, 'data_set_manager')
+    # the assay filter of users with many data sets is too long for a URL
+    return search_solr(solr_params, 'data_set_manager', post=True)